@@ -0,0 +1,78 @@
+"""
+Load test of the monitoring API: dashboard requests (status and summaries
+of a few ranges) sent over keep-alive connections from client threads.
+Server and clients share one process, so one core.
+
+Run with `python -m benchmarks.api`.
+"""
+import http.client
+import threading
+import time
+
+from benchmarks.decode import get_raw_messages
+from consumer.api import initialize_response_cache, start_api_server
+from consumer.state import get_state_cache, initialize_state_cache
+from consumer.storage import MockedEventsStorage, get_storage, \
+    initialize_storage
+from schema_registry.batch import decode_batch
+from schema_registry.models import MonitoredEvent
+
+
+EVENTS = 10000
+CLIENTS = 4
+REQUESTS_PER_CLIENT = 2500
+PATHS = [
+    '/status',
+    '/summary',
+    '/summary?start=2020-12-13T00:00:00&end=2020-12-14T00:00:00',
+    '/summary?start=2020-12-13T10:00:00&end=2020-12-13T11:00:00'
+    '&resolution=minute',
+    '/events?limit=50',
+]
+
+
+def run_client(port: int, latencies: list):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    for i in range(REQUESTS_PER_CLIENT):
+        started_at = time.perf_counter()
+        connection.request('GET', PATHS[i % len(PATHS)])
+        response = connection.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        latencies.append(time.perf_counter() - started_at)
+    connection.close()
+
+
+def main():
+    batch = decode_batch(MonitoredEvent, get_raw_messages(EVENTS))
+    initialize_storage(MockedEventsStorage)
+    get_storage().write_batch(batch)
+    initialize_state_cache()
+    get_state_cache().update(batch)
+    initialize_response_cache()
+    server = start_api_server('127.0.0.1', 0)
+
+    latencies: list = []
+    clients = [
+        threading.Thread(
+            target=run_client, args=(server.server_address[1], latencies),
+        )
+        for _ in range(CLIENTS)
+    ]
+    started_at = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    seconds = time.perf_counter() - started_at
+    server.shutdown()
+    server.server_close()
+
+    latencies.sort()
+    print(f'requests: {len(latencies) / seconds:10.0f} requests/s')
+    print(f'     p50: {latencies[len(latencies) // 2] * 1e3:10.2f} ms')
+    print(f'     p99: {latencies[len(latencies) * 99 // 100] * 1e3:10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Content checks of a page with several required and forbidden patterns:
+`ContentMatcher` against a regex search per pattern and a single search
+of all patterns combined into one regex, with a search of one literal
+pattern as the baseline.
+
+Run with `python -m benchmarks.content [--size N]`.
+"""
+import argparse
+import random
+import re
+import timeit
+
+from typing import Callable, List, Optional
+
+from producer.content import ContentMatcher
+
+
+SIZE = 200 * 1024
+REPEAT = 20
+REQUIRED = ['Welcome', 'Sign (in|up)']
+FORBIDDEN = [
+    'Internal Server Error', 'Service Unavailable', '(?i:bad gateway)',
+    r'[Ee]rror \d{3}',
+]
+
+
+def get_body(size: int) -> str:
+    rng = random.Random(42)
+    words = [
+        'monitoring', 'status', 'service', 'available', 'latency', 'region',
+        'request', 'response', 'customer', 'dashboard', 'pricing', 'docs',
+    ]
+    text = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    # required patterns are found at the end of the page
+    return ' '.join(text) + ' Sign up Welcome'
+
+
+def measure(name: str, check: Callable[[], object]):
+    seconds = min(timeit.repeat(check, number=1, repeat=REPEAT))
+    print(f'{name:>20}: {seconds * 1000:8.2f}ms')
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=SIZE)
+    options = parser.parse_args(args)
+
+    body = get_body(options.size)
+    patterns = REQUIRED + FORBIDDEN
+    matcher = ContentMatcher(REQUIRED, FORBIDDEN)
+    assert matcher.match(body).is_ok
+    single = re.compile(REQUIRED[0])
+    regexes = [re.compile(pattern) for pattern in patterns]
+    combined = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+    print(f'{len(patterns)} patterns, body of {len(body)} characters')
+    measure('single pattern', lambda: single.search(body))
+    measure('regex per pattern', lambda: [
+        regex.search(body) for regex in regexes
+    ])
+    measure('combined patterns', lambda: combined.search(body))
+    measure('ContentMatcher', lambda: matcher.match(body))
+
+
+if __name__ == '__main__':
+    main()
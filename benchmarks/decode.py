@@ -0,0 +1,66 @@
+"""
+Compare per-message decoding of consumed messages with `decode_batch`.
+
+Run with `python -m benchmarks.decode`.
+"""
+import datetime
+import timeit
+
+from typing import List
+
+from schema_registry.batch import decode_batch
+from schema_registry.models import MonitoredEvent
+from schema_registry.utils import json_to_dict, new_event_id, \
+    pydantic_to_json_serializer
+
+
+BATCH_SIZE = 500
+RULES_COUNT = 20
+REPEAT = 5
+
+
+def get_raw_messages(count: int = BATCH_SIZE) -> List[bytes]:
+    start = datetime.datetime(2020, 12, 13, 10, 0, 0)
+    return [
+        pydantic_to_json_serializer(MonitoredEvent(
+            event_id=new_event_id(),
+            url=f'https://site-{i % RULES_COUNT}.example.com/',
+            rule_name=f'rule-{i % RULES_COUNT}',
+            meta={
+                'schedule': {'interval': {'seconds': 10}},
+                'timeout': 10,
+                'regex_pattern': None,
+            },
+            timestamp=start + datetime.timedelta(milliseconds=i),
+            latency=0.1 + i % 7 / 100.0,
+            http_status=200,
+            success=True,
+            regex_match=None,
+        ))
+        for i in range(count)
+    ]
+
+
+def decode_per_message(messages: List[bytes]) -> List[MonitoredEvent]:
+    """The former consumer path: decode and build a model per message."""
+    parsed = []
+    for message in messages:
+        try:
+            parsed.append(MonitoredEvent(**json_to_dict(message)))
+        except Exception:
+            pass
+    return parsed
+
+
+def main():
+    messages = get_raw_messages()
+    for name, func in (
+            ('per message', lambda: decode_per_message(messages)),
+            ('batch', lambda: decode_batch(MonitoredEvent, messages)),
+    ):
+        seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+        print(f'{name:>12}: {seconds / len(messages) * 1e9:10.0f} ns/event')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Per-event CPU cost and memory of every step of the pipeline, measured in
+isolation and end to end on a synthetic stream of monitoring events,
+using mocked producer and in-memory storages.
+
+Run with `python -m benchmarks.pipeline`. Results are saved as JSON, pass
+`--baseline` with results of a previous run to fail on regressions.
+"""
+import argparse
+import datetime
+import gc
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.decode import RULES_COUNT, get_raw_messages
+from consumer.segments import SegmentEventsStorage
+from consumer.storage import MockedEventsStorage
+from producer.checker import MonitoringResult, prepare_data_to_report
+from producer.produce import BaseProducer, MockedProducer
+from producer.rules import MonitoringRule
+from schema_registry.batch import RecordBatch, decode_batch
+from schema_registry.constants import TOPIC
+from schema_registry.models import MonitoredEvent
+from schema_registry.utils import json_to_dict, pydantic_to_json_serializer
+
+
+EVENTS = 5000
+REPEAT = 5
+DEFAULT_OUTPUT = Path(__file__).parent / 'results' / 'pipeline.json'
+DEFAULT_THRESHOLD = 0.2
+
+
+class StageResult(NamedTuple):
+    ns_per_event: float
+    peak_bytes_per_event: float
+
+
+class Stream:
+    """Synthetic events in the shape every stage consumes."""
+
+    def __init__(self, count: int):
+        self.raw = get_raw_messages(count)
+        self.batch = decode_batch(MonitoredEvent, self.raw)
+        self.models = self.batch.to_models()
+        self.messages = [model.dict() for model in self.models]
+        rules = [
+            MonitoringRule(
+                rule_name=f'rule-{i}',
+                url=f'https://site-{i}.example.com/',
+                schedule={'interval': {'seconds': 10}},
+            )
+            for i in range(RULES_COUNT)
+        ]
+        self.checks = [
+            (
+                rules[i % RULES_COUNT],
+                MonitoringResult(
+                    url=rules[i % RULES_COUNT].url,
+                    http_status=200,
+                    latency=0.1 + i % 7 / 100.0,
+                ),
+            )
+            for i in range(count)
+        ]
+
+
+def _write_segments(batch: RecordBatch):
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SegmentEventsStorage(segments_directory=Path(directory))
+        storage.write_batch(batch)
+        storage.close()
+
+
+def _end_to_end(stream: Stream):
+    producer = MockedProducer()
+    for rule, result in stream.checks:
+        producer.send(
+            TOPIC.SiteAvailabilityMonitoring,
+            prepare_data_to_report(rule, result),
+        )
+    raw = [
+        pydantic_to_json_serializer(message)
+        for _, message in producer._sent_data
+    ]
+    MockedEventsStorage().write_batch(decode_batch(MonitoredEvent, raw))
+
+
+def get_stages(stream: Stream) -> Dict[str, Callable[[], Any]]:
+    topic = TOPIC.SiteAvailabilityMonitoring
+    return {
+        'prepare_data_to_report': lambda: [
+            prepare_data_to_report(rule, result)
+            for rule, result in stream.checks
+        ],
+        'get_validated_message': lambda: [
+            BaseProducer.get_validated_message(topic, message)
+            for message in stream.messages
+        ],
+        'pydantic_to_json_serializer': lambda: [
+            pydantic_to_json_serializer(model) for model in stream.models
+        ],
+        'json_to_dict': lambda: [json_to_dict(raw) for raw in stream.raw],
+        'decode_batch': lambda: decode_batch(MonitoredEvent, stream.raw),
+        'write_batch:mocked': lambda: MockedEventsStorage().write_batch(
+            stream.batch,
+        ),
+        'write_batch:segments': lambda: _write_segments(stream.batch),
+        'end_to_end': lambda: _end_to_end(stream),
+    }
+
+
+def measure(run: Callable[[], Any], events: int) -> StageResult:
+    """Best time of `REPEAT` runs and peak traced memory of one more."""
+    timings = []
+    for _ in range(REPEAT):
+        gc.collect()
+        started_at = time.perf_counter_ns()
+        run()
+        timings.append(time.perf_counter_ns() - started_at)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return StageResult(min(timings) / events, peak / events)
+
+
+def find_regressions(results: Dict[str, StageResult],
+                     baseline: Dict[str, Dict[str, float]],
+                     threshold: float) -> List[str]:
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        before = baseline[stage]['ns_per_event']
+        if result.ns_per_event > before * (1 + threshold):
+            regressions.append(
+                f'{stage}: {result.ns_per_event:.0f} ns/event, '
+                f'baseline {before:.0f} ns/event'
+            )
+    return regressions
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=EVENTS)
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', type=Path)
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='allowed relative slowdown against the baseline',
+    )
+    options = parser.parse_args(args)
+    # log records are still created, only not emitted
+    logging.disable(logging.INFO)
+
+    stream = Stream(options.events)
+    results = {
+        stage: measure(run, options.events)
+        for stage, run in get_stages(stream).items()
+    }
+    for stage, result in results.items():
+        print(f'{stage:>28}: {result.ns_per_event:10.0f} ns/event '
+              f'{result.peak_bytes_per_event:8.0f} peak bytes/event')
+
+    options.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(options.output, 'w') as f:
+        json.dump({
+            'created_at': datetime.datetime.now().isoformat(),
+            'python': sys.version,
+            'events': options.events,
+            'stages': {
+                stage: result._asdict() for stage, result in results.items()
+            },
+        }, f, indent=2)
+
+    if options.baseline is not None:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['stages']
+        regressions = find_regressions(results, baseline, options.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+SLA report over 30 days of checks: aggregated row by row in Python (as
+reports were built from `events` before) against `SlaReport` aggregating
+column chunks with NumPy, with peak memory of both.
+
+Run with `python -m benchmarks.reports [--rules N] [--days N]`.
+"""
+import argparse
+import datetime
+import random
+import time
+import tracemalloc
+
+from typing import Callable, Dict, Iterator, List, Optional
+
+from consumer.reports import DEFAULT_CHUNK_SIZE, SlaReport
+from consumer.sketch import LatencySketch
+from consumer.storage import Columns
+
+
+RULES = 50
+DAYS = 30
+INTERVAL_SECONDS = 60
+START = datetime.datetime(2020, 11, 1)
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def iter_chunks(rules: int, days: int,
+                epoch: bool = False) -> Iterator[Columns]:
+    """
+    An event per rule and interval, ordered by timestamp. With `epoch`
+    timestamps are microseconds since the epoch, as read from Postgres.
+    """
+    rng = random.Random(42)
+    rule_names = [f'rule-{i}' for i in range(rules)]
+    checks = days * 24 * 3600 // INTERVAL_SECONDS
+    timestamp_column = 'timestamp_us' if epoch else 'timestamp'
+    chunk: Columns = {
+        'rule_name': [], timestamp_column: [], 'latency': [], 'success': [],
+    }
+    for i in range(checks):
+        timestamp = START + datetime.timedelta(seconds=i * INTERVAL_SECONDS)
+        for rule_name in rule_names:
+            success = rng.random() < 0.99
+            chunk['rule_name'].append(rule_name)
+            chunk[timestamp_column].append(
+                (timestamp - EPOCH) // MICROSECOND if epoch else timestamp
+            )
+            chunk['latency'].append(rng.expovariate(5) if success else None)
+            chunk['success'].append(success)
+        if len(chunk['rule_name']) >= DEFAULT_CHUNK_SIZE:
+            yield chunk
+            chunk = {name: [] for name in chunk}
+    if chunk['rule_name']:
+        yield chunk
+
+
+def row_by_row(chunks: Iterator[Columns]) -> Dict[str, Dict]:
+    """Previous approach: a Python loop over every event."""
+    stats: Dict[str, Dict] = {}
+    for chunk in chunks:
+        for rule_name, timestamp, latency, success in zip(
+                chunk['rule_name'], chunk['timestamp'], chunk['latency'],
+                chunk['success'],
+        ):
+            rule = stats.get(rule_name)
+            if rule is None:
+                rule = stats[rule_name] = {
+                    'checks': 0, 'successes': 0, 'down_since': None,
+                    'repairs': [], 'sketch': LatencySketch(),
+                }
+            rule['checks'] += 1
+            if success:
+                rule['successes'] += 1
+                if rule['down_since'] is not None:
+                    rule['repairs'].append(
+                        (timestamp - rule['down_since']).total_seconds()
+                    )
+                    rule['down_since'] = None
+            elif rule['down_since'] is None:
+                rule['down_since'] = timestamp
+            if latency is not None:
+                rule['sketch'].add(latency)
+    return {
+        rule_name: {
+            'uptime_percent': 100 * rule['successes'] / rule['checks'],
+            'latency_p99': rule['sketch'].quantile(0.99),
+        }
+        for rule_name, rule in stats.items()
+    }
+
+
+def vectorized(chunks: Iterator[Columns]) -> Dict[str, Dict]:
+    report = SlaReport(START, START + datetime.timedelta(days=DAYS))
+    for chunk in chunks:
+        report.add_events(chunk)
+    return {row['rule_name']: row for row in report.iter_rows()}
+
+
+def measure(name: str,
+            aggregate: Callable[[Iterator[Columns]], Dict],
+            rules: int,
+            days: int,
+            epoch: bool = False) -> Dict[str, Dict]:
+    """
+    Time of one run less generating its chunks and peak memory of a
+    traced one.
+    """
+    started_at = time.perf_counter()
+    for _ in iter_chunks(rules, days, epoch):
+        pass
+    generating = time.perf_counter() - started_at
+    # chunks are generated while aggregating, as they would be read
+    started_at = time.perf_counter()
+    result = aggregate(iter_chunks(rules, days, epoch))
+    seconds = time.perf_counter() - started_at - generating
+    tracemalloc.start()
+    try:
+        aggregate(iter_chunks(rules, days, epoch))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(f'{name:>20}: {seconds:8.2f}s, peak {peak / 2 ** 20:8.1f} MiB')
+    return result
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rules', type=int, default=RULES)
+    parser.add_argument('--days', type=int, default=DAYS)
+    options = parser.parse_args(args)
+
+    events = options.rules * options.days * 24 * 3600 // INTERVAL_SECONDS
+    print(f'{events} events of {options.rules} rules')
+    expected = measure('row by row', row_by_row, options.rules, options.days)
+    results = [
+        measure('vectorized', vectorized, options.rules, options.days),
+        measure(
+            'vectorized, epoch', vectorized, options.rules, options.days,
+            epoch=True,
+        ),
+    ]
+    for result in results:
+        for rule_name, row in expected.items():
+            assert abs(
+                row['uptime_percent'] - result[rule_name]['uptime_percent']
+            ) < 1e-9
+            assert abs(
+                row['latency_p99'] - result[rule_name]['latency_p99']
+            ) < 1e-9
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Memory held per in-flight check result with 10k concurrent checks of
+pages of `BODY_SIZE` bytes: results retaining the whole response (as
+`MonitoringResult` used to), slotted `MonitoringResult` and `ResultBatch`.
+
+Run with `python -m benchmarks.results`.
+"""
+import datetime
+import gc
+import io
+import tracemalloc
+
+from typing import Callable, List
+
+import requests
+
+from producer.checker import MonitoringResult, ResultBatch, SiteChecker
+from producer.rules import MonitoringRule
+
+
+CHECKS = 10000
+BODY_SIZE = 16 * 1024
+
+
+class RetainingResult:
+    """Previous shape of results: the response and meta dict were kept."""
+
+    def __init__(self, url, http_status=None, latency=None, meta=None,
+                 regex_match=None, response=None):
+        self.url = url
+        self.http_status = http_status
+        self.latency = latency
+        self.response = response
+        self.regex_match = regex_match
+        self.meta = meta
+
+
+def get_response() -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.elapsed = datetime.timedelta(milliseconds=120)
+    response.raw = io.BytesIO(b'x' * BODY_SIZE)
+    return response
+
+
+def retaining(rule: MonitoringRule):
+    response = get_response()
+    # the body was always downloaded
+    response.content
+    return RetainingResult(
+        url=rule.url, http_status=response.status_code,
+        latency=response.elapsed.total_seconds(), response=response,
+    )
+
+
+def slotted(rule: MonitoringRule) -> MonitoringResult:
+    checker = SiteChecker(url=rule.url, timeout=rule.timeout)
+    return checker._get_result_from_response(get_response())
+
+
+def measure(collect: Callable[[List[MonitoringRule]], object],
+            rules: List[MonitoringRule]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        results = collect(rules)
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del results
+    return (after - before) / len(rules)
+
+
+def collect_batch(rules: List[MonitoringRule]) -> ResultBatch:
+    batch = ResultBatch()
+    for rule in rules:
+        batch.append(rule, slotted(rule))
+    return batch
+
+
+def main():
+    rules = [
+        MonitoringRule(
+            rule_name=f'rule-{i}',
+            url=f'https://site-{i}.example.com/',
+            schedule={'interval': {'seconds': 10}},
+        )
+        for i in range(CHECKS)
+    ]
+    for name, collect in [
+        ('retaining response', lambda rules: list(map(retaining, rules))),
+        ('MonitoringResult', lambda rules: list(map(slotted, rules))),
+        ('ResultBatch', collect_batch),
+    ]:
+        print(f'{name:>20}: {measure(collect, rules):10.0f} bytes/check')
+
+
+if __name__ == '__main__':
+    main()
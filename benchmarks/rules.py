@@ -0,0 +1,102 @@
+"""
+Loading time, time to the first rule and memory held per rule for a large
+rule set: the whole YAML document validated into `MonitoringRule` models
+against streamed `CompactRule` from YAML and JSON lines files.
+
+Run with `python -m benchmarks.rules [--rules N]`.
+"""
+import argparse
+import gc
+import json
+import tempfile
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+import yaml
+
+from producer.rules import MonitoringRule, get_rules_loader
+
+
+RULES = 20000
+
+
+def get_rules_data(count: int) -> dict:
+    return {
+        f'rule-{i}': {
+            'url': f'https://site-{i}.example.com/status',
+            'timeout': 5,
+            'regex_pattern': f'Welcome to site {i % 50}',
+            'schedule': {'interval': {'seconds': 30}},
+        }
+        for i in range(count)
+    }
+
+
+def iter_models(path: Path) -> Iterator[MonitoringRule]:
+    """Previous loader: the whole document first, then every model."""
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    return iter([
+        MonitoringRule(rule_name=rule_name, **meta)
+        for rule_name, meta in data.items()
+    ])
+
+
+def measure(name: str, load: Callable[[], Iterator], count: int):
+    """Timings of one run and memory held by rules of a traced one."""
+    gc.collect()
+    started_at = time.perf_counter()
+    rules = load()
+    first = next(rules)
+    first_seconds = time.perf_counter() - started_at
+    loaded = [first, *rules]
+    seconds = time.perf_counter() - started_at
+    del first, loaded
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        loaded = list(load())
+        gc.collect()
+        held, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(loaded) == count
+    print(f'{name:>20}: {seconds:8.2f}s total, {first_seconds:8.4f}s to '
+          f'first rule, {held / count:6.0f} bytes/rule')
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rules', type=int, default=RULES)
+    options = parser.parse_args(args)
+
+    data = get_rules_data(options.rules)
+    with tempfile.TemporaryDirectory() as directory:
+        yaml_path = Path(directory) / 'rules.yaml'
+        jsonl_path = Path(directory) / 'rules.jsonl'
+        with open(yaml_path, 'w') as f:
+            yaml.safe_dump(data, f)
+        with open(jsonl_path, 'w') as f:
+            for rule_name, meta in data.items():
+                f.write(json.dumps({'rule_name': rule_name, **meta}) + '\n')
+        del data
+
+        measure('yaml, models', lambda: iter_models(yaml_path), options.rules)
+        measure(
+            'yaml, streamed',
+            lambda: get_rules_loader(yaml_path).iter_monitoring_rules(),
+            options.rules,
+        )
+        measure(
+            'jsonl, streamed',
+            lambda: get_rules_loader(jsonl_path).iter_monitoring_rules(),
+            options.rules,
+        )
+
+
+if __name__ == '__main__':
+    main()
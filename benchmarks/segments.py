@@ -0,0 +1,49 @@
+"""
+Ingest and read throughput of `SegmentEventsStorage` and its disk usage
+compared to the raw JSON messages.
+
+Run with `python -m benchmarks.segments`.
+"""
+import tempfile
+import time
+
+from pathlib import Path
+
+from benchmarks.decode import get_raw_messages
+from consumer.segments import SegmentEventsStorage
+from schema_registry.batch import decode_batch
+from schema_registry.models import MonitoredEvent
+
+
+BATCH_SIZE = 1000
+BATCHES = 50
+
+
+def main():
+    rows = BATCH_SIZE * BATCHES
+    messages = get_raw_messages(rows)
+    batches = list(decode_batch(MonitoredEvent, messages).chunks(BATCH_SIZE))
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SegmentEventsStorage(segments_directory=Path(directory))
+        started_at = time.perf_counter()
+        for batch in batches:
+            storage.write_batch(batch)
+        write_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        read_rows = len(storage.read_events())
+        read_seconds = time.perf_counter() - started_at
+        storage.close()
+        disk_bytes = sum(
+            path.stat().st_size for path in Path(directory).iterdir()
+        )
+
+    assert read_rows == rows
+    print(f'write: {rows / write_seconds:10.0f} rows/s')
+    print(f' read: {rows / read_seconds:10.0f} rows/s')
+    print(f' disk: {disk_bytes / rows:10.1f} bytes/row '
+          f'(raw JSON {sum(map(len, messages)) / len(messages):.1f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import abc
+import datetime
+import importlib
+import json
+import logging
+
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Type
+
+from consumer.config import ALERT_SINK_IMPLEMENTATION
+from schema_registry.batch import RecordBatch
+from schema_registry.utils import JSONEncoder, to_epoch_microseconds
+
+
+logger = logging.getLogger(__name__)
+
+CONSECUTIVE_FAILURES = 'consecutive_failures'
+FAILURE_RATIO = 'failure_ratio'
+SLOW_RESPONSE = 'slow_response'
+
+FIRING = 'firing'
+RESOLVED = 'resolved'
+
+_MINUTE_US = 60 * 1000 * 1000
+
+
+class Alert(NamedTuple):
+    rule_name: str
+    kind: str
+    state: str
+    timestamp: datetime.datetime
+    value: float
+
+
+class _RuleAlertState:
+    """
+    Alerting state of a single rule: failures in a row and success counts
+    per minute in a ring of `window_minutes` buckets with running totals,
+    so every event is evaluated in constant time.
+    """
+
+    __slots__ = (
+        'consecutive_failures', 'latest_minute', 'bucket_minutes',
+        'bucket_counts', 'bucket_failures', 'window_count',
+        'window_failures', 'firing',
+    )
+
+    def __init__(self, window_minutes: int):
+        self.consecutive_failures = 0
+        self.latest_minute: Optional[int] = None
+        self.bucket_minutes = [-1] * window_minutes
+        self.bucket_counts = [0] * window_minutes
+        self.bucket_failures = [0] * window_minutes
+        self.window_count = 0
+        self.window_failures = 0
+        self.firing: Dict[str, bool] = {}
+
+    def _expire(self, minute: int):
+        """Drop buckets which are older than the window ending at `minute`."""
+        window = len(self.bucket_minutes)
+        latest = self.latest_minute
+        if latest is None or minute <= latest:
+            return
+        # only minutes of the window ending at `latest` can hold data
+        for expired in range(latest - window + 1,
+                             min(latest, minute - window) + 1):
+            index = expired % window
+            if self.bucket_minutes[index] == expired:
+                self.window_count -= self.bucket_counts[index]
+                self.window_failures -= self.bucket_failures[index]
+                self.bucket_minutes[index] = -1
+                self.bucket_counts[index] = 0
+                self.bucket_failures[index] = 0
+        self.latest_minute = minute
+
+    def add(self, minute: int, failed: bool):
+        if self.latest_minute is None:
+            self.latest_minute = minute
+        self._expire(minute)
+        window = len(self.bucket_minutes)
+        if minute <= self.latest_minute - window:
+            # too late for the window
+            return
+        index = minute % window
+        if self.bucket_minutes[index] != minute:
+            self.window_count -= self.bucket_counts[index]
+            self.window_failures -= self.bucket_failures[index]
+            self.bucket_minutes[index] = minute
+            self.bucket_counts[index] = 0
+            self.bucket_failures[index] = 0
+        self.bucket_counts[index] += 1
+        self.window_count += 1
+        if failed:
+            self.bucket_failures[index] += 1
+            self.window_failures += 1
+            self.consecutive_failures += 1
+        else:
+            self.consecutive_failures = 0
+
+
+class AlertEvaluator:
+    """
+    Evaluates alert conditions per rule on every written batch and sends
+    firing and resolved alerts to the sink on state changes:
+    - `consecutive_failures` failed checks in a row;
+    - failure ratio of at least `failure_ratio` over the last
+      `window_minutes` (once there are `min_window_count` checks);
+    - latency above `latency_threshold` seconds (if set).
+    """
+
+    def __init__(self,
+                 sink: 'BaseAlertSink',
+                 consecutive_failures: int = 3,
+                 failure_ratio: float = 0.5,
+                 window_minutes: int = 5,
+                 min_window_count: int = 5,
+                 latency_threshold: Optional[float] = None,
+                 ):
+        self._sink = sink
+        self._consecutive_failures = consecutive_failures
+        self._failure_ratio = failure_ratio
+        self._window_minutes = window_minutes
+        self._min_window_count = min_window_count
+        self._latency_threshold = latency_threshold
+        self._states: Dict[str, _RuleAlertState] = {}
+
+    def _set(self,
+             alerts: List[Alert],
+             state: _RuleAlertState,
+             rule_name: str,
+             kind: str,
+             firing: bool,
+             timestamp: datetime.datetime,
+             value: float):
+        if state.firing.get(kind, False) == firing:
+            return
+        state.firing[kind] = firing
+        alerts.append(Alert(
+            rule_name, kind, FIRING if firing else RESOLVED, timestamp, value,
+        ))
+
+    def update(self, batch: RecordBatch):
+        alerts: List[Alert] = []
+        for rule_name, timestamp, success, latency in zip(
+                batch['rule_name'], batch['timestamp'], batch['success'],
+                batch['latency'],
+        ):
+            state = self._states.get(rule_name)
+            if state is None:
+                state = self._states[rule_name] = _RuleAlertState(
+                    self._window_minutes,
+                )
+            state.add(to_epoch_microseconds(timestamp) // _MINUTE_US,
+                      not success)
+
+            self._set(
+                alerts, state, rule_name, CONSECUTIVE_FAILURES,
+                state.consecutive_failures >= self._consecutive_failures,
+                timestamp, state.consecutive_failures,
+            )
+            if state.window_count >= self._min_window_count:
+                ratio = state.window_failures / state.window_count
+                self._set(
+                    alerts, state, rule_name, FAILURE_RATIO,
+                    ratio >= self._failure_ratio, timestamp, ratio,
+                )
+            if self._latency_threshold is not None and latency is not None:
+                self._set(
+                    alerts, state, rule_name, SLOW_RESPONSE,
+                    latency > self._latency_threshold, timestamp, latency,
+                )
+        if alerts:
+            self._sink.send_many(alerts)
+
+
+class BaseAlertSink(abc.ABC):
+    def __init__(self, file_path: Optional[Path] = None, **configs):
+        self._file_path = file_path
+        self._configs = configs
+
+    @abc.abstractmethod
+    def send_many(self, alerts: List[Alert]):
+        pass
+
+
+class LogAlertSink(BaseAlertSink):
+    def send_many(self, alerts: List[Alert]):
+        for alert in alerts:
+            logger.warning(
+                'Alert %s %s for rule %s at %s: %s',
+                alert.kind, alert.state, alert.rule_name, alert.timestamp,
+                alert.value,
+            )
+
+
+class FileAlertSink(BaseAlertSink):
+    """Appends alerts as JSON lines, e.g. for a notifier tailing the file."""
+
+    def __init__(self, file_path: Optional[Path] = None, **configs):
+        super().__init__(file_path, **configs)
+        if file_path is None:
+            raise RuntimeError('File path must be set for alerts')
+        self._file = open(file_path, 'a', encoding='utf-8')
+
+    def send_many(self, alerts: List[Alert]):
+        self._file.writelines(
+            json.dumps(alert._asdict(), cls=JSONEncoder) + '\n'
+            for alert in alerts
+        )
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class MockedAlertSink(BaseAlertSink):
+    def __init__(self, file_path: Optional[Path] = None, **configs):
+        super().__init__(file_path, **configs)
+        self._sent_data: List[Alert] = []
+
+    def send_many(self, alerts: List[Alert]):
+        self._sent_data += alerts
+
+
+_alert_evaluator: Optional[AlertEvaluator] = None
+
+
+def initialize_alert_evaluator(
+        sink_class: Optional[Type[BaseAlertSink]] = None,
+        file_path: Optional[Path] = None,
+        **config
+):
+    global _alert_evaluator
+    if sink_class is None:
+        module, cls = ALERT_SINK_IMPLEMENTATION.rsplit('.', 1)
+        sink_module = importlib.import_module(module)
+        sink_class = getattr(sink_module, cls)
+
+    _alert_evaluator = AlertEvaluator(sink_class(file_path), **config)
+
+
+def get_alert_evaluator() -> AlertEvaluator:
+    if _alert_evaluator is None:
+        raise RuntimeError('Alert evaluator is not initialized')
+    return _alert_evaluator
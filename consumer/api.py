@@ -0,0 +1,299 @@
+import base64
+import collections
+import datetime
+import json
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from consumer.rollups import RESOLUTIONS, Rollup
+from consumer.state import get_state_cache
+from consumer.storage import EventCursor, get_event_cursor, get_storage
+from schema_registry.utils import JSONEncoder
+
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), )
+DEFAULT_SUMMARY_HOURS = 24
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class ResponseCache:
+    """
+    LRU cache of encoded responses. Entries expire after `ttl_seconds`
+    and all of them are dropped by `invalidate` which the consumer calls
+    after every write. A response computed while a write happened is not
+    cached, so the cache never serves data older than the last write.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 60.0):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._entries: 'collections.OrderedDict[str, Tuple[float, bytes]]' = (
+            collections.OrderedDict()
+        )
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, generation: int):
+        """Store `value` computed when the cache was at `generation`."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self._ttl_seconds, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key: str, compute: Callable[[], bytes]) -> bytes:
+        value = self.get(key)
+        if value is None:
+            generation = self._generation
+            value = compute()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, *args):
+        """Drop all entries, accepts the written batch as a write listener."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+def _parse_datetime(params: Dict[str, List[str]],
+                    name: str) -> Optional[datetime.datetime]:
+    if name not in params:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(params[name][0])
+    except ValueError:
+        raise BadRequest(f'Invalid {name}: {params[name][0]}')
+
+
+def _check_range(start: Optional[datetime.datetime],
+                 end: Optional[datetime.datetime]):
+    if start is not None and end is not None and \
+            (start.tzinfo is None) != (end.tzinfo is None):
+        raise BadRequest(
+            'Times of a range must all have a timezone or none of them',
+        )
+
+
+def _get_param(params: Dict[str, List[str]], name: str) -> Optional[str]:
+    return params[name][0] if name in params else None
+
+
+def encode_cursor(cursor: EventCursor) -> str:
+    timestamp, rule_name, event_id = cursor
+    return base64.urlsafe_b64encode(
+        json.dumps(
+            [timestamp.isoformat(), rule_name, event_id]
+        ).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(value: str) -> EventCursor:
+    try:
+        timestamp, rule_name, event_id = json.loads(
+            base64.urlsafe_b64decode(value)
+        )
+        return (
+            datetime.datetime.fromisoformat(timestamp), rule_name, event_id,
+        )
+    except (ValueError, TypeError):
+        raise BadRequest(f'Invalid cursor: {value}')
+
+
+def _summarize(rollup: Rollup) -> Dict[str, Any]:
+    summary = {
+        'count': rollup.count,
+        'uptime': rollup.uptime,
+        'regex_failures': rollup.regex_failures,
+        'latency_min': rollup.latency_min,
+        'latency_max': rollup.latency_max,
+        'latency_avg': rollup.latency_avg,
+    }
+    for name, q in QUANTILES:
+        summary[f'latency_{name}'] = rollup.latency_quantile(q)
+    return summary
+
+
+def get_status(params: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Latest result of every rule, served from the state cache."""
+    return {
+        rule_name: state._asdict()
+        for rule_name, state in get_state_cache().get_all_latest().items()
+    }
+
+
+def get_summary(params: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    Uptime and latency per rule over [start, end) from rollups, buckets of
+    `resolution` starting in the range if it is set.
+    """
+    end = _parse_datetime(params, 'end') or datetime.datetime.now()
+    start = _parse_datetime(params, 'start') or end - datetime.timedelta(
+        hours=DEFAULT_SUMMARY_HOURS,
+    )
+    _check_range(start, end)
+    rule_name = _get_param(params, 'rule_name')
+    resolution = _get_param(params, 'resolution')
+    if resolution is None:
+        rollups = get_storage().read_summary(start, end, rule_name)
+    elif resolution in RESOLUTIONS:
+        rollups = get_storage().read_rollups(
+            start, end, resolution, rule_name,
+        )
+    else:
+        raise BadRequest(f'Unknown rollup resolution {resolution}')
+    return {
+        rule_name: _summarize(rollup)
+        for rule_name, rollup in sorted(rollups.items())
+    }
+
+
+def get_events(params: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Raw events ordered by time, paginated with an opaque cursor."""
+    try:
+        limit = int(_get_param(params, 'limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise BadRequest(f'Invalid limit: {params["limit"][0]}')
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f'Limit must be between 1 and {MAX_PAGE_SIZE}')
+    cursor = _get_param(params, 'cursor')
+    start = _parse_datetime(params, 'start')
+    end = _parse_datetime(params, 'end')
+    _check_range(start, end)
+    batch = get_storage().read_events_page(
+        limit,
+        after=decode_cursor(cursor) if cursor else None,
+        rule_name=_get_param(params, 'rule_name'),
+        start=start,
+        end=end,
+    )
+    next_cursor = None
+    if len(batch) == limit:
+        next_cursor = encode_cursor(get_event_cursor(
+            batch['timestamp'][-1], batch['rule_name'][-1],
+            batch['event_id'][-1],
+        ))
+    return {'events': list(batch.rows()), 'next_cursor': next_cursor}
+
+
+def get_intervals(params: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Runs of identical results per rule overlapping [start, end)."""
+    end = _parse_datetime(params, 'end') or datetime.datetime.now()
+    start = _parse_datetime(params, 'start') or end - datetime.timedelta(
+        hours=DEFAULT_SUMMARY_HOURS,
+    )
+    _check_range(start, end)
+    intervals = get_storage().read_intervals(
+        start, end, _get_param(params, 'rule_name'),
+    )
+    return {'intervals': [interval.to_dict() for interval in intervals]}
+
+
+ROUTES: Dict[str, Callable[[Dict[str, List[str]]], Dict[str, Any]]] = {
+    '/status': get_status,
+    '/summary': get_summary,
+    '/events': get_events,
+    '/intervals': get_intervals,
+}
+
+
+class MonitoringApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid delayed ACK stalls
+    # on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        route = ROUTES.get(url.path)
+        if route is None:
+            self._respond(404, {'error': f'Unknown path {url.path}'})
+            return
+        params = parse_qs(url.query)
+        try:
+            body = get_response_cache().get_or_set(
+                self.path,
+                lambda: json.dumps(route(params), cls=JSONEncoder).encode(),
+            )
+        except BadRequest as e:
+            self._respond(400, {'error': str(e)})
+        except NotImplementedError:
+            self._respond(501, {'error': 'Not supported by the storage'})
+        except Exception:
+            logger.exception('Failed to serve %s', self.path)
+            self._respond(500, {'error': 'Internal server error'})
+        else:
+            self._send(200, body)
+
+    def _respond(self, status: int, data: Dict[str, Any]):
+        self._send(status, json.dumps(data).encode())
+
+    def _send(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def initialize_response_cache(max_size: int = 1024,
+                              ttl_seconds: float = 60.0):
+    global _response_cache
+    _response_cache = ResponseCache(max_size, ttl_seconds)
+
+
+def get_response_cache() -> ResponseCache:
+    if _response_cache is None:
+        raise RuntimeError('Response cache is not initialized')
+    return _response_cache
+
+
+def start_api_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve the API from a daemon thread next to the consumer loop."""
+    server = ThreadingHTTPServer((host, port), MonitoringApiHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name='monitoring-api', daemon=True,
+    )
+    thread.start()
+    logger.info('Serving monitoring API on %s:%s', host, port)
+    return server
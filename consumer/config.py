@@ -16,6 +16,14 @@ STORAGE_IMPLEMENTATION = os.environ.get(
     'STORAGE_IMPLEMENTATION_CLASS',
     'consumer.storage.PostgresEventsStorage'
 )
+DEAD_LETTER_IMPLEMENTATION = os.environ.get(
+    'DEAD_LETTER_IMPLEMENTATION_CLASS',
+    'consumer.dead_letter.KafkaDeadLetterQueue'
+)
+ALERT_SINK_IMPLEMENTATION = os.environ.get(
+    'ALERT_SINK_IMPLEMENTATION_CLASS',
+    'consumer.alerts.LogAlertSink'
+)
 
 
 class Config(BaseModel):
@@ -25,8 +33,42 @@ class Config(BaseModel):
     CONSUMER_ACCESS_CERTIFICATE: Optional[Path]
     CONSUMER_ACCESS_KEY: Optional[Path]
     CONSUMER_SLEEP_INTERVAL_SECONDS: float
+    CONSUMER_WRITE_MAX_ROWS: int
+    CONSUMER_WRITE_MAX_BYTES: int
+    CONSUMER_WRITE_MAX_LATENCY_MS: float
+    CONSUMER_DEAD_LETTER_TOPIC_SUFFIX: str
+    CONSUMER_DEAD_LETTER_FILE_PATH: Optional[Path]
+    CONSUMER_FILE_PATH: Optional[Path]
+    CONSUMER_ERROR_LOG_INTERVAL_SECONDS: float
+    CONSUMER_STATE_HISTORY_SIZE: int
+    CONSUMER_STATE_WARM_HOURS: float
+    CONSUMER_API_HOST: str
+    CONSUMER_API_PORT: Optional[int]
+    CONSUMER_API_CACHE_SIZE: int
+    CONSUMER_API_CACHE_TTL_SECONDS: float
+    CONSUMER_ALERT_FILE_PATH: Optional[Path]
+    CONSUMER_ALERT_CONSECUTIVE_FAILURES: int
+    CONSUMER_ALERT_FAILURE_RATIO: float
+    CONSUMER_ALERT_WINDOW_MINUTES: int
+    CONSUMER_ALERT_MIN_WINDOW_COUNT: int
+    CONSUMER_ALERT_LATENCY_SECONDS: Optional[float]
 
     STORAGE_URI: Optional[str]
+    STORAGE_SEGMENTS_DIRECTORY: Optional[Path]
+    STORAGE_SEGMENT_MAX_BYTES: int
+    STORAGE_COMPACT_INTERVALS: bool
+    STORAGE_RAW_WINDOW_SECONDS: Optional[float]
+    STORAGE_DEDUP_WINDOW_SECONDS: Optional[float]
+    STORAGE_READ_CONNECTIONS: int
+    STORAGE_FALLBACK_DIRECTORY: Optional[Path]
+    STORAGE_FALLBACK_LATENCY_BUDGET_SECONDS: float
+    STORAGE_FALLBACK_DRAIN_ROWS: int
+    STORAGE_FALLBACK_RETRY_INTERVAL_SECONDS: float
+    STORAGE_FALLBACK_DRAIN_TIMEOUT_SECONDS: float
+
+    LOG_LEVEL: str
+    METRICS_HOST: str
+    METRICS_PORT: Optional[int]
 
 
 config = Config(
@@ -39,14 +81,95 @@ config = Config(
     CONSUMER_SLEEP_INTERVAL_SECONDS=float(
         os.environ.get('CONSUMER_SLEEP_INTERVAL_SECONDS', 2),
     ),
+    CONSUMER_WRITE_MAX_ROWS=int(
+        os.environ.get('CONSUMER_WRITE_MAX_ROWS', 5000),
+    ),
+    CONSUMER_WRITE_MAX_BYTES=int(
+        os.environ.get('CONSUMER_WRITE_MAX_BYTES', 4 * 1024 * 1024),
+    ),
+    CONSUMER_WRITE_MAX_LATENCY_MS=float(
+        os.environ.get('CONSUMER_WRITE_MAX_LATENCY_MS', 5000),
+    ),
+    CONSUMER_DEAD_LETTER_TOPIC_SUFFIX=os.environ.get(
+        'CONSUMER_DEAD_LETTER_TOPIC_SUFFIX', '.dead-letter',
+    ),
+    CONSUMER_DEAD_LETTER_FILE_PATH=os.environ.get(
+        'CONSUMER_DEAD_LETTER_FILE_PATH',
+    ),
+    CONSUMER_FILE_PATH=os.environ.get('CONSUMER_FILE_PATH'),
+    CONSUMER_ERROR_LOG_INTERVAL_SECONDS=float(
+        os.environ.get('CONSUMER_ERROR_LOG_INTERVAL_SECONDS', 10),
+    ),
+    CONSUMER_STATE_HISTORY_SIZE=int(
+        os.environ.get('CONSUMER_STATE_HISTORY_SIZE', 100),
+    ),
+    CONSUMER_STATE_WARM_HOURS=float(
+        os.environ.get('CONSUMER_STATE_WARM_HOURS', 24),
+    ),
+    CONSUMER_API_HOST=os.environ.get('CONSUMER_API_HOST', '0.0.0.0'),
+    CONSUMER_API_PORT=os.environ.get('CONSUMER_API_PORT'),
+    CONSUMER_API_CACHE_SIZE=int(
+        os.environ.get('CONSUMER_API_CACHE_SIZE', 1024),
+    ),
+    CONSUMER_API_CACHE_TTL_SECONDS=float(
+        os.environ.get('CONSUMER_API_CACHE_TTL_SECONDS', 60),
+    ),
+    CONSUMER_ALERT_FILE_PATH=os.environ.get('CONSUMER_ALERT_FILE_PATH'),
+    CONSUMER_ALERT_CONSECUTIVE_FAILURES=int(
+        os.environ.get('CONSUMER_ALERT_CONSECUTIVE_FAILURES', 3),
+    ),
+    CONSUMER_ALERT_FAILURE_RATIO=float(
+        os.environ.get('CONSUMER_ALERT_FAILURE_RATIO', 0.5),
+    ),
+    CONSUMER_ALERT_WINDOW_MINUTES=int(
+        os.environ.get('CONSUMER_ALERT_WINDOW_MINUTES', 5),
+    ),
+    CONSUMER_ALERT_MIN_WINDOW_COUNT=int(
+        os.environ.get('CONSUMER_ALERT_MIN_WINDOW_COUNT', 5),
+    ),
+    CONSUMER_ALERT_LATENCY_SECONDS=os.environ.get(
+        'CONSUMER_ALERT_LATENCY_SECONDS',
+    ),
 
     STORAGE_URI=os.environ.get('POSTGRES_EVENTS_STORAGE_URI'),
+    STORAGE_SEGMENTS_DIRECTORY=os.environ.get('STORAGE_SEGMENTS_DIRECTORY'),
+    STORAGE_SEGMENT_MAX_BYTES=int(
+        os.environ.get('STORAGE_SEGMENT_MAX_BYTES', 64 * 1024 * 1024),
+    ),
+    STORAGE_COMPACT_INTERVALS=os.environ.get(
+        'STORAGE_COMPACT_INTERVALS', False
+    ),
+    STORAGE_RAW_WINDOW_SECONDS=os.environ.get('STORAGE_RAW_WINDOW_SECONDS'),
+    STORAGE_DEDUP_WINDOW_SECONDS=os.environ.get(
+        'STORAGE_DEDUP_WINDOW_SECONDS',
+    ),
+    STORAGE_READ_CONNECTIONS=int(
+        os.environ.get('STORAGE_READ_CONNECTIONS', 4),
+    ),
+    STORAGE_FALLBACK_DIRECTORY=os.environ.get('STORAGE_FALLBACK_DIRECTORY'),
+    STORAGE_FALLBACK_LATENCY_BUDGET_SECONDS=float(
+        os.environ.get('STORAGE_FALLBACK_LATENCY_BUDGET_SECONDS', 5),
+    ),
+    STORAGE_FALLBACK_DRAIN_ROWS=int(
+        os.environ.get('STORAGE_FALLBACK_DRAIN_ROWS', 50000),
+    ),
+    STORAGE_FALLBACK_RETRY_INTERVAL_SECONDS=float(
+        os.environ.get('STORAGE_FALLBACK_RETRY_INTERVAL_SECONDS', 5),
+    ),
+    STORAGE_FALLBACK_DRAIN_TIMEOUT_SECONDS=float(
+        os.environ.get('STORAGE_FALLBACK_DRAIN_TIMEOUT_SECONDS', 60),
+    ),
+
+    LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    METRICS_HOST=os.environ.get('METRICS_HOST', '0.0.0.0'),
+    METRICS_PORT=os.environ.get('METRICS_PORT'),
 )
 
 
 CONSUMER_CONFIG: Dict[str, Any] = dict(
     topics=[TOPIC.SiteAvailabilityMonitoring, ],
     sleep_interval_seconds=config.CONSUMER_SLEEP_INTERVAL_SECONDS,
+    error_log_interval_seconds=config.CONSUMER_ERROR_LOG_INTERVAL_SECONDS,
     bootstrap_servers=config.CONSUMER_SERVER,
     security_protocol=config.CONSUMER_SECURITY_PROTOCOL,
     ssl_cafile=config.CONSUMER_CA_CERTIFICATE,
@@ -55,13 +178,87 @@ CONSUMER_CONFIG: Dict[str, Any] = dict(
 
     client_id="availability-monitoring-client-1",
     group_id="availability-monitoring-group-1",
+    # offsets are committed by the event writer after every flush
+    enable_auto_commit=False,
 )
+# read by `FileConsumer` only, Kafka rejects unknown options
+if config.CONSUMER_FILE_PATH is not None:
+    CONSUMER_CONFIG['file_path'] = config.CONSUMER_FILE_PATH
 
+# the topic is read without a consumer group by `consumer.replay`
+REPLAY_KAFKA_CONFIG: Dict[str, Any] = dict(
+    bootstrap_servers=config.CONSUMER_SERVER,
+    security_protocol=config.CONSUMER_SECURITY_PROTOCOL,
+    ssl_cafile=config.CONSUMER_CA_CERTIFICATE,
+    ssl_certfile=config.CONSUMER_ACCESS_CERTIFICATE,
+    ssl_keyfile=config.CONSUMER_ACCESS_KEY,
+    client_id="availability-monitoring-replay-1",
+)
+
+DEAD_LETTER_CONFIG: Dict[str, Any] = dict(
+    topic_suffix=config.CONSUMER_DEAD_LETTER_TOPIC_SUFFIX,
+    file_path=config.CONSUMER_DEAD_LETTER_FILE_PATH,
+    bootstrap_servers=config.CONSUMER_SERVER,
+    security_protocol=config.CONSUMER_SECURITY_PROTOCOL,
+    ssl_cafile=config.CONSUMER_CA_CERTIFICATE,
+    ssl_certfile=config.CONSUMER_ACCESS_CERTIFICATE,
+    ssl_keyfile=config.CONSUMER_ACCESS_KEY,
+)
+
+STATE_CONFIG: Dict[str, Any] = dict(
+    history_size=config.CONSUMER_STATE_HISTORY_SIZE,
+    warm_hours=config.CONSUMER_STATE_WARM_HOURS,
+)
+
+# API is served only when the port is set
+API_CONFIG: Dict[str, Any] = dict(
+    host=config.CONSUMER_API_HOST,
+    port=config.CONSUMER_API_PORT,
+    cache_size=config.CONSUMER_API_CACHE_SIZE,
+    cache_ttl_seconds=config.CONSUMER_API_CACHE_TTL_SECONDS,
+)
+
+ALERT_CONFIG: Dict[str, Any] = dict(
+    file_path=config.CONSUMER_ALERT_FILE_PATH,
+    consecutive_failures=config.CONSUMER_ALERT_CONSECUTIVE_FAILURES,
+    failure_ratio=config.CONSUMER_ALERT_FAILURE_RATIO,
+    window_minutes=config.CONSUMER_ALERT_WINDOW_MINUTES,
+    min_window_count=config.CONSUMER_ALERT_MIN_WINDOW_COUNT,
+    latency_threshold=config.CONSUMER_ALERT_LATENCY_SECONDS,
+)
+
+WRITER_CONFIG: Dict[str, Any] = dict(
+    max_rows=config.CONSUMER_WRITE_MAX_ROWS,
+    max_bytes=config.CONSUMER_WRITE_MAX_BYTES,
+    max_latency_ms=config.CONSUMER_WRITE_MAX_LATENCY_MS,
+)
+
+# every storage implementation picks the options it knows about
 STORAGE_CONFIG: Dict[str, Any] = dict(
     dsn=config.STORAGE_URI,
+    segments_directory=config.STORAGE_SEGMENTS_DIRECTORY,
+    segment_max_bytes=config.STORAGE_SEGMENT_MAX_BYTES,
+    compact_intervals=config.STORAGE_COMPACT_INTERVALS,
+    raw_window_seconds=config.STORAGE_RAW_WINDOW_SECONDS,
+    dedup_window_seconds=config.STORAGE_DEDUP_WINDOW_SECONDS,
+    read_connections=config.STORAGE_READ_CONNECTIONS,
+)
+
+# storage writes are buffered on local disk only when the directory is set
+FALLBACK_CONFIG: Dict[str, Any] = dict(
+    directory=config.STORAGE_FALLBACK_DIRECTORY,
+    latency_budget_seconds=config.STORAGE_FALLBACK_LATENCY_BUDGET_SECONDS,
+    drain_rows=config.STORAGE_FALLBACK_DRAIN_ROWS,
+    retry_interval_seconds=config.STORAGE_FALLBACK_RETRY_INTERVAL_SECONDS,
+    drain_timeout_seconds=config.STORAGE_FALLBACK_DRAIN_TIMEOUT_SECONDS,
+)
+
+METRICS_CONFIG: Dict[str, Any] = dict(
+    host=config.METRICS_HOST,
+    port=config.METRICS_PORT,
 )
 
 logging.basicConfig(
     format='%(asctime)s:%(levelname)s:%(name)s:%(message)s',
-    level=logging.DEBUG,
+    level=config.LOG_LEVEL,
 )
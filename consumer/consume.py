@@ -4,91 +4,200 @@ import importlib
 import logging
 import time
 
-from typing import Optional, Type, Tuple, List, Dict, Generator
-
-from kafka import KafkaConsumer as _KafkaConsumer
+from pathlib import Path
+from typing import Optional, Type, Tuple, List, Dict, Generator, Union
 
 from consumer.config import CONSUMER_IMPLEMENTATION
+from consumer.dead_letter import DeadLetter, get_dead_letter_queue, \
+    get_raw_message
 from schema_registry import get_schema
 from schema_registry.base import BasePydanticSchema
+from schema_registry.batch import RecordBatch, decode_batch
 from schema_registry.constants import TOPIC
 from schema_registry.exceptions import SchemaNotFound
-from schema_registry.utils import json_to_dict
+from schema_registry.metrics import SIZE_BUCKETS, registry
+from schema_registry.utils import AggregatedErrorLogger
 
 
 logger = logging.getLogger(__name__)
 
+POLLED_MESSAGES = registry.histogram(
+    'consumer_poll_messages', 'Messages returned by a single poll',
+    buckets=SIZE_BUCKETS,
+)
+INVALID_MESSAGES = registry.counter(
+    'consumer_invalid_messages_total',
+    'Messages failed to decode, sent to the dead letter queue',
+)
+CONSUMER_LAG = registry.gauge(
+    'consumer_lag_messages',
+    'Messages not consumed yet in assigned partitions',
+)
+
 
 class BaseConsumer(abc.ABC):
     def __init__(self,
                  topics: List[str],
                  sleep_interval_seconds: float,
                  timeout_ms: float = float('inf'),
+                 error_log_interval_seconds: float = 10.0,
                  **configs):
         self._topics = topics
         self._timeout_ms = timeout_ms
         self._sleep_interval_seconds = sleep_interval_seconds
         self._configs = configs
+        self._validation_errors = AggregatedErrorLogger(
+            logger,
+            'Invalid messages sent to dead letter queue',
+            error_log_interval_seconds,
+        )
 
     @abc.abstractmethod
-    def poll(self, **kwargs) -> Dict[str, List[Dict]]:
+    def poll(self, **kwargs) -> Dict[str, List[Union[bytes, Dict]]]:
+        """Polled messages per topic, either raw JSON or decoded dicts."""
         pass
 
-    @staticmethod
-    def _parse_messages(
+    def _decode_messages(
+            self,
+            topic: str,
             schema: Type[BasePydanticSchema],
-            messages: List[Dict],
-    ) -> List[BasePydanticSchema]:
-        parsed_messages = []
-        for message in messages:
-            try:
-                parsed_message = schema(**message)
-                parsed_messages.append(parsed_message)
-            except Exception:
-                logger.exception(
-                    f'Validation error for message against {schema}'
-                )
-        return parsed_messages
+            messages: List[Union[bytes, Dict]],
+    ) -> RecordBatch:
+        """Invalid messages are routed to the dead letter queue."""
+        batch = decode_batch(schema, messages)
+        if batch.errors:
+            get_dead_letter_queue().send_many([
+                DeadLetter(topic, get_raw_message(messages[index]), error)
+                for index, error in batch.errors
+            ])
+            self._validation_errors.add(
+                batch.errors[-1][1], count=len(batch.errors),
+            )
+            INVALID_MESSAGES.inc(len(batch.errors))
+        return batch
+
+    def commit(self):
+        """Commit offsets of all messages returned by `poll` so far."""
+        pass
 
-    def run(
+    def iter_polls(
             self, **poll_kwargs
-    ) -> Generator[Tuple[str, List[BasePydanticSchema]], None, None]:
+    ) -> Generator[List[Tuple[str, RecordBatch]], None, None]:
+        """Decoded batches per topic for every poll, including empty ones."""
         consumer_timeout = time.time() + (self._timeout_ms / 1000.0)
         while time.time() < consumer_timeout:
-            for topic, messages in self.poll(**poll_kwargs).items():
+            batches = []
+            polled = self.poll(**poll_kwargs)
+            POLLED_MESSAGES.observe(
+                sum(len(messages) for messages in polled.values())
+            )
+            for topic, messages in polled.items():
                 try:
                     schema = get_schema(topic)
                 except SchemaNotFound:
-                    logger.exception(f'Schema not found for topic {topic}')
+                    logger.exception('Schema not found for topic %s', topic)
                     continue
-                parsed_messages = self._parse_messages(schema, messages)
-                yield topic, parsed_messages
+                batches.append(
+                    (topic, self._decode_messages(topic, schema, messages))
+                )
+            self._validation_errors.maybe_log()
+            yield batches
             time.sleep(self._sleep_interval_seconds)
 
+    def run(
+            self, **poll_kwargs
+    ) -> Generator[Tuple[str, RecordBatch], None, None]:
+        for batches in self.iter_polls(**poll_kwargs):
+            yield from batches
+
 
 class KafkaConsumer(BaseConsumer):
     def __init__(self,
                  topics: List[str],
                  sleep_interval_seconds: float,
                  timeout_ms: float = float('inf'),
+                 error_log_interval_seconds: float = 10.0,
                  **configs):
         super(KafkaConsumer, self).__init__(
             topics,
             sleep_interval_seconds,
             timeout_ms,
+            error_log_interval_seconds,
             **configs
         )
-        self._consumer = _KafkaConsumer(
-            value_deserializer=json_to_dict,
-            **configs
-        )
+        # imported on use, so that other consumers start without kafka
+        from kafka import KafkaConsumer as _KafkaConsumer
+        # values are kept as raw bytes to be decoded in batches
+        self._consumer = _KafkaConsumer(**configs)
         self._consumer.subscribe(topics)
 
-    def poll(self, **kwargs) -> Dict[str, List[Dict]]:
-        return {
+    def commit(self):
+        self._consumer.commit()
+
+    def poll(self, **kwargs) -> Dict[str, List[Union[bytes, Dict]]]:
+        polled = {
             topic.topic: [message.value for message in messages]
             for topic, messages in self._consumer.poll(**kwargs).items()
         }
+        CONSUMER_LAG.set(self.get_lag())
+        return polled
+
+    def get_lag(self) -> int:
+        """Lag by the last fetched high watermarks, without requests."""
+        lag = 0
+        for partition in self._consumer.assignment():
+            highwater = self._consumer.highwater(partition)
+            if highwater is not None:
+                lag += max(highwater - self._consumer.position(partition), 0)
+        return lag
+
+
+class FileConsumer(BaseConsumer):
+    """
+    Reads messages of the first topic from JSON lines of `file_path`
+    instead of Kafka, e.g. written by `producer.generator`, and follows
+    the file as it grows. Offsets are not kept: every run starts from
+    the beginning of the file.
+    """
+
+    def __init__(self,
+                 topics: List[str],
+                 sleep_interval_seconds: float,
+                 timeout_ms: float = float('inf'),
+                 error_log_interval_seconds: float = 10.0,
+                 file_path: Optional[Path] = None,
+                 max_poll_records: int = 10000,
+                 **configs):
+        super(FileConsumer, self).__init__(
+            topics,
+            sleep_interval_seconds,
+            timeout_ms,
+            error_log_interval_seconds,
+            **configs
+        )
+        if file_path is None:
+            raise RuntimeError('Consumer file path must be set')
+        self._max_poll_records = max_poll_records
+        self._file = open(file_path, 'rb')
+
+    def poll(self, **kwargs) -> Dict[str, List[Union[bytes, Dict]]]:
+        messages: List[Union[bytes, Dict]] = []
+        while len(messages) < self._max_poll_records:
+            position = self._file.tell()
+            line = self._file.readline()
+            if not line.endswith(b'\n'):
+                # end of the file or a line not completely written yet
+                self._file.seek(position)
+                break
+            line = line.strip()
+            if line:
+                messages.append(line)
+        if not messages:
+            return {}
+        return {self._topics[0]: messages}
+
+    def close(self):
+        self._file.close()
 
 
 class MockedConsumer(BaseConsumer):
@@ -105,8 +214,8 @@ class MockedConsumer(BaseConsumer):
             success=True,
         )
 
-    def poll(self, **kwargs) -> Dict[str, List[Dict]]:
-        logger.info('Poll from MockedConsumer')
+    def poll(self, **kwargs) -> Dict[str, List[Union[bytes, Dict]]]:
+        logger.debug('Poll from MockedConsumer')
         return {
             TOPIC.SiteAvailabilityMonitoring: [
                 self.get_fake_payload(),
@@ -0,0 +1,134 @@
+import abc
+import base64
+import datetime
+import importlib
+import json
+import logging
+
+from pathlib import Path
+from typing import Any, List, NamedTuple, Optional, Type
+
+from consumer.config import DEAD_LETTER_IMPLEMENTATION
+from schema_registry.utils import JSONEncoder
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetter(NamedTuple):
+    topic: str
+    raw: bytes
+    error: str
+
+
+def get_raw_message(message: Any) -> bytes:
+    """Raw bytes of a polled message, already decoded ones are re-encoded."""
+    if isinstance(message, bytes):
+        return message
+    if isinstance(message, str):
+        return message.encode('utf-8')
+    try:
+        return json.dumps(message, cls=JSONEncoder).encode('utf-8')
+    except (TypeError, ValueError):
+        return repr(message).encode('utf-8')
+
+
+class BaseDeadLetterQueue(abc.ABC):
+    def __init__(self,
+                 topic_suffix: str,
+                 file_path: Optional[Path] = None,
+                 **configs):
+        self._topic_suffix = topic_suffix
+        self._file_path = file_path
+        self._configs = configs
+
+    def get_topic(self, topic: str) -> str:
+        return f'{topic}{self._topic_suffix}'
+
+    @abc.abstractmethod
+    def send_many(self, letters: List[DeadLetter]):
+        pass
+
+
+class KafkaDeadLetterQueue(BaseDeadLetterQueue):
+    """Sends raw messages as is to `<topic><topic_suffix>` topics."""
+
+    def __init__(self,
+                 topic_suffix: str,
+                 file_path: Optional[Path] = None,
+                 **configs):
+        super().__init__(topic_suffix, file_path, **configs)
+        from kafka import KafkaProducer as _KafkaProducer
+        self._producer = _KafkaProducer(**configs)
+
+    def send_many(self, letters: List[DeadLetter]):
+        for letter in letters:
+            self._producer.send(
+                self.get_topic(letter.topic),
+                value=letter.raw,
+                headers=[('error', letter.error.encode('utf-8'))],
+            )
+        self._producer.flush()
+
+
+class FileDeadLetterQueue(BaseDeadLetterQueue):
+    """Appends dead letters as JSON lines with base64 encoded raw bytes."""
+
+    def __init__(self,
+                 topic_suffix: str,
+                 file_path: Optional[Path] = None,
+                 **configs):
+        super().__init__(topic_suffix, file_path, **configs)
+        if file_path is None:
+            raise RuntimeError('File path must be set for dead letters')
+        self._file = open(file_path, 'a', encoding='utf-8')
+
+    def send_many(self, letters: List[DeadLetter]):
+        received_at = datetime.datetime.now().isoformat()
+        self._file.writelines(
+            json.dumps({
+                'topic': self.get_topic(letter.topic),
+                'received_at': received_at,
+                'error': letter.error,
+                'raw': base64.b64encode(letter.raw).decode('ascii'),
+            }) + '\n'
+            for letter in letters
+        )
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class MockedDeadLetterQueue(BaseDeadLetterQueue):
+    def __init__(self,
+                 topic_suffix: str = '.dead-letter',
+                 file_path: Optional[Path] = None,
+                 **configs):
+        super().__init__(topic_suffix, file_path, **configs)
+        self._sent_data: List[DeadLetter] = []
+
+    def send_many(self, letters: List[DeadLetter]):
+        self._sent_data += letters
+
+
+_dead_letter_queue: Optional[BaseDeadLetterQueue] = None
+
+
+def initialize_dead_letter_queue(
+        dead_letter_queue_class: Optional[Type[BaseDeadLetterQueue]] = None,
+        **config
+):
+    global _dead_letter_queue
+    if dead_letter_queue_class is None:
+        module, cls = DEAD_LETTER_IMPLEMENTATION.rsplit('.', 1)
+        dead_letter_module = importlib.import_module(module)
+        dead_letter_queue_class = getattr(dead_letter_module, cls)
+
+    _dead_letter_queue = dead_letter_queue_class(**config)
+
+
+def get_dead_letter_queue() -> BaseDeadLetterQueue:
+    if _dead_letter_queue is None:
+        raise RuntimeError('Dead letter queue is not initialized')
+    return _dead_letter_queue
@@ -1,17 +1,134 @@
 import logging
+import time
 
-from consumer.consume import get_consumer
-from consumer.storage import get_storage
+from typing import Callable, Optional, Sequence
+
+from consumer.alerts import get_alert_evaluator
+from consumer.api import get_response_cache
+from consumer.config import WRITER_CONFIG
+from consumer.consume import BaseConsumer, get_consumer
+from consumer.state import get_state_cache
+from consumer.storage import BaseStorage, get_storage
+from schema_registry.batch import RecordBatch
 from schema_registry.constants import TOPIC
+from schema_registry.metrics import registry
 
 
 logger = logging.getLogger(__name__)
 
+WRITE_SECONDS = registry.histogram(
+    'consumer_write_seconds', 'Duration of storage writes',
+)
+WRITTEN_ROWS = registry.counter(
+    'consumer_written_rows_total', 'Events written to the storage',
+)
+WRITE_ERRORS = registry.counter(
+    'consumer_write_errors_total', 'Failed storage writes',
+)
 
-def consume_and_write_monitoring_events():
-    for topic, messages in get_consumer().run():
-        if topic != TOPIC.SiteAvailabilityMonitoring:
-            logger.info('Received not a monitoring event.')
-            continue
 
-        get_storage().write_many(messages)
+class EventWriteBuffer:
+    """
+    Accumulates decoded events across polls and writes them to the storage
+    once `max_rows`, `max_bytes` or `max_latency_ms` (age of the oldest
+    buffered event) is reached. Writes are split into chunks of at most
+    `max_rows` and consumer offsets are committed after every flush,
+    also of polls with only skipped or dead-lettered messages.
+    Rows of every chunk written by the storage, without duplicates it
+    skipped, are passed to `listeners` (e.g. in-memory caches).
+    """
+
+    def __init__(self,
+                 storage: BaseStorage,
+                 consumer: BaseConsumer,
+                 max_rows: int,
+                 max_bytes: int,
+                 max_latency_ms: float,
+                 listeners: Sequence[Callable[[RecordBatch], None]] = (),
+                 ):
+        self._storage = storage
+        self._consumer = consumer
+        self._listeners = listeners
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self._max_latency_seconds = max_latency_ms / 1000.0
+        self._batch: Optional[RecordBatch] = None
+        self._oldest_added_at: Optional[float] = None
+        # polled messages which were not buffered, committed on next flush
+        self._has_skipped = False
+
+    def __len__(self) -> int:
+        return len(self._batch) if self._batch is not None else 0
+
+    def skip(self):
+        """Mark polled messages which are not written as consumed."""
+        self._has_skipped = True
+
+    def add(self, batch: RecordBatch):
+        if batch.errors:
+            self.skip()
+        if not len(batch):
+            return
+        if self._batch is None:
+            self._batch = RecordBatch(batch.schema)
+            self._oldest_added_at = time.monotonic()
+        self._batch.extend(batch)
+
+    def is_full(self) -> bool:
+        if self._batch is None:
+            return self._has_skipped
+        return (
+            len(self._batch) >= self._max_rows or
+            self._batch.nbytes >= self._max_bytes or
+            time.monotonic() - self._oldest_added_at >=
+            self._max_latency_seconds
+        )
+
+    def flush(self):
+        if self._batch is None:
+            if self._has_skipped:
+                self._has_skipped = False
+                self._consumer.commit()
+            return
+        self._has_skipped = False
+        batch, self._batch, self._oldest_added_at = self._batch, None, None
+        for chunk in batch.chunks(self._max_rows):
+            started_at = time.perf_counter()
+            try:
+                written = self._storage.write_batch(chunk)
+            except Exception:
+                WRITE_ERRORS.inc()
+                raise
+            WRITE_SECONDS.observe(time.perf_counter() - started_at)
+            WRITTEN_ROWS.inc(len(written))
+            if not len(written):
+                continue
+            for listener in self._listeners:
+                listener(written)
+        logger.debug('Flushed %s events (%s bytes)', len(batch), batch.nbytes)
+        self._consumer.commit()
+
+
+def consume_and_write_monitoring_events():
+    consumer = get_consumer()
+    buffer = EventWriteBuffer(
+        get_storage(), consumer,
+        listeners=[
+            get_state_cache().update,
+            get_response_cache().invalidate,
+            get_alert_evaluator().update,
+        ],
+        **WRITER_CONFIG,
+    )
+    # buffer is only flushed between polls, so committing all polled
+    # offsets never acknowledges events which were not written yet
+    for batches in consumer.iter_polls():
+        for topic, batch in batches:
+            if topic != TOPIC.SiteAvailabilityMonitoring:
+                logger.info('Received not a monitoring event.')
+                buffer.skip()
+                continue
+            buffer.add(batch)
+        if buffer.is_full():
+            buffer.flush()
+    buffer.flush()
@@ -0,0 +1,286 @@
+import datetime
+import logging
+import os
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from consumer.intervals import StateInterval
+from consumer.rollups import HOUR, Rollup
+from consumer.segments import SegmentLog
+from consumer.storage import BaseStorage, Columns, EventCursor
+from schema_registry.batch import RecordBatch
+from schema_registry.metrics import registry
+from schema_registry.models import MonitoredEvent
+
+
+logger = logging.getLogger(__name__)
+
+# file with the id of the first buffered row not written to the storage
+DRAINED_FILE = 'drained'
+
+FALLBACK_WRITES = registry.counter(
+    'consumer_fallback_writes_total',
+    'Storage writes buffered on local disk instead',
+    ('reason', ),
+)
+BUFFERED_ROWS = registry.gauge(
+    'consumer_fallback_buffered_rows',
+    'Events buffered on local disk and not written to the storage yet',
+)
+DRAINED_ROWS = registry.counter(
+    'consumer_fallback_drained_rows_total',
+    'Buffered events written to the storage',
+)
+
+
+class FallbackStorage(BaseStorage):
+    """
+    Decorates `storage` with a local buffer: a write which fails or takes
+    longer than `latency_budget_seconds` is appended to a `SegmentLog` in
+    `directory` instead, so offsets keep being committed while the
+    storage is down. New events are buffered too until a background
+    thread has drained the buffer into the storage in batches of up to
+    `drain_rows`, retrying every `retry_interval_seconds`. A drain write
+    taking over `drain_timeout_seconds` is waited for again by the next
+    attempt instead of being written twice.
+
+    Events are written at least once: a write over the budget may still
+    succeed after its events were buffered. Reads go to `storage` and see
+    buffered events only once they are drained.
+    """
+
+    def __init__(self,
+                 storage: BaseStorage,
+                 directory: Path,
+                 latency_budget_seconds: float = 5.0,
+                 drain_rows: int = 50000,
+                 retry_interval_seconds: float = 5.0,
+                 drain_timeout_seconds: float = 60.0,
+                 segment_max_bytes: int = 64 * 1024 * 1024,
+                 fsync: bool = True,
+                 **configs):
+        super().__init__(**configs)
+        self._storage = storage
+        self._latency_budget_seconds = float(latency_budget_seconds)
+        self._drain_rows = int(drain_rows)
+        self._retry_interval_seconds = float(retry_interval_seconds)
+        self._drain_timeout_seconds = float(drain_timeout_seconds)
+        self._log = SegmentLog(
+            directory, MonitoredEvent,
+            segment_max_bytes=segment_max_bytes, fsync=fsync,
+        )
+        self._drained_path = Path(directory) / DRAINED_FILE
+        self._drained_row_id = self._read_drained_row_id()
+        # guards the log and the buffering flag
+        self._lock = threading.Lock()
+        self._buffering = self.buffered_rows > 0
+        if self._buffering:
+            logger.warning(
+                'Draining %s events buffered before restart',
+                self.buffered_rows,
+            )
+        BUFFERED_ROWS.set(self.buffered_rows)
+        # one writer keeps writes and drains to the storage in order
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='storage-writer',
+        )
+        # write of the drain in progress and the row id drained by it
+        self._pending_drain: Optional[Tuple[Future, int]] = None
+        self._stopped = threading.Event()
+        self._drainer = threading.Thread(
+            target=self._drain_periodically, name='storage-drainer',
+            daemon=True,
+        )
+        self._drainer.start()
+
+    @property
+    def buffered_rows(self) -> int:
+        return self._log.next_row_id - self._drained_row_id
+
+    @property
+    def is_buffering(self) -> bool:
+        return self._buffering
+
+    def _read_drained_row_id(self) -> int:
+        try:
+            return int(self._drained_path.read_text())
+        except FileNotFoundError:
+            return 0
+
+    def _set_drained_row_id(self, row_id: int):
+        tmp_path = self._drained_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(str(row_id))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._drained_path)
+        self._drained_row_id = row_id
+
+    def _append(self, batch: RecordBatch):
+        self._log.append(batch)
+        BUFFERED_ROWS.set(self.buffered_rows)
+
+    def write_many(self, items: List[MonitoredEvent]):
+        self.write_batch(RecordBatch.from_models(MonitoredEvent, items))
+
+    def write_batch(self, batch: RecordBatch) -> RecordBatch:
+        """
+        Returns the rows written by the storage, or all of them when they
+        are buffered: duplicates are only skipped once they are drained.
+        """
+        if not len(batch):
+            return batch
+        with self._lock:
+            if self._buffering:
+                self._append(batch)
+                return batch
+        future = self._writer.submit(self._storage.write_batch, batch)
+        try:
+            return future.result(timeout=self._latency_budget_seconds)
+        except FutureTimeoutError:
+            reason = 'timeout'
+            logger.warning(
+                'Storage write took over %ss, buffering events locally',
+                self._latency_budget_seconds,
+            )
+        except Exception:
+            reason = 'error'
+            logger.exception('Storage write failed, buffering events locally')
+        FALLBACK_WRITES.labels(reason).inc()
+        with self._lock:
+            self._buffering = True
+            self._append(batch)
+        return batch
+
+    def _drain_periodically(self):
+        while not self._stopped.wait(self._retry_interval_seconds):
+            if not self._buffering:
+                continue
+            try:
+                self.drain()
+            except Exception:
+                logger.warning(
+                    'Failed to drain %s buffered events, retrying in %ss',
+                    self.buffered_rows, self._retry_interval_seconds,
+                    exc_info=True,
+                )
+
+    def drain(self):
+        """Write buffered events to the storage, oldest first."""
+        while self._buffering:
+            if self._pending_drain is None:
+                self._pending_drain = self._submit_drain()
+                if self._pending_drain is None:
+                    return
+            future, drained_row_id = self._pending_drain
+            try:
+                future.result(timeout=self._drain_timeout_seconds)
+            finally:
+                # a write over the timeout is kept to be waited for again
+                if future.done():
+                    self._pending_drain = None
+            DRAINED_ROWS.inc(drained_row_id - self._drained_row_id)
+            with self._lock:
+                self._set_drained_row_id(drained_row_id)
+                if self.buffered_rows:
+                    self._log.drop_segments(self._drained_row_id)
+                else:
+                    self._finish_drain()
+                BUFFERED_ROWS.set(self.buffered_rows)
+
+    def _submit_drain(self) -> Optional[Tuple[Future, int]]:
+        """
+        Submit a write of the oldest buffered blocks. Returns its future
+        and the row id drained by it, None if nothing is left to drain.
+        """
+        with self._lock:
+            blocks = self._log.get_blocks(first_row_id=self._drained_row_id)
+            if not blocks:
+                self._finish_drain()
+                return None
+        # whole blocks, at least one even if larger than a batch
+        rows = 0
+        for count, block in enumerate(blocks):
+            if count and rows + block.rows > self._drain_rows:
+                blocks = blocks[:count]
+                break
+            rows += block.rows
+        chunk = RecordBatch(MonitoredEvent)
+        for _, batch in self._log.iter_batches(blocks):
+            chunk.extend(batch)
+        return (
+            self._writer.submit(self._storage.write_batch, chunk),
+            blocks[-1].first_row_id + blocks[-1].rows,
+        )
+
+    def _finish_drain(self):
+        # reset first: a crash before clearing drains the buffer again
+        # instead of skipping rows buffered next
+        self._set_drained_row_id(0)
+        self._log.clear()
+        self._buffering = False
+        logger.info('Drained all buffered events')
+
+    def close(self):
+        self._stopped.set()
+        self._drainer.join()
+        self._writer.shutdown()
+        self._log.close()
+        close = getattr(self._storage, 'close', None)
+        if close is not None:
+            close()
+
+    def read_rollups(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     resolution: str = HOUR,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        return self._storage.read_rollups(start, end, resolution, rule_name)
+
+    def read_summary(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        return self._storage.read_summary(start, end, rule_name)
+
+    def read_latest(self,
+                    limit_per_rule: int,
+                    since: datetime.datetime) -> RecordBatch:
+        return self._storage.read_latest(limit_per_rule, since)
+
+    def read_events_page(self,
+                         limit: int,
+                         after: Optional[EventCursor] = None,
+                         rule_name: Optional[str] = None,
+                         start: Optional[datetime.datetime] = None,
+                         end: Optional[datetime.datetime] = None,
+                         ) -> RecordBatch:
+        return self._storage.read_events_page(
+            limit, after, rule_name, start, end,
+        )
+
+    def read_intervals(self,
+                       start: datetime.datetime,
+                       end: datetime.datetime,
+                       rule_name: Optional[str] = None,
+                       ) -> List[StateInterval]:
+        return self._storage.read_intervals(start, end, rule_name)
+
+    def iter_event_columns(self,
+                           start: datetime.datetime,
+                           end: datetime.datetime,
+                           chunk_size: int = 100000) -> Iterator[Columns]:
+        return self._storage.iter_event_columns(start, end, chunk_size)
+
+    def iter_rollup_columns(self,
+                            start: datetime.datetime,
+                            end: datetime.datetime,
+                            resolution: str = HOUR,
+                            chunk_size: int = 100000) -> Iterator[Columns]:
+        return self._storage.iter_rollup_columns(
+            start, end, resolution, chunk_size,
+        )
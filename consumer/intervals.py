@@ -0,0 +1,141 @@
+import datetime
+
+from typing import Dict, List, Optional, Tuple
+
+from schema_registry.batch import RecordBatch
+
+
+# consecutive events of a rule with equal state are kept as one interval
+StateKey = Tuple[Optional[bool], Optional[int], Optional[bool]]
+
+
+class StateInterval:
+    """
+    Run of consecutive events of a single rule with the same state
+    (`success`, `http_status`, `regex_match`) from the timestamp of the
+    first event to the timestamp of the last one, with their count and
+    latency aggregates.
+    """
+
+    __slots__ = (
+        'rule_name', 'success', 'http_status', 'regex_match', 'start', 'end',
+        'count', 'latency_count', 'latency_min', 'latency_max', 'latency_sum',
+        'id',
+    )
+
+    def __init__(self,
+                 rule_name: str,
+                 success: Optional[bool],
+                 http_status: Optional[int],
+                 regex_match: Optional[bool],
+                 start: datetime.datetime,
+                 end: Optional[datetime.datetime] = None,
+                 count: int = 0,
+                 latency_count: int = 0,
+                 latency_min: Optional[float] = None,
+                 latency_max: Optional[float] = None,
+                 latency_sum: float = 0.0,
+                 id: Optional[int] = None,
+                 ):
+        self.rule_name = rule_name
+        self.success = success
+        self.http_status = http_status
+        self.regex_match = regex_match
+        self.start = start
+        self.end = end or start
+        self.count = count
+        self.latency_count = latency_count
+        self.latency_min = latency_min
+        self.latency_max = latency_max
+        self.latency_sum = latency_sum
+        # key of the stored row, None until it is written
+        self.id = id
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, StateInterval):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ', '.join(
+            f'{name}={getattr(self, name)!r}' for name in self.__slots__
+        )
+        return f'StateInterval({fields})'
+
+    @property
+    def state(self) -> StateKey:
+        return self.success, self.http_status, self.regex_match
+
+    @property
+    def latency_avg(self) -> Optional[float]:
+        if not self.latency_count:
+            return None
+        return self.latency_sum / self.latency_count
+
+    def add(self, timestamp: datetime.datetime, latency: Optional[float]):
+        self.count += 1
+        if timestamp > self.end:
+            self.end = timestamp
+        if latency is not None:
+            self.latency_count += 1
+            self.latency_sum += latency
+            if self.latency_min is None or latency < self.latency_min:
+                self.latency_min = latency
+            if self.latency_max is None or latency > self.latency_max:
+                self.latency_max = latency
+
+    def to_dict(self) -> Dict:
+        return {
+            'rule_name': self.rule_name,
+            'success': self.success,
+            'http_status': self.http_status,
+            'regex_match': self.regex_match,
+            'start': self.start,
+            'end': self.end,
+            'count': self.count,
+            'latency_min': self.latency_min,
+            'latency_max': self.latency_max,
+            'latency_avg': self.latency_avg,
+        }
+
+
+def extend_intervals(
+        open_intervals: Dict[str, StateInterval],
+        batch: RecordBatch,
+) -> Tuple[List[StateInterval], List[int]]:
+    """
+    Add events of the batch in timestamp order to the open interval of
+    their rule, starting a new one on every state change. Late events
+    (older than the end of the open interval) with another state become
+    closed intervals of their own.
+
+    `open_intervals` is updated in place. Returned are intervals changed
+    by the batch (open ones included) and indexes of events which started
+    an interval, i.e. state transitions.
+    """
+    indexes = sorted(range(len(batch)), key=batch['timestamp'].__getitem__)
+    changed: Dict[int, StateInterval] = {}
+    transitions = []
+    for index in indexes:
+        rule_name = batch['rule_name'][index]
+        timestamp = batch['timestamp'][index]
+        state = (
+            batch['success'][index], batch['http_status'][index],
+            batch['regex_match'][index],
+        )
+        interval = open_intervals.get(rule_name)
+        if interval is None or interval.state != state:
+            transitions.append(index)
+            new_interval = StateInterval(rule_name, *state, start=timestamp)
+            if interval is None or timestamp >= interval.end:
+                if interval is not None:
+                    # closed by the change, stored ones are written back
+                    changed[id(interval)] = interval
+                open_intervals[rule_name] = new_interval
+            interval = new_interval
+        changed[id(interval)] = interval
+        interval.add(timestamp, batch['latency'][index])
+    return list(changed.values()), sorted(transitions)
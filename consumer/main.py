@@ -1,13 +1,36 @@
 import schema_registry  # noqa
 
+from consumer.alerts import initialize_alert_evaluator
+from consumer.api import initialize_response_cache, start_api_server
 from consumer.consume import initialize_consumer
-from consumer.storage import initialize_storage
-from consumer.config import CONSUMER_CONFIG, STORAGE_CONFIG
+from consumer.dead_letter import initialize_dead_letter_queue
+from consumer.fallback import FallbackStorage
+from consumer.state import initialize_state_cache, warm_state_cache
+from consumer.storage import initialize_storage, get_storage
+from consumer.config import CONSUMER_CONFIG, STORAGE_CONFIG, \
+    DEAD_LETTER_CONFIG, STATE_CONFIG, API_CONFIG, ALERT_CONFIG, \
+    METRICS_CONFIG, FALLBACK_CONFIG
 from consumer.event_writer import consume_and_write_monitoring_events
+from schema_registry.metrics import start_metrics_server
 
 
 def start_consumer():
+    if METRICS_CONFIG['port'] is not None:
+        start_metrics_server(METRICS_CONFIG['host'], METRICS_CONFIG['port'])
     initialize_storage(**STORAGE_CONFIG)
+    if FALLBACK_CONFIG['directory'] is not None:
+        initialize_storage(
+            FallbackStorage, storage=get_storage(), **FALLBACK_CONFIG
+        )
+    initialize_dead_letter_queue(**DEAD_LETTER_CONFIG)
+    initialize_state_cache(STATE_CONFIG['history_size'])
+    warm_state_cache(STATE_CONFIG['warm_hours'])
+    initialize_alert_evaluator(**ALERT_CONFIG)
+    initialize_response_cache(
+        API_CONFIG['cache_size'], API_CONFIG['cache_ttl_seconds'],
+    )
+    if API_CONFIG['port'] is not None:
+        start_api_server(API_CONFIG['host'], API_CONFIG['port'])
     initialize_consumer(**CONSUMER_CONFIG)
     # running in while loop:
     consume_and_write_monitoring_events()
@@ -0,0 +1,328 @@
+"""
+Re-ingest monitoring events from a JSON lines dump or a time range of the
+Kafka topic into the configured storage, e.g. after a storage outage:
+
+    python -m consumer.replay --file events.jsonl
+    python -m consumer.replay --start 2020-12-13T00:00 --end 2020-12-14T00:00
+
+Messages are decoded in chunks by a pool of processes and every chunk is
+written with a single `write_batch`. Positions of written messages (line
+numbers of a file, offsets of a topic partition) are recorded in a
+ledger file, so replaying them again, with any chunk size, skips them.
+"""
+import argparse
+import bisect
+import datetime
+import functools
+import logging
+import math
+import multiprocessing
+import time
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, \
+    Tuple, Type
+
+from consumer.config import REPLAY_KAFKA_CONFIG, STORAGE_CONFIG
+from consumer.storage import BaseStorage, get_storage, initialize_storage
+from schema_registry import get_schema
+from schema_registry.base import BasePydanticSchema
+from schema_registry.batch import RecordBatch, decode_batch
+from schema_registry.constants import TOPIC
+from schema_registry.models import MonitoredEvent
+from schema_registry.utils import AggregatedErrorLogger
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+class Chunk(NamedTuple):
+    # a file or a topic partition, and positions of the messages in it
+    # as their stable identity used by the ledger
+    source: str
+    positions: List[int]
+    messages: List[bytes]
+
+
+class ReplayStats(NamedTuple):
+    chunks: int
+    skipped_chunks: int
+    rows: int
+    errors: int
+    seconds: float
+
+
+def iter_file_chunks(path: Path, chunk_size: int) -> Iterator[Chunk]:
+    """Chunks of lines of a JSON lines file, with their line numbers."""
+    source = str(Path(path).resolve())
+    positions: List[int] = []
+    messages: List[bytes] = []
+    with open(path, 'rb') as f:
+        for line_number, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            positions.append(line_number)
+            messages.append(line)
+            if len(messages) == chunk_size:
+                yield Chunk(source, positions, messages)
+                positions, messages = [], []
+    if messages:
+        yield Chunk(source, positions, messages)
+
+
+def iter_kafka_chunks(topic: str,
+                      start: datetime.datetime,
+                      end: Optional[datetime.datetime],
+                      chunk_size: int,
+                      max_idle_polls: int = 10,
+                      **configs) -> Iterator[Chunk]:
+    """
+    Chunks of messages of every partition of `topic` with timestamps in
+    [start, end), with their offsets. Partitions are left after
+    `max_idle_polls` polls without records, as positions may never reach
+    the end offset past compacted messages or transaction markers.
+    """
+    from kafka import KafkaConsumer as _KafkaConsumer, TopicPartition
+
+    consumer = _KafkaConsumer(enable_auto_commit=False, **configs)
+    partitions = [
+        TopicPartition(topic, partition)
+        for partition in sorted(consumer.partitions_for_topic(topic) or ())
+    ]
+    consumer.assign(partitions)
+    end_offsets = consumer.end_offsets(partitions)
+    if end is not None:
+        for partition, found in consumer.offsets_for_times({
+            partition: int(end.timestamp() * 1000)
+            for partition in partitions
+        }).items():
+            if found is not None:
+                end_offsets[partition] = found.offset
+    start_offsets = consumer.offsets_for_times({
+        partition: int(start.timestamp() * 1000) for partition in partitions
+    })
+    pending: Dict[TopicPartition, List] = {}
+    for partition in partitions:
+        found = start_offsets.get(partition)
+        if found is None or found.offset >= end_offsets[partition]:
+            continue
+        consumer.seek(partition, found.offset)
+        pending[partition] = []
+
+    def make_chunk(partition: TopicPartition, records: List) -> Chunk:
+        return Chunk(
+            f'{topic}:{partition.partition}',
+            [record.offset for record in records],
+            [record.value for record in records],
+        )
+
+    try:
+        idle_polls = 0
+        while pending:
+            polled = consumer.poll(timeout_ms=1000)
+            idle_polls += 1
+            for partition, records in polled.items():
+                if partition not in pending or not records:
+                    continue
+                idle_polls = 0
+                buffered = pending[partition]
+                end_offset = end_offsets[partition]
+                for record in records:
+                    if record.offset >= end_offset:
+                        break
+                    buffered.append(record)
+                    if len(buffered) == chunk_size:
+                        yield make_chunk(partition, buffered)
+                        buffered = pending[partition] = []
+            for partition in list(pending):
+                position = consumer.position(partition)
+                if position < end_offsets[partition]:
+                    if idle_polls < max_idle_polls:
+                        continue
+                    logger.warning(
+                        'No records of %s after %s polls, stopped at '
+                        'offset %s before end offset %s',
+                        partition, idle_polls, position,
+                        end_offsets[partition],
+                    )
+                buffered = pending.pop(partition)
+                if buffered:
+                    yield make_chunk(partition, buffered)
+                consumer.pause(partition)
+    finally:
+        consumer.close()
+
+
+class ReplayLedger:
+    """
+    Ranges of positions already written per source, appended to a text
+    file as `source<TAB>first<TAB>last` lines.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path
+        # sorted, non-overlapping (first, last) ranges per source
+        self._ranges: Dict[str, List[Tuple[int, int]]] = {}
+        if path is not None and path.exists():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    source, first, last = line.rstrip('\n').rsplit('\t', 2)
+                    self._add_range(source, int(first), int(last))
+
+    def is_written(self, source: str, position: int) -> bool:
+        ranges = self._ranges.get(source, ())
+        index = bisect.bisect_right(ranges, (position, math.inf)) - 1
+        return index >= 0 and ranges[index][1] >= position
+
+    def _add_range(self, source: str, first: int, last: int):
+        ranges = self._ranges.setdefault(source, [])
+        index = bisect.bisect_left(ranges, (first, first))
+        # merge with overlapping and adjacent ranges around it
+        if index and ranges[index - 1][1] >= first - 1:
+            index -= 1
+            first = ranges[index][0]
+        end = index
+        while end < len(ranges) and ranges[end][0] <= last + 1:
+            last = max(last, ranges[end][1])
+            end += 1
+        ranges[index:end] = [(first, last)]
+
+    def add(self, source: str, first: int, last: int):
+        self._add_range(source, first, last)
+        if self._path is not None:
+            with open(self._path, 'a', encoding='utf-8') as f:
+                f.write(f'{source}\t{first}\t{last}\n')
+
+
+def _decode_chunk(
+        schema: Type[BasePydanticSchema],
+        chunk: Chunk,
+) -> Tuple[str, int, int, RecordBatch]:
+    return (
+        chunk.source, chunk.positions[0], chunk.positions[-1],
+        decode_batch(schema, chunk.messages),
+    )
+
+
+def replay(chunks: Iterable[Chunk],
+           storage: BaseStorage,
+           ledger: ReplayLedger,
+           processes: int = 1,
+           progress_interval_seconds: float = 5.0,
+           schema: Type[BasePydanticSchema] = MonitoredEvent) -> ReplayStats:
+    """
+    Decode chunks as `schema` (in a pool of `processes` if more than one)
+    and write them in order, skipping messages already in the ledger.
+    """
+    started_at = time.monotonic()
+    reported_at = started_at
+    written = skipped = rows = errors = 0
+    error_logger = AggregatedErrorLogger(
+        logger, 'Invalid messages skipped', progress_interval_seconds,
+    )
+
+    def pending_chunks() -> Iterator[Chunk]:
+        nonlocal skipped
+        for chunk in chunks:
+            pending = [
+                index for index, position in enumerate(chunk.positions)
+                if not ledger.is_written(chunk.source, position)
+            ]
+            if not pending:
+                skipped += 1
+                continue
+            if len(pending) < len(chunk.positions):
+                chunk = Chunk(
+                    chunk.source,
+                    [chunk.positions[index] for index in pending],
+                    [chunk.messages[index] for index in pending],
+                )
+            yield chunk
+
+    decode_chunk = functools.partial(_decode_chunk, schema)
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        decoded = (
+            pool.imap(decode_chunk, pending_chunks()) if pool is not None
+            else map(decode_chunk, pending_chunks())
+        )
+        for source, first, last, batch in decoded:
+            if len(batch):
+                storage.write_batch(batch)
+            ledger.add(source, first, last)
+            written += 1
+            rows += len(batch)
+            if batch.errors:
+                errors += len(batch.errors)
+                error_logger.add(batch.errors[-1][1], len(batch.errors))
+            error_logger.maybe_log()
+            now = time.monotonic()
+            if now - reported_at >= progress_interval_seconds:
+                reported_at = now
+                logger.info(
+                    'Replayed %s chunks, %s rows (%.0f rows/s)',
+                    written, rows, rows / (now - started_at),
+                )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    seconds = time.monotonic() - started_at
+    logger.info(
+        'Replay finished: %s chunks written, %s skipped, %s rows, '
+        '%s invalid messages in %.1fs (%.0f rows/s)',
+        written, skipped, rows, errors, seconds, rows / max(seconds, 1e-9),
+    )
+    return ReplayStats(written, skipped, rows, errors, seconds)
+
+
+def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--file', type=Path, help='JSON lines dump')
+    source.add_argument(
+        '--start', type=datetime.datetime.fromisoformat,
+        help='replay the Kafka topic from this time',
+    )
+    parser.add_argument(
+        '--end', type=datetime.datetime.fromisoformat,
+        help='replay the Kafka topic until this time, default is now',
+    )
+    parser.add_argument(
+        '--topic', default=TOPIC.SiteAvailabilityMonitoring,
+        help='topic to replay, its schema decodes messages of a file too',
+    )
+    parser.add_argument(
+        '--ledger', type=Path, default=Path('replay-ledger.txt'),
+        help='file of already written chunks',
+    )
+    parser.add_argument(
+        '--processes', type=int, default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    return parser.parse_args(args)
+
+
+def main(args: Optional[List[str]] = None) -> ReplayStats:
+    options = parse_args(args)
+    schema = get_schema(options.topic)
+    if options.file is not None:
+        chunks = iter_file_chunks(options.file, options.chunk_size)
+    else:
+        chunks = iter_kafka_chunks(
+            options.topic, options.start, options.end, options.chunk_size,
+            **REPLAY_KAFKA_CONFIG,
+        )
+    initialize_storage(**STORAGE_CONFIG)
+    return replay(
+        chunks, get_storage(), ReplayLedger(options.ledger),
+        processes=options.processes, schema=schema,
+    )
+
+
+if __name__ == '__main__':
+    main()
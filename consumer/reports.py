@@ -0,0 +1,484 @@
+"""
+SLA report of all rules over a period: uptime, downtime intervals, MTTR
+and latency percentiles, written as CSV or JSON lines:
+
+    python -m consumer.reports --start 2020-11-01 --end 2020-12-01
+    python -m consumer.reports --start 2020-11-01 --source rollups
+
+Events (or rollups) are read in large column chunks and every chunk is
+aggregated for all rules at once with NumPy, so memory is bounded by the
+chunk size and the number of rules rather than by the period.
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import itertools
+import json
+import math
+import sys
+
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, \
+    Optional, TextIO
+
+import numpy as np
+
+from consumer.config import STORAGE_CONFIG
+from consumer.rollups import HOUR, RESOLUTIONS
+from consumer.sketch import LatencySketch
+from consumer.storage import BaseStorage, Columns, get_storage, \
+    initialize_storage
+from schema_registry.utils import JSONEncoder
+
+
+DEFAULT_CHUNK_SIZE = 100000
+EVENTS = 'events'
+ROLLUPS = 'rollups'
+SOURCES = (EVENTS, ROLLUPS, )
+QUANTILES = (0.5, 0.95, 0.99)
+
+# rule state carried between chunks
+_UNKNOWN, _DOWN, _UP = -1, 0, 1
+_NO_TIME = np.iinfo(np.int64).min
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_LOG_GAMMA = math.log(
+    (1 + LatencySketch.RELATIVE_ACCURACY) /
+    (1 - LatencySketch.RELATIVE_ACCURACY)
+)
+# rules per block of percentile computation, bounds its temporary arrays
+_QUANTILE_BLOCK = 4096
+
+REPORT_FIELDS = (
+    'rule_name', 'checks', 'uptime_percent', 'incidents', 'downtime_seconds',
+    'mttr_seconds', *(f'latency_p{round(q * 100)}' for q in QUANTILES),
+)
+DOWNTIME_FIELDS = ('rule_name', 'start', 'end', 'seconds')
+
+
+class Downtime(NamedTuple):
+    """Failed checks of a rule from the first one to the next success."""
+    rule_name: str
+    start: datetime.datetime
+    # None if the rule was still down at the end of the period
+    end: Optional[datetime.datetime]
+    seconds: float
+
+
+def _to_microseconds(timestamps: List[datetime.datetime]) -> np.ndarray:
+    # a few times faster than conversion of datetimes by NumPy
+    return np.fromiter(
+        ((timestamp - _EPOCH) // _MICROSECOND for timestamp in timestamps),
+        np.int64, len(timestamps),
+    )
+
+
+def _to_datetime(microseconds: int) -> datetime.datetime:
+    return np.datetime64(int(microseconds), 'us').astype(datetime.datetime)
+
+
+class SlaReport:
+    """
+    SLA figures of rules over [start, end), accumulated from chunks of
+    events or of rollups into arrays indexed by rule.
+
+    Downtime is a run of failed checks of a rule from the first failure
+    to the next success, the time to repair of an incident. Rules still
+    down at the end are down until `end`. Events older than the last
+    event of their rule in previous chunks count towards uptime and
+    latency only. Latency percentiles use `LatencySketch` buckets, so
+    they are within its relative accuracy and match the rollups.
+    """
+
+    def __init__(self, start: datetime.datetime, end: datetime.datetime):
+        self.start = start
+        self.end = end
+        self.rule_names: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._checks = np.zeros(0, np.int64)
+        self._successes = np.zeros(0, np.int64)
+        self._incidents = np.zeros(0, np.int64)
+        self._recoveries = np.zeros(0, np.int64)
+        self._repair_us = np.zeros(0, np.int64)
+        self._last_us = np.zeros(0, np.int64)
+        self._last_state = np.zeros(0, np.int8)
+        self._down_since_us = np.zeros(0, np.int64)
+        # latency histograms of rules by sketch bucket from `_min_bucket`
+        self._latency = np.zeros((0, 0), np.int64)
+        self._min_bucket = 0
+        self._has_events = False
+
+    def __len__(self) -> int:
+        return len(self.rule_names)
+
+    def _get_codes(self, rule_names: List[str]) -> np.ndarray:
+        """Index of every rule name, new rules get rows in all arrays."""
+        codes = np.fromiter(
+            map(self._codes.get, rule_names, itertools.repeat(-1)),
+            np.int64, len(rule_names),
+        )
+        new = np.flatnonzero(codes < 0)
+        if len(new):
+            for index in new.tolist():
+                name = rule_names[index]
+                code = self._codes.get(name)
+                if code is None:
+                    code = self._codes[name] = len(self.rule_names)
+                    self.rule_names.append(name)
+                codes[index] = code
+            self._grow(len(self.rule_names))
+        return codes
+
+    def _grow(self, size: int):
+        capacity = len(self._checks)
+        if size <= capacity:
+            return
+        extra = max(size, 2 * capacity) - capacity
+        for name, fill in [
+            ('_checks', 0), ('_successes', 0), ('_incidents', 0),
+            ('_recoveries', 0), ('_repair_us', 0), ('_last_us', _NO_TIME),
+            ('_last_state', _UNKNOWN), ('_down_since_us', _NO_TIME),
+        ]:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate(
+                [array, np.full(extra, fill, array.dtype)]
+            ))
+        self._latency = np.pad(self._latency, ((0, extra), (0, 0)))
+
+    def _add_latency_counts(self,
+                            codes: np.ndarray,
+                            buckets: np.ndarray,
+                            counts: np.ndarray):
+        if not len(buckets):
+            return
+        low, high = int(buckets.min()), int(buckets.max()) + 1
+        width = self._latency.shape[1]
+        if width:
+            low = min(low, self._min_bucket)
+            high = max(high, self._min_bucket + width)
+            before = self._min_bucket - low
+        else:
+            before = 0
+        after = high - low - before - width
+        if before or after:
+            self._latency = np.pad(self._latency, ((0, 0), (before, after)))
+        self._min_bucket = low
+        np.add.at(self._latency, (codes, buckets - self._min_bucket), counts)
+
+    def add_events(self, columns: Columns) -> List[Downtime]:
+        """
+        Aggregate a chunk of events, returned are downtimes which ended
+        in the chunk. Timestamps given as `timestamp_us` (microseconds
+        since the epoch) are used as is, `timestamp` is converted.
+        """
+        if not len(columns['rule_name']):
+            return []
+        self._has_events = True
+        codes = self._get_codes(columns['rule_name'])
+        size = len(self._checks)
+        if 'timestamp_us' in columns:
+            timestamps = np.array(columns['timestamp_us'], np.int64)
+        else:
+            timestamps = _to_microseconds(columns['timestamp'])
+        up = np.array(columns['success'], dtype=bool)
+        latency = np.array(columns['latency'], dtype=np.float64)
+
+        self._checks += np.bincount(codes, minlength=size)
+        self._successes += np.bincount(codes[up], minlength=size)
+        measured = ~np.isnan(latency)
+        self._add_latency_counts(
+            codes[measured],
+            np.ceil(
+                np.log(np.maximum(
+                    latency[measured], LatencySketch.MIN_VALUE,
+                )) / _LOG_GAMMA
+            ).astype(np.int64),
+            np.ones(int(measured.sum()), np.int64),
+        )
+
+        # events of every rule in time order, following previous chunks
+        order = np.lexsort((timestamps, codes))
+        codes, timestamps = codes[order], timestamps[order]
+        state = up[order].astype(np.int8)
+        in_order = timestamps >= self._last_us[codes]
+        codes, timestamps, state = (
+            codes[in_order], timestamps[in_order], state[in_order],
+        )
+        count = len(codes)
+        if not count:
+            return []
+        positions = np.arange(count)
+        first = np.ones(count, bool)
+        first[1:] = codes[1:] != codes[:-1]
+        last = np.ones(count, bool)
+        last[:-1] = first[1:]
+        previous = np.empty(count, np.int8)
+        previous[1:] = state[:-1]
+        previous[first] = self._last_state[codes[first]]
+
+        failed = (state == _DOWN) & (previous != _DOWN)
+        recovered = (state == _UP) & (previous == _DOWN)
+        # start of the incident of every row: set on failures and carried
+        # over from the previous chunk, then filled forward within rules
+        continued = first & (previous == _DOWN)
+        since = np.where(failed, timestamps, _NO_TIME)
+        since[continued] = self._down_since_us[codes[continued]]
+        source = np.maximum.accumulate(
+            np.where(failed | continued, positions, -1)
+        )
+        rule_start = np.maximum.accumulate(np.where(first, positions, 0))
+        since = np.where(
+            source >= rule_start, since[np.maximum(source, 0)], _NO_TIME,
+        )
+
+        repair = timestamps[recovered] - since[recovered]
+        self._incidents += np.bincount(codes[failed], minlength=size)
+        self._recoveries += np.bincount(codes[recovered], minlength=size)
+        self._repair_us += np.bincount(
+            codes[recovered], weights=repair, minlength=size,
+        ).astype(np.int64)
+        last_codes = codes[last]
+        self._last_us[last_codes] = timestamps[last]
+        self._last_state[last_codes] = state[last]
+        self._down_since_us[last_codes] = np.where(
+            state[last] == _DOWN, since[last], _NO_TIME,
+        )
+        return [
+            Downtime(
+                self.rule_names[code], _to_datetime(start_us),
+                _to_datetime(end_us), (end_us - start_us) / 1e6,
+            )
+            for code, start_us, end_us in zip(
+                codes[recovered].tolist(), since[recovered].tolist(),
+                timestamps[recovered].tolist(),
+            )
+        ]
+
+    def add_rollups(self, columns: Columns):
+        """
+        Aggregate a chunk of rollups, which have no order of events:
+        uptime and latency percentiles only.
+        """
+        if not len(columns['rule_name']):
+            return
+        codes = self._get_codes(columns['rule_name'])
+        size = len(self._checks)
+        self._checks += np.bincount(
+            codes, weights=columns['count'], minlength=size,
+        ).astype(np.int64)
+        self._successes += np.bincount(
+            codes, weights=columns['success_count'], minlength=size,
+        ).astype(np.int64)
+        sketch_codes: List[int] = []
+        buckets: List[int] = []
+        counts: List[int] = []
+        for code, sketch in zip(codes.tolist(), columns['latency_sketch']):
+            for bucket, count in (sketch or {}).items():
+                sketch_codes.append(code)
+                buckets.append(int(bucket))
+                counts.append(int(count))
+        self._add_latency_counts(
+            np.array(sketch_codes, np.int64), np.array(buckets, np.int64),
+            np.array(counts, np.int64),
+        )
+
+    def open_downtimes(self) -> List[Downtime]:
+        """Downtimes not recovered by the end of the period."""
+        end_us = int(_to_microseconds([self.end])[0])
+        size = len(self)
+        codes = np.flatnonzero(self._last_state[:size] == _DOWN)
+        return [
+            Downtime(
+                self.rule_names[code], _to_datetime(start_us), None,
+                (end_us - start_us) / 1e6,
+            )
+            for code, start_us in zip(
+                codes.tolist(), self._down_since_us[codes].tolist(),
+            )
+        ]
+
+    def _quantiles(self) -> np.ndarray:
+        """Latency quantiles as rules x `QUANTILES`, NaN without data."""
+        size = len(self)
+        result = np.full((size, len(QUANTILES)), np.nan)
+        if not self._latency.shape[1]:
+            return result
+        for offset in range(0, size, _QUANTILE_BLOCK):
+            histograms = self._latency[offset:offset + _QUANTILE_BLOCK]
+            histograms = histograms[:size - offset]
+            cumulative = np.cumsum(histograms, axis=1)
+            totals = cumulative[:, -1]
+            for i, q in enumerate(QUANTILES):
+                # first bucket with more values than the rank, as in
+                # `LatencySketch.quantile`
+                rank = q * (totals - 1)
+                index = (cumulative <= rank[:, None]).sum(axis=1)
+                index = np.minimum(index, histograms.shape[1] - 1)
+                values = LatencySketch.get_value(index + self._min_bucket)
+                result[offset:offset + len(histograms), i] = np.where(
+                    totals > 0, values, np.nan,
+                )
+        return result
+
+    def iter_rows(self) -> Iterator[Dict]:
+        """Report row of every rule, ordered by rule name."""
+        size = len(self)
+        checks = self._checks[:size]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            uptime = np.where(
+                checks > 0, 100 * self._successes[:size] / checks, np.nan,
+            )
+            end_us = int(_to_microseconds([self.end])[0])
+            down = self._last_state[:size] == _DOWN
+            downtime = (
+                self._repair_us[:size] +
+                np.where(down, end_us - self._down_since_us[:size], 0)
+            ) / 1e6
+            recoveries = self._recoveries[:size]
+            mttr = np.where(
+                recoveries > 0, self._repair_us[:size] / 1e6 / recoveries,
+                np.nan,
+            )
+        quantiles = self._quantiles()
+        columns = [
+            checks.tolist(), uptime.tolist(), self._incidents[:size].tolist(),
+            downtime.tolist(), mttr.tolist(),
+            *(quantiles[:, i].tolist() for i in range(len(QUANTILES))),
+        ]
+        for code in sorted(range(size), key=self.rule_names.__getitem__):
+            row = dict(zip(REPORT_FIELDS, [
+                self.rule_names[code],
+                *(_none_if_nan(column[code]) for column in columns),
+            ]))
+            if not self._has_events:
+                # rollups have no order of events
+                row.update(
+                    incidents=None, downtime_seconds=None, mttr_seconds=None,
+                )
+            yield row
+
+
+def _none_if_nan(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def build_report(storage: BaseStorage,
+                 start: datetime.datetime,
+                 end: datetime.datetime,
+                 source: str = EVENTS,
+                 resolution: str = HOUR,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 on_downtime: Optional[Callable[[Downtime], None]] = None,
+                 ) -> SlaReport:
+    """
+    Report of [start, end) from events or from rollups of `resolution`,
+    `on_downtime` is called with every downtime as soon as it is known.
+    """
+    report = SlaReport(start, end)
+    if source == EVENTS:
+        for columns in storage.iter_event_columns(start, end, chunk_size):
+            downtimes = report.add_events(columns)
+            if on_downtime is not None:
+                for downtime in downtimes:
+                    on_downtime(downtime)
+        if on_downtime is not None:
+            for downtime in report.open_downtimes():
+                on_downtime(downtime)
+    elif source == ROLLUPS:
+        for columns in storage.iter_rollup_columns(
+                start, end, resolution, chunk_size,
+        ):
+            report.add_rollups(columns)
+    else:
+        raise ValueError(f'Unknown report source {source}')
+    return report
+
+
+class CsvWriter:
+    def __init__(self, f: TextIO, fields: Iterable[str]):
+        self._writer = csv.DictWriter(f, fieldnames=list(fields))
+        self._writer.writeheader()
+
+    def write(self, row: Dict):
+        self._writer.writerow({
+            key: value.isoformat()
+            if isinstance(value, datetime.datetime) else value
+            for key, value in row.items()
+        })
+
+
+class JsonLinesWriter:
+    def __init__(self, f: TextIO, fields: Iterable[str]):
+        self._f = f
+
+    def write(self, row: Dict):
+        self._f.write(json.dumps(row, cls=JSONEncoder) + '\n')
+
+
+WRITERS = {'csv': CsvWriter, 'json': JsonLinesWriter}
+
+
+def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--start', type=datetime.datetime.fromisoformat, required=True,
+    )
+    parser.add_argument(
+        '--end', type=datetime.datetime.fromisoformat,
+        help='end of the period, default is now',
+    )
+    parser.add_argument(
+        '--source', choices=SOURCES, default=EVENTS,
+        help='rollups are faster, but have no downtimes and MTTR',
+    )
+    parser.add_argument('--resolution', choices=RESOLUTIONS, default=HOUR)
+    parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    parser.add_argument(
+        '--output', type=Path, help='report file, default is stdout',
+    )
+    parser.add_argument(
+        '--downtime-output', type=Path,
+        help='file for downtime intervals of rules',
+    )
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    return parser.parse_args(args)
+
+
+def main(args: Optional[List[str]] = None) -> SlaReport:
+    options = parse_args(args)
+    writer_class = WRITERS[options.format]
+    with contextlib.ExitStack() as stack:
+        on_downtime: Optional[Callable[[Downtime], None]] = None
+        if options.downtime_output is not None:
+            downtime_writer = writer_class(
+                stack.enter_context(open(options.downtime_output, 'w')),
+                DOWNTIME_FIELDS,
+            )
+
+            def write_downtime(downtime: Downtime):
+                downtime_writer.write(downtime._asdict())
+
+            on_downtime = write_downtime
+
+        initialize_storage(**STORAGE_CONFIG)
+        report = build_report(
+            get_storage(), options.start,
+            options.end or datetime.datetime.now(),
+            source=options.source, resolution=options.resolution,
+            chunk_size=options.chunk_size, on_downtime=on_downtime,
+        )
+        writer = writer_class(
+            sys.stdout if options.output is None
+            else stack.enter_context(open(options.output, 'w')),
+            REPORT_FIELDS,
+        )
+        for row in report.iter_rows():
+            writer.write(row)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import datetime
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from consumer.sketch import LatencySketch
+from schema_registry.batch import RecordBatch
+
+
+MINUTE = 'minute'
+HOUR = 'hour'
+RESOLUTIONS = (MINUTE, HOUR, )
+
+RollupKey = Tuple[str, datetime.datetime]
+# rollups of [start, end) at a resolution
+RollupRange = Tuple[str, datetime.datetime, datetime.datetime]
+
+
+def truncate_timestamp(timestamp: datetime.datetime,
+                       resolution: str) -> datetime.datetime:
+    if resolution == MINUTE:
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    raise ValueError(f'Unknown rollup resolution {resolution}')
+
+
+def get_bucket_bound(timestamp: datetime.datetime,
+                     resolution: str) -> datetime.datetime:
+    """The first bucket starting at or after `timestamp`."""
+    bucket = truncate_timestamp(timestamp, resolution)
+    if bucket < timestamp:
+        bucket += datetime.timedelta(
+            minutes=1 if resolution == MINUTE else 60,
+        )
+    return bucket
+
+
+def split_range(start: datetime.datetime,
+                end: datetime.datetime) -> List[RollupRange]:
+    """
+    Cover minutes overlapping [start, end) with the fewest rollup buckets:
+    hour buckets for whole hours and minute buckets around them.
+    """
+    start = truncate_timestamp(start, MINUTE)
+    if start >= end:
+        return []
+    first_hour = truncate_timestamp(start, HOUR)
+    if first_hour < start:
+        first_hour += datetime.timedelta(hours=1)
+    last_hour = truncate_timestamp(end, HOUR)
+    if first_hour >= last_hour:
+        return [(MINUTE, start, end)]
+    ranges = []
+    if start < first_hour:
+        ranges.append((MINUTE, start, first_hour))
+    ranges.append((HOUR, first_hour, last_hour))
+    if last_hour < end:
+        ranges.append((MINUTE, last_hour, end))
+    return ranges
+
+
+class Rollup:
+    """Aggregated monitoring results of a single rule over a time bucket."""
+
+    __slots__ = (
+        'count', 'success_count', 'regex_failures', 'latency_count',
+        'latency_min', 'latency_max', 'latency_sum', 'latency_sketch',
+    )
+
+    def __init__(self,
+                 count: int = 0,
+                 success_count: int = 0,
+                 regex_failures: int = 0,
+                 latency_count: int = 0,
+                 latency_min: Optional[float] = None,
+                 latency_max: Optional[float] = None,
+                 latency_sum: float = 0.0,
+                 latency_sketch: Optional[LatencySketch] = None,
+                 ):
+        self.count = count
+        self.success_count = success_count
+        self.regex_failures = regex_failures
+        self.latency_count = latency_count
+        self.latency_min = latency_min
+        self.latency_max = latency_max
+        self.latency_sum = latency_sum
+        self.latency_sketch = latency_sketch or LatencySketch()
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Rollup):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ', '.join(
+            f'{name}={getattr(self, name)!r}' for name in self.__slots__
+        )
+        return f'Rollup({fields})'
+
+    def add(self,
+            success: Optional[bool],
+            regex_match: Optional[bool],
+            latency: Optional[float]):
+        self.count += 1
+        if success:
+            self.success_count += 1
+        if regex_match is False:
+            self.regex_failures += 1
+        if latency is not None:
+            self.latency_count += 1
+            self.latency_sum += latency
+            if self.latency_min is None or latency < self.latency_min:
+                self.latency_min = latency
+            if self.latency_max is None or latency > self.latency_max:
+                self.latency_max = latency
+            self.latency_sketch.add(latency)
+
+    def merge(self, other: 'Rollup'):
+        self.count += other.count
+        self.success_count += other.success_count
+        self.regex_failures += other.regex_failures
+        self.latency_count += other.latency_count
+        self.latency_sum += other.latency_sum
+        if other.latency_min is not None and (
+                self.latency_min is None or
+                other.latency_min < self.latency_min):
+            self.latency_min = other.latency_min
+        if other.latency_max is not None and (
+                self.latency_max is None or
+                other.latency_max > self.latency_max):
+            self.latency_max = other.latency_max
+        self.latency_sketch.merge(other.latency_sketch)
+
+    @property
+    def uptime(self) -> Optional[float]:
+        if not self.count:
+            return None
+        return self.success_count / self.count
+
+    @property
+    def latency_avg(self) -> Optional[float]:
+        if not self.latency_count:
+            return None
+        return self.latency_sum / self.latency_count
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        return self.latency_sketch.quantile(q)
+
+
+def aggregate_rollups(batch: RecordBatch,
+                      resolution: str) -> Dict[RollupKey, Rollup]:
+    rollups: Dict[RollupKey, Rollup] = {}
+    for rule_name, timestamp, success, regex_match, latency in zip(
+            batch['rule_name'], batch['timestamp'], batch['success'],
+            batch['regex_match'], batch['latency'],
+    ):
+        key = (rule_name, truncate_timestamp(timestamp, resolution))
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = Rollup()
+        rollup.add(success, regex_match, latency)
+    return rollups
+
+
+def merge_rollups(
+        rollups: Iterable[Tuple[RollupKey, Rollup]],
+) -> Dict[str, Rollup]:
+    """Merge time buckets into a single summary per rule."""
+    merged: Dict[str, Rollup] = {}
+    for (rule_name, _), rollup in rollups:
+        summary = merged.get(rule_name)
+        if summary is None:
+            summary = merged[rule_name] = Rollup()
+        summary.merge(rollup)
+    return merged
+
+
+def filter_rollups(
+        rollups: Dict[RollupKey, Rollup],
+        start: datetime.datetime,
+        end: datetime.datetime,
+        rule_name: Optional[str] = None,
+) -> List[Tuple[RollupKey, Rollup]]:
+    return [
+        (key, rollup) for key, rollup in rollups.items()
+        if start <= key[1] < end and rule_name in (None, key[0])
+    ]
@@ -0,0 +1,627 @@
+import array
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import uuid
+import zlib
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, \
+    Type
+
+from pydantic import BaseModel
+from pydantic.fields import ModelField
+
+from consumer.rollups import HOUR, Rollup, aggregate_rollups, \
+    get_bucket_bound, merge_rollups
+from consumer.storage import BaseStorage, Columns, EventCursor, \
+    filter_events, select_latest, select_page
+from schema_registry.base import BasePydanticSchema
+from schema_registry.batch import RecordBatch
+from schema_registry.models import MonitoredEvent
+from schema_registry.utils import JSONEncoder, from_epoch_microseconds, \
+    to_epoch_microseconds
+
+
+logger = logging.getLogger(__name__)
+
+BLOCK_MAGIC = b'AMSB'
+_BLOCK_PREFIX = struct.Struct('<4sI')
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+_NULL_INT = -2 ** 63
+_NULL_BOOL = -1
+# never generated, see `schema_registry.utils.new_event_id`
+_NULL_UUID = bytes(16)
+
+# column encodings, see `_encode_column`
+DELTA_TIMESTAMP = 'delta-timestamp'
+FIXED_POINT = 'fixed-point'
+INTEGER = 'integer'
+BOOLEAN = 'boolean'
+UUID = 'uuid'
+DICTIONARY = 'dictionary'
+
+
+def _get_encoding(field: ModelField) -> str:
+    if field.type_ is datetime.datetime:
+        return DELTA_TIMESTAMP
+    if field.type_ is float:
+        return FIXED_POINT
+    if field.type_ is bool:
+        return BOOLEAN
+    if field.type_ is int:
+        return INTEGER
+    if field.type_ is uuid.UUID:
+        return UUID
+    return DICTIONARY
+
+
+def _dump_dictionary_value(value: Any) -> str:
+    if isinstance(value, BaseModel):
+        value = value.dict()
+    return json.dumps(value, cls=JSONEncoder, sort_keys=True)
+
+
+def _encode_column(encoding: str,
+                   values: List) -> Tuple[array.array, Optional[List[str]]]:
+    """
+    - timestamps: microseconds since epoch, delta encoded;
+    - floats: fixed point with microsecond precision;
+    - integers and booleans: fixed width with a sentinel for None;
+    - UUIDs: 16 bytes each, unique values would bloat a dictionary;
+    - everything else: dictionary of distinct JSON values and their codes.
+    """
+    if encoding == DELTA_TIMESTAMP:
+        deltas, previous = array.array('q'), 0
+        for value in values:
+            current = to_epoch_microseconds(value)
+            deltas.append(current - previous)
+            previous = current
+        return deltas, None
+    if encoding == FIXED_POINT:
+        return array.array('q', [
+            _NULL_INT if value is None else round(value * 1e6)
+            for value in values
+        ]), None
+    if encoding == INTEGER:
+        return array.array('q', [
+            _NULL_INT if value is None else value for value in values
+        ]), None
+    if encoding == BOOLEAN:
+        return array.array('b', [
+            _NULL_BOOL if value is None else value for value in values
+        ]), None
+    if encoding == UUID:
+        return array.array('B', b''.join(
+            _NULL_UUID if value is None else value.bytes for value in values
+        )), None
+    codes_by_id: Dict[int, int] = {}
+    codes_by_value: Dict[str, int] = {}
+    codes = array.array('I')
+    for value in values:
+        # decoded batches share objects of repeated values (e.g. meta)
+        code = codes_by_id.get(id(value))
+        if code is None:
+            dumped = _dump_dictionary_value(value)
+            code = codes_by_value.setdefault(dumped, len(codes_by_value))
+            codes_by_id[id(value)] = code
+        codes.append(code)
+    return codes, list(codes_by_value)
+
+
+def _decode_column(encoding: str,
+                   field: ModelField,
+                   schema: Type[BasePydanticSchema],
+                   data: bytes,
+                   dictionary: Optional[List[str]]) -> List:
+    if encoding == DELTA_TIMESTAMP:
+        deltas = array.array('q', data)
+        values, current = [], 0
+        for delta in deltas:
+            current += delta
+            values.append(from_epoch_microseconds(current))
+        return values
+    if encoding == FIXED_POINT:
+        return [
+            None if value == _NULL_INT else value / 1e6
+            for value in array.array('q', data)
+        ]
+    if encoding == INTEGER:
+        return [
+            None if value == _NULL_INT else value
+            for value in array.array('q', data)
+        ]
+    if encoding == BOOLEAN:
+        return [
+            None if value == _NULL_BOOL else bool(value)
+            for value in array.array('b', data)
+        ]
+    if encoding == UUID:
+        return [
+            None if value == 0 else uuid.UUID(int=value)
+            for value in (
+                int.from_bytes(data[offset:offset + 16], 'big')
+                for offset in range(0, len(data), 16)
+            )
+        ]
+    # each distinct value is validated once, rows share the result
+    validated = []
+    for dumped in dictionary or ():
+        value, errors = field.validate(
+            json.loads(dumped), {}, loc=field.alias, cls=schema,
+        )
+        if errors:
+            raise ValueError(f'Corrupted column {field.name}: {errors}')
+        validated.append(value)
+    return [validated[code] for code in array.array('I', data)]
+
+
+class BlockInfo(NamedTuple):
+    """Per block entry of a segment index."""
+    path: Path
+    offset: int
+    size: int
+    rows: int
+    first_row_id: int
+    min_timestamp: int
+    max_timestamp: int
+    rule_names: frozenset
+
+    def matches(self,
+                rule_name: Optional[str] = None,
+                start: Optional[int] = None,
+                end: Optional[int] = None) -> bool:
+        return (
+            (rule_name is None or rule_name in self.rule_names) and
+            (start is None or self.max_timestamp >= start) and
+            (end is None or self.min_timestamp < end)
+        )
+
+    def to_dict(self) -> Dict:
+        return dict(
+            self._asdict(),
+            path=self.path.name,
+            rule_names=sorted(self.rule_names),
+        )
+
+    @classmethod
+    def from_dict(cls, directory: Path, data: Dict) -> 'BlockInfo':
+        return cls(**dict(
+            data,
+            path=directory / data['path'],
+            rule_names=frozenset(data['rule_names']),
+        ))
+
+
+class SegmentInfo(NamedTuple):
+    """Summary of the blocks of a sealed segment, kept in memory."""
+    path: Path
+    first_row_id: int
+    rows: int
+    min_timestamp: int
+    max_timestamp: int
+    rule_names: frozenset
+
+    matches = BlockInfo.matches
+
+    @classmethod
+    def from_blocks(cls, path: Path,
+                    blocks: List[BlockInfo]) -> 'SegmentInfo':
+        return cls(
+            path=path,
+            first_row_id=blocks[0].first_row_id,
+            rows=sum(block.rows for block in blocks),
+            min_timestamp=min(block.min_timestamp for block in blocks),
+            max_timestamp=max(block.max_timestamp for block in blocks),
+            rule_names=frozenset().union(
+                *(block.rule_names for block in blocks)
+            ),
+        )
+
+
+def encode_block(batch: RecordBatch,
+                 first_row_id: int,
+                 compression_level: int) -> Tuple[bytes, Dict]:
+    columns = []
+    payloads = []
+    for name, field in batch.schema.__fields__.items():
+        encoding = _get_encoding(field)
+        values, dictionary = _encode_column(encoding, batch[name])
+        payload = zlib.compress(values.tobytes(), compression_level)
+        columns.append([name, encoding, len(payload), dictionary])
+        payloads.append(payload)
+    timestamps = [to_epoch_microseconds(value) for value in batch['timestamp']]
+    header = {
+        'rows': len(batch),
+        'first_row_id': first_row_id,
+        'min_timestamp': min(timestamps),
+        'max_timestamp': max(timestamps),
+        'rule_names': sorted(set(batch['rule_name'])),
+        'columns': columns,
+    }
+    header_data = json.dumps(header).encode('utf-8')
+    block = b''.join([
+        _BLOCK_PREFIX.pack(BLOCK_MAGIC, len(header_data)),
+        header_data,
+    ] + payloads)
+    return block, header
+
+
+def read_block_header(buffer, offset: int) -> Tuple[Dict, int]:
+    """Header of the block at `offset` and the offset of its payload."""
+    magic, header_length = _BLOCK_PREFIX.unpack_from(buffer, offset)
+    if magic != BLOCK_MAGIC:
+        raise ValueError(f'Invalid block at offset {offset}')
+    start = offset + _BLOCK_PREFIX.size
+    header = json.loads(bytes(buffer[start:start + header_length]))
+    return header, start + header_length
+
+
+def decode_block(schema: Type[BasePydanticSchema],
+                 buffer,
+                 offset: int) -> RecordBatch:
+    header, position = read_block_header(buffer, offset)
+    fields = schema.__fields__
+    columns = {}
+    for name, encoding, length, dictionary in header['columns']:
+        data = zlib.decompress(buffer[position:position + length])
+        position += length
+        if name in fields:
+            columns[name] = _decode_column(
+                encoding, fields[name], schema, data, dictionary,
+            )
+    for name, field in fields.items():
+        # written before the field was added to the schema
+        if name not in columns:
+            columns[name] = [field.get_default()] * header['rows']
+    return RecordBatch(schema, {name: columns[name] for name in fields})
+
+
+def _get_block_info(path: Path, offset: int, size: int,
+                    header: Dict) -> BlockInfo:
+    return BlockInfo(
+        path=path,
+        offset=offset,
+        size=size,
+        rows=header['rows'],
+        first_row_id=header['first_row_id'],
+        min_timestamp=header['min_timestamp'],
+        max_timestamp=header['max_timestamp'],
+        rule_names=frozenset(header['rule_names']),
+    )
+
+
+class SegmentLog:
+    """
+    Append-only log of columnar, compressed blocks of a schema stored in
+    rotating segment files of a directory.
+
+    Each `append` writes one block to the active segment. Once the active
+    segment grows over `segment_max_bytes` it is sealed: its block index
+    (row ids, time range and rule names per block) is written next to it
+    and a new segment is started. Only a summary of every sealed segment
+    is kept in memory, its index is read when the summary matches a read.
+    Reads memory-map segments and decode only blocks matching the index.
+    """
+
+    def __init__(self,
+                 directory: Path,
+                 schema: Type[BasePydanticSchema] = MonitoredEvent,
+                 segment_max_bytes: int = 64 * 1024 * 1024,
+                 compression_level: int = 1,
+                 fsync: bool = False,
+                 ):
+        self._directory = Path(directory)
+        self._schema = schema
+        self._segment_max_bytes = segment_max_bytes
+        self._compression_level = compression_level
+        self._fsync = fsync
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        self._sealed_segments: List[SegmentInfo] = []
+        self._active_blocks: List[BlockInfo] = []
+        self._active_path: Optional[Path] = None
+        self._active_file = None
+        self._next_row_id = 0
+        self._load()
+
+    @property
+    def blocks(self) -> List[BlockInfo]:
+        return self.get_blocks()
+
+    @property
+    def next_row_id(self) -> int:
+        return self._next_row_id
+
+    def get_blocks(self,
+                   rule_name: Optional[str] = None,
+                   start: Optional[int] = None,
+                   end: Optional[int] = None,
+                   first_row_id: int = 0) -> List[BlockInfo]:
+        """
+        Blocks, in order, which may have rows of `rule_name` with
+        timestamps in [start, end) microseconds and row ids from
+        `first_row_id`.
+        """
+        blocks: List[BlockInfo] = []
+        for segment in self._sealed_segments:
+            if segment.first_row_id + segment.rows > first_row_id and \
+                    segment.matches(rule_name, start, end):
+                blocks += self._read_index(segment.path)
+        blocks += self._active_blocks
+        return [
+            block for block in blocks
+            if block.first_row_id >= first_row_id and
+            block.matches(rule_name, start, end)
+        ]
+
+    def get_segment_paths(self) -> List[Path]:
+        return sorted(self._directory.glob(f'*{SEGMENT_SUFFIX}'))
+
+    def _load(self):
+        paths = self.get_segment_paths()
+        for path in paths:
+            if path.with_suffix(INDEX_SUFFIX).exists():
+                blocks = self._read_index(path)
+            elif path == paths[-1]:
+                self._active_blocks = blocks = self._scan_segment(path)
+                self._active_path = path
+            else:
+                # not sealed because of a crash during rotation
+                blocks = self._scan_segment(path)
+                self._write_index(path, blocks)
+            if not blocks:
+                continue
+            if path != self._active_path:
+                self._sealed_segments.append(
+                    SegmentInfo.from_blocks(path, blocks)
+                )
+            self._next_row_id = blocks[-1].first_row_id + blocks[-1].rows
+
+    def _read_index(self, path: Path) -> List[BlockInfo]:
+        with open(path.with_suffix(INDEX_SUFFIX)) as f:
+            return [
+                BlockInfo.from_dict(self._directory, block)
+                for block in json.load(f)
+            ]
+
+    def _scan_segment(self, path: Path) -> List[BlockInfo]:
+        """Rebuild index of a segment, dropping an incomplete last block."""
+        blocks: List[BlockInfo] = []
+        size = path.stat().st_size
+        if not size:
+            return blocks
+        offset = 0
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            while offset < size:
+                try:
+                    header, position = read_block_header(buffer, offset)
+                    end = position + sum(
+                        length for _, _, length, _ in header['columns']
+                    )
+                except (ValueError, struct.error):
+                    end = size + 1
+                if end > size:
+                    logger.warning(
+                        'Truncating incomplete block of %s at %s',
+                        path, offset,
+                    )
+                    break
+                blocks.append(
+                    _get_block_info(path, offset, end - offset, header)
+                )
+                offset = end
+        if offset < size:
+            os.truncate(path, offset)
+        return blocks
+
+    @staticmethod
+    def _write_index(path: Path, blocks: List[BlockInfo]):
+        index_path = path.with_suffix(INDEX_SUFFIX)
+        tmp_path = index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump([block.to_dict() for block in blocks], f)
+        os.replace(tmp_path, index_path)
+
+    def _open_active_segment(self):
+        if self._active_path is None:
+            paths = self.get_segment_paths()
+            number = int(paths[-1].stem) + 1 if paths else 0
+            self._active_path = self._directory / (
+                f'{number:012d}{SEGMENT_SUFFIX}'
+            )
+        self._active_file = open(self._active_path, 'ab')
+
+    def _seal_active_segment(self):
+        self._active_file.close()
+        self._write_index(self._active_path, self._active_blocks)
+        self._sealed_segments.append(
+            SegmentInfo.from_blocks(self._active_path, self._active_blocks)
+        )
+        self._active_blocks = []
+        self._active_path = None
+        self._active_file = None
+
+    def append(self, batch: RecordBatch):
+        if not len(batch):
+            return
+        if self._active_file is None:
+            self._open_active_segment()
+        block, header = encode_block(
+            batch, self.next_row_id, self._compression_level,
+        )
+        offset = self._active_file.tell()
+        self._active_file.write(block)
+        self._active_file.flush()
+        if self._fsync:
+            os.fsync(self._active_file.fileno())
+        self._active_blocks.append(
+            _get_block_info(self._active_path, offset, len(block), header)
+        )
+        self._next_row_id += len(batch)
+        if offset + len(block) >= self._segment_max_bytes:
+            self._seal_active_segment()
+
+    def close(self):
+        if self._active_file is not None:
+            self._active_file.close()
+            self._active_file = None
+
+    def drop_segments(self, row_id: int):
+        """Delete sealed segments all rows of which are before `row_id`."""
+        dropped = [
+            segment.path for segment in self._sealed_segments
+            if segment.first_row_id + segment.rows <= row_id
+        ]
+        if not dropped:
+            return
+        self._sealed_segments = [
+            segment for segment in self._sealed_segments
+            if segment.path not in dropped
+        ]
+        for path in dropped:
+            path.with_suffix(INDEX_SUFFIX).unlink()
+            path.unlink()
+
+    def clear(self):
+        """Delete all segments, row ids start from zero again."""
+        self.close()
+        for path in self.get_segment_paths():
+            path.with_suffix(INDEX_SUFFIX).unlink(missing_ok=True)
+            path.unlink()
+        self._sealed_segments = []
+        self._active_blocks = []
+        self._active_path = None
+        self._next_row_id = 0
+
+    def iter_batches(
+            self,
+            blocks: Optional[List[BlockInfo]] = None,
+    ) -> Iterator[Tuple[BlockInfo, RecordBatch]]:
+        """Decoded blocks, in order, using one memory map per segment."""
+        by_path: Dict[Path, List[BlockInfo]] = {}
+        for block in self.blocks if blocks is None else blocks:
+            by_path.setdefault(block.path, []).append(block)
+        for path, path_blocks in by_path.items():
+            with open(path, 'rb') as f, mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ,
+            ) as buffer, memoryview(buffer) as view:
+                for block in path_blocks:
+                    yield block, decode_block(
+                        self._schema, view, block.offset,
+                    )
+
+    def read(self,
+             rule_name: Optional[str] = None,
+             start: Optional[datetime.datetime] = None,
+             end: Optional[datetime.datetime] = None) -> RecordBatch:
+        """Rows of `rule_name` (if set) with timestamp in [start, end)."""
+        start_us = None if start is None else to_epoch_microseconds(start)
+        end_us = None if end is None else to_epoch_microseconds(end)
+        result = RecordBatch(self._schema)
+        blocks = self.get_blocks(rule_name, start_us, end_us)
+        for _, batch in self.iter_batches(blocks):
+            result.extend(filter_events(batch, rule_name, start, end))
+        return result
+
+
+class SegmentEventsStorage(BaseStorage):
+    """
+    Embedded storage for single node deployments without Postgres:
+    events are kept in a `SegmentLog` in `segments_directory`.
+    Rollups are computed from segments on read.
+    """
+
+    def __init__(self,
+                 segments_directory: Optional[Path] = None,
+                 segment_max_bytes: int = 64 * 1024 * 1024,
+                 compression_level: int = 1,
+                 fsync: bool = False,
+                 **configs):
+        super().__init__(**configs)
+        if segments_directory is None:
+            raise RuntimeError('Segments directory must be set')
+        self._log = SegmentLog(
+            segments_directory,
+            MonitoredEvent,
+            segment_max_bytes=segment_max_bytes,
+            compression_level=compression_level,
+            fsync=fsync,
+        )
+
+    def write_many(self, items: List[MonitoredEvent]):
+        self.write_batch(RecordBatch.from_models(MonitoredEvent, items))
+
+    def write_batch(self, batch: RecordBatch) -> RecordBatch:
+        self._log.append(batch)
+        return batch
+
+    def close(self):
+        self._log.close()
+
+    def read_events(self,
+                    rule_name: Optional[str] = None,
+                    start: Optional[datetime.datetime] = None,
+                    end: Optional[datetime.datetime] = None) -> RecordBatch:
+        return self._log.read(rule_name, start, end)
+
+    def read_latest(self,
+                    limit_per_rule: int,
+                    since: datetime.datetime) -> RecordBatch:
+        return select_latest(self._log.read(start=since), limit_per_rule)
+
+    def read_events_page(self,
+                         limit: int,
+                         after: Optional[EventCursor] = None,
+                         rule_name: Optional[str] = None,
+                         start: Optional[datetime.datetime] = None,
+                         end: Optional[datetime.datetime] = None,
+                         ) -> RecordBatch:
+        if after is not None and (start is None or after[0] > start):
+            # skips blocks which end before the previous page
+            start = after[0]
+        return select_page(self._log.read(rule_name, start, end), limit, after)
+
+    def iter_event_columns(self,
+                           start: datetime.datetime,
+                           end: datetime.datetime,
+                           chunk_size: int = 100000) -> Iterator[Columns]:
+        # blocks in order of writing, rather than sorting the whole range
+        blocks = self._log.get_blocks(
+            None, to_epoch_microseconds(start), to_epoch_microseconds(end),
+        )
+        chunk = RecordBatch(MonitoredEvent)
+        for _, batch in self._log.iter_batches(blocks):
+            chunk.extend(filter_events(batch, start=start, end=end))
+            if len(chunk) >= chunk_size:
+                yield chunk.columns
+                chunk = RecordBatch(MonitoredEvent)
+        if len(chunk):
+            yield chunk.columns
+
+    def read_rollups(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     resolution: str = HOUR,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        # all events of buckets in [start, end), as in stored rollups,
+        # blocks out of their time range are skipped by the index
+        start = get_bucket_bound(start, resolution)
+        end = get_bucket_bound(end, resolution)
+        blocks = self._log.get_blocks(
+            rule_name, to_epoch_microseconds(start),
+            to_epoch_microseconds(end),
+        )
+        return merge_rollups(
+            item
+            for _, batch in self._log.iter_batches(blocks)
+            for item in aggregate_rollups(
+                filter_events(batch, rule_name, start, end), resolution,
+            ).items()
+        )
@@ -0,0 +1,90 @@
+import math
+
+from typing import Dict, Optional
+
+
+class LatencySketch:
+    """
+    Mergeable latency histogram with logarithmic buckets.
+
+    Bucket `i` counts values in `(gamma ** (i - 1), gamma ** i]`, so any
+    quantile is estimated within `RELATIVE_ACCURACY` of the real value.
+    Two sketches are merged by adding up their bucket counts which makes
+    them suitable for rollups receiving late events.
+
+    Memory is bounded by `MAX_BUCKETS`: when exceeded the lowest buckets
+    are collapsed into one, so only the lowest quantiles lose accuracy.
+    Latencies between `MIN_VALUE` and hours never get there in practice.
+    """
+    RELATIVE_ACCURACY = 0.01
+    # latencies are measured in seconds, anything below is rounded up
+    MIN_VALUE = 1e-6
+    MAX_BUCKETS = 2048
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.counts: Dict[int, int] = counts or {}
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, LatencySketch):
+            return NotImplemented
+        return self.counts == other.counts
+
+    def __repr__(self) -> str:
+        return f'LatencySketch({self.counts})'
+
+    @classmethod
+    def get_index(cls, value: float) -> int:
+        return math.ceil(math.log(max(value, cls.MIN_VALUE)) / cls._log_gamma)
+
+    @classmethod
+    def get_value(cls, index: int) -> float:
+        return 2 * cls._gamma ** index / (cls._gamma + 1)
+
+    def add(self, value: float, count: int = 1):
+        index = self.get_index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        if len(self.counts) > self.MAX_BUCKETS:
+            self._collapse()
+
+    def merge(self, other: 'LatencySketch'):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        if len(self.counts) > self.MAX_BUCKETS:
+            self._collapse()
+
+    def _collapse(self):
+        indexes = sorted(self.counts)
+        excess = len(indexes) - self.MAX_BUCKETS
+        lowest = indexes[excess]
+        for index in indexes[:excess]:
+            self.counts[lowest] += self.counts.pop(index)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not 0 <= q <= 1:
+            raise ValueError(f'Quantile must be between 0 and 1: {q}')
+        total = len(self)
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return self.get_value(index)
+        return self.get_value(max(self.counts))
+
+    def to_dict(self) -> Dict[str, int]:
+        """JSON friendly representation, stored as jsonb by Postgres."""
+        return {str(index): count for index, count in self.counts.items()}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, int]]) -> 'LatencySketch':
+        return cls({
+            int(index): int(count) for index, count in (data or {}).items()
+        })
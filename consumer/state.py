@@ -0,0 +1,197 @@
+import array
+import datetime
+import logging
+import math
+import threading
+
+from typing import Dict, List, NamedTuple, Optional
+
+from consumer.storage import get_storage
+from schema_registry.batch import RecordBatch
+from schema_registry.utils import from_epoch_microseconds, \
+    to_epoch_microseconds
+
+
+logger = logging.getLogger(__name__)
+
+_NULL_STATUS = -1
+_NULL_BOOL = -1
+
+
+class RuleState(NamedTuple):
+    timestamp: datetime.datetime
+    latency: Optional[float]
+    http_status: Optional[int]
+    success: Optional[bool]
+    regex_match: Optional[bool]
+
+
+def _to_flag(value: Optional[bool]) -> int:
+    return _NULL_BOOL if value is None else int(value)
+
+
+def _from_flag(value: int) -> Optional[bool]:
+    return None if value == _NULL_BOOL else bool(value)
+
+
+class _RuleHistory:
+    """Ring buffer of the last results of a single rule in flat arrays."""
+
+    __slots__ = (
+        'timestamps', 'latencies', 'http_statuses', 'successes',
+        'regex_matches', 'next_index', 'size',
+    )
+
+    def __init__(self, capacity: int):
+        self.timestamps = array.array('q', [0]) * capacity
+        self.latencies = array.array('d', [0.0]) * capacity
+        self.http_statuses = array.array('i', [0]) * capacity
+        self.successes = array.array('b', [0]) * capacity
+        self.regex_matches = array.array('b', [0]) * capacity
+        self.next_index = 0
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def latest_timestamp(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return self.timestamps[self.next_index - 1]
+
+    def add(self,
+            timestamp: int,
+            latency: Optional[float],
+            http_status: Optional[int],
+            success: Optional[bool],
+            regex_match: Optional[bool]):
+        index = self.next_index
+        self.timestamps[index] = timestamp
+        self.latencies[index] = math.nan if latency is None else latency
+        self.http_statuses[index] = (
+            _NULL_STATUS if http_status is None else http_status
+        )
+        self.successes[index] = _to_flag(success)
+        self.regex_matches[index] = _to_flag(regex_match)
+        self.next_index = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def get(self, index: int) -> RuleState:
+        latency = self.latencies[index]
+        http_status = self.http_statuses[index]
+        return RuleState(
+            timestamp=from_epoch_microseconds(self.timestamps[index]),
+            latency=None if math.isnan(latency) else latency,
+            http_status=None if http_status == _NULL_STATUS else http_status,
+            success=_from_flag(self.successes[index]),
+            regex_match=_from_flag(self.regex_matches[index]),
+        )
+
+    def get_all(self) -> List[RuleState]:
+        """Results from the oldest to the latest."""
+        start = (self.next_index - self.size) % self.capacity
+        return [
+            self.get((start + offset) % self.capacity)
+            for offset in range(self.size)
+        ]
+
+
+class RuleStateCache:
+    """
+    Latest monitoring result and the history of the last `history_size`
+    results per rule, updated by the consumer after every write.
+
+    Events older than the latest known result of a rule (e.g. redelivered
+    ones) are not added, so the history is always ordered by time.
+    Timestamps are returned naive, aware ones are converted to UTC.
+    """
+
+    def __init__(self, history_size: int = 100):
+        self._history_size = history_size
+        self._histories: Dict[str, _RuleHistory] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def history_size(self) -> int:
+        return self._history_size
+
+    def update(self, batch: RecordBatch):
+        with self._lock:
+            for rule_name, timestamp, latency, http_status, success, \
+                    regex_match in zip(
+                        batch['rule_name'], batch['timestamp'],
+                        batch['latency'], batch['http_status'],
+                        batch['success'], batch['regex_match'],
+                    ):
+                history = self._histories.get(rule_name)
+                if history is None:
+                    history = self._histories[rule_name] = _RuleHistory(
+                        self._history_size,
+                    )
+                timestamp = to_epoch_microseconds(timestamp)
+                latest_timestamp = history.latest_timestamp
+                if latest_timestamp is not None and \
+                        timestamp < latest_timestamp:
+                    continue
+                history.add(
+                    timestamp, latency, http_status, success, regex_match,
+                )
+
+    def warm(self, batch: RecordBatch):
+        """Fill from events read back from storage after a restart."""
+        self.update(batch)
+        logger.info(
+            'State cache warmed with %s events of %s rules',
+            len(batch), len(self._histories),
+        )
+
+    def get_rule_names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._histories)
+
+    def get_latest(self, rule_name: str) -> Optional[RuleState]:
+        with self._lock:
+            history = self._histories.get(rule_name)
+            if history is None:
+                return None
+            return history.get(history.next_index - 1)
+
+    def get_all_latest(self) -> Dict[str, RuleState]:
+        with self._lock:
+            return {
+                rule_name: history.get(history.next_index - 1)
+                for rule_name, history in sorted(self._histories.items())
+            }
+
+    def get_history(self, rule_name: str) -> List[RuleState]:
+        with self._lock:
+            history = self._histories.get(rule_name)
+            return history.get_all() if history is not None else []
+
+
+_state_cache: Optional[RuleStateCache] = None
+
+
+def initialize_state_cache(history_size: int = 100):
+    global _state_cache
+    _state_cache = RuleStateCache(history_size)
+
+
+def get_state_cache() -> RuleStateCache:
+    if _state_cache is None:
+        raise RuntimeError('State cache is not initialized')
+    return _state_cache
+
+
+def warm_state_cache(hours: float):
+    """Fill the state cache with events of the last `hours` from storage."""
+    state_cache = get_state_cache()
+    since = datetime.datetime.now() - datetime.timedelta(hours=hours)
+    try:
+        batch = get_storage().read_latest(state_cache.history_size, since)
+    except NotImplementedError:
+        logger.warning('Storage does not support warming the state cache')
+        return
+    state_cache.warm(batch)
@@ -1,19 +1,43 @@
 import abc
+import contextlib
+import datetime
+import hashlib
+import heapq
 import importlib
+import itertools
 import logging
 import json
+import threading
+import time
+import uuid
 
-import psycopg2
-
-from typing import Optional, List, Type
-from psycopg2.extras import execute_values
+from typing import Any, Iterator, Optional, List, Type, Set, Dict, Tuple
 
 from consumer.config import STORAGE_IMPLEMENTATION
+from consumer.intervals import StateInterval, extend_intervals
+from consumer.rollups import RESOLUTIONS, HOUR, Rollup, RollupKey, \
+    aggregate_rollups, merge_rollups, filter_rollups, split_range
+from consumer.sketch import LatencySketch
+from schema_registry.batch import RecordBatch, decode_batch
+from schema_registry.metrics import registry
 from schema_registry.models import MonitoredEvent
+from schema_registry.models.monitoring_event import RuleMeta
 from schema_registry.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
+RULE_META_OPTIONAL_FIELDS = ('required_patterns', 'forbidden_patterns', )
+DUPLICATE_EVENTS = registry.counter(
+    'consumer_duplicate_events_total',
+    'Events not written because their id was written already',
+)
+
+# key of the last event of a page: events are ordered by it, events
+# without an id sort first among events of a rule at the same time
+EventCursor = Tuple[datetime.datetime, str, str]
+# a list of values per column name
+Columns = Dict[str, List[Any]]
+
 
 class BaseStorage(abc.ABC):
 
@@ -24,17 +48,279 @@ class BaseStorage(abc.ABC):
     def write_many(self, items: List[MonitoredEvent]):
         pass
 
+    def write_batch(self, batch: RecordBatch) -> RecordBatch:
+        """
+        Write valid rows of a decoded `MonitoredEvent` batch. Returns the
+        rows written, without events the storage skipped as duplicates.
+        """
+        self.write_many(batch.to_models())
+        return batch
+
+    def read_rollups(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     resolution: str = HOUR,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        """Summary per rule of rollup buckets starting in [start, end)."""
+        raise NotImplementedError
+
+    def read_summary(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        """
+        Summary per rule of an arbitrary range with minute precision, hour
+        rollups are used for whole hours and minute rollups for the rest.
+        """
+        summaries: Dict[str, Rollup] = {}
+        for resolution, range_start, range_end in split_range(start, end):
+            rollups = self.read_rollups(
+                range_start, range_end, resolution, rule_name,
+            )
+            for name, rollup in rollups.items():
+                if name in summaries:
+                    summaries[name].merge(rollup)
+                else:
+                    summaries[name] = rollup
+        return summaries
+
+    def read_latest(self,
+                    limit_per_rule: int,
+                    since: datetime.datetime) -> RecordBatch:
+        """
+        Up to `limit_per_rule` latest events of every rule which happened
+        after `since`, ordered by timestamp.
+        """
+        raise NotImplementedError
+
+    def read_events_page(self,
+                         limit: int,
+                         after: Optional[EventCursor] = None,
+                         rule_name: Optional[str] = None,
+                         start: Optional[datetime.datetime] = None,
+                         end: Optional[datetime.datetime] = None,
+                         ) -> RecordBatch:
+        """
+        Up to `limit` events with timestamp in [start, end) ordered by
+        `(timestamp, rule_name)` and following the `after` key, which is the
+        key of the last event of the previous page (keyset pagination).
+        """
+        raise NotImplementedError
+
+    def read_intervals(self,
+                       start: datetime.datetime,
+                       end: datetime.datetime,
+                       rule_name: Optional[str] = None,
+                       ) -> List[StateInterval]:
+        """
+        State intervals overlapping [start, end) ordered by rule name and
+        start, the history of rules without reading every event.
+        """
+        raise NotImplementedError
+
+    def iter_event_columns(self,
+                           start: datetime.datetime,
+                           end: datetime.datetime,
+                           chunk_size: int = 100000) -> Iterator[Columns]:
+        """
+        Events with timestamp in [start, end) in chunks of up to
+        `chunk_size` rows with at least `rule_name`, `timestamp` (or
+        `timestamp_us`, microseconds since the epoch), `latency` and
+        `success` columns, ordered by timestamp (append-only storages may
+        return them in order of writing instead).
+        """
+        after = None
+        while True:
+            page = self.read_events_page(
+                chunk_size, after, start=start, end=end,
+            )
+            if not len(page):
+                return
+            yield page.columns
+            after = get_event_cursor(
+                page['timestamp'][-1], page['rule_name'][-1],
+                page['event_id'][-1],
+            )
+
+    def iter_rollup_columns(self,
+                            start: datetime.datetime,
+                            end: datetime.datetime,
+                            resolution: str = HOUR,
+                            chunk_size: int = 100000) -> Iterator[Columns]:
+        """
+        Rollups of buckets starting in [start, end) in chunks of up to
+        `chunk_size` rows with `rule_name`, `count`, `success_count` and
+        `latency_sketch` (bucket counts of `LatencySketch`) columns.
+        """
+        rollups = list(self.read_rollups(start, end, resolution).items())
+        for offset in range(0, len(rollups), chunk_size):
+            chunk = rollups[offset:offset + chunk_size]
+            yield {
+                'rule_name': [rule_name for rule_name, _ in chunk],
+                'count': [rollup.count for _, rollup in chunk],
+                'success_count': [
+                    rollup.success_count for _, rollup in chunk
+                ],
+                'latency_sketch': [
+                    rollup.latency_sketch.counts for _, rollup in chunk
+                ],
+            }
+
+
+def filter_events(batch: RecordBatch,
+                  rule_name: Optional[str] = None,
+                  start: Optional[datetime.datetime] = None,
+                  end: Optional[datetime.datetime] = None) -> RecordBatch:
+    indexes = [
+        index
+        for index, (name, timestamp) in enumerate(
+            zip(batch['rule_name'], batch['timestamp'])
+        )
+        if (rule_name is None or name == rule_name) and
+        (start is None or timestamp >= start) and
+        (end is None or timestamp < end)
+    ]
+    if len(indexes) == len(batch):
+        return batch
+    return batch.take(indexes)
+
+
+def get_event_cursor(timestamp: datetime.datetime,
+                     rule_name: str,
+                     event_id: Optional[uuid.UUID]) -> EventCursor:
+    return timestamp, rule_name, '' if event_id is None else str(event_id)
+
+
+def select_page(batch: RecordBatch,
+                limit: int,
+                after: Optional[EventCursor] = None) -> RecordBatch:
+    keys = [
+        get_event_cursor(*key) for key in zip(
+            batch['timestamp'], batch['rule_name'], batch['event_id'],
+        )
+    ]
+    indexes = heapq.nsmallest(
+        limit,
+        (
+            index for index, key in enumerate(keys)
+            if after is None or key > after
+        ),
+        key=keys.__getitem__,
+    )
+    return batch.take(indexes)
+
+
+def select_latest(batch: RecordBatch, limit_per_rule: int) -> RecordBatch:
+    indexes = sorted(
+        range(len(batch)), key=batch['timestamp'].__getitem__, reverse=True,
+    )
+    counts: Dict[str, int] = {}
+    selected = []
+    for index in indexes:
+        rule_name = batch['rule_name'][index]
+        if counts.get(rule_name, 0) < limit_per_rule:
+            counts[rule_name] = counts.get(rule_name, 0) + 1
+            selected.append(index)
+    return batch.take(selected[::-1])
+
+
+def execute_values(curs, sql: str, argslist: List,
+                   template: Optional[str] = None,
+                   fetch: bool = False):
+    """`psycopg2.extras.execute_values`, imported with the first write."""
+    from psycopg2.extras import execute_values as _execute_values
+    return _execute_values(
+        curs, sql, argslist, template=template, fetch=fetch,
+    )
+
 
 class PostgresEventsStorage(BaseStorage):
+    """
+    With `compact_intervals` consecutive identical results of a rule are
+    also kept as a single row of `rule_state_intervals`, extended by every
+    write. Raw events are then kept according to `raw_window_seconds`:
+    all of them if None, only state transitions if 0, otherwise all of
+    them for the window and only transitions after it.
 
-    def __init__(self, **configs):
-        super().__init__(**configs)
-        self._connection = psycopg2.connect(**configs)
-        self._connection.autocommit = True
+    Ids of written events are kept in `event_ids` for
+    `dedup_window_seconds` (forever if None) after their timestamp,
+    events with a stored id are not written again.
+
+    Reads use a pool of up to `read_connections` read-only connections,
+    separate from the connection of writes, so that API requests from
+    several threads neither wait for nor end the transaction of a write.
+    """
+
+    # how often raw events and ids out of their windows are deleted
+    PRUNE_INTERVAL_SECONDS = 60.0
+
+    def __init__(self,
+                 dsn: Optional[str] = None,
+                 compact_intervals: bool = False,
+                 raw_window_seconds: Optional[float] = None,
+                 dedup_window_seconds: Optional[float] = None,
+                 read_connections: int = 4,
+                 **configs):
+        super().__init__(
+            dsn=dsn, compact_intervals=compact_intervals,
+            raw_window_seconds=raw_window_seconds,
+            dedup_window_seconds=dedup_window_seconds,
+            read_connections=read_connections, **configs
+        )
+        # imported on use, so that other storages start without psycopg2
+        import psycopg2
+        import psycopg2.pool
+        self._dsn = dsn
+        self._connection = psycopg2.connect(dsn)
+        # errors of a broken connection, which is reopened on next write
+        self._connection_errors = (
+            psycopg2.OperationalError, psycopg2.InterfaceError,
+        )
+        # the pool keeps only `minconn` connections open and raises instead
+        # of waiting when all of them are taken, so readers wait on semaphore
+        self._read_pool = psycopg2.pool.ThreadedConnectionPool(
+            read_connections, read_connections, dsn,
+        )
+        self._read_slots = threading.BoundedSemaphore(read_connections)
+        # names of server-side cursors, unique across reader threads
+        self._cursor_names = itertools.count()
+        # hashes of rule definitions known to be in the `rules` table already
+        self._known_rule_hashes: Set[str] = set()
+        self._compact_intervals = compact_intervals
+        self._raw_window_seconds = raw_window_seconds
+        self._dedup_window_seconds = dedup_window_seconds
+        self._pruned_at = time.monotonic()
         self.try_initialize_table()
 
+    @contextlib.contextmanager
+    def _read_connection(self):
+        """A read-only connection of the pool within a transaction."""
+        with self._read_slots:
+            connection = self._read_pool.getconn()
+            try:
+                if not connection.readonly:
+                    connection.set_session(readonly=True)
+                with connection:
+                    yield connection
+            finally:
+                self._read_pool.putconn(
+                    connection, close=bool(connection.closed),
+                )
+
     def try_initialize_table(self):
+        """
+        Rule definitions are stored once in `rules` keyed by a content hash
+        and referenced from `events` by `rule_hash`. `events.meta` is only
+        filled for rows written before the `rules` table existed.
+        `events_with_meta` view reconstructs the old shape of `events`.
+        """
         sql_template = """
+        CREATE TABLE IF NOT EXISTS rules (
+        hash         TEXT PRIMARY KEY,
+        created_at   TIMESTAMP NOT NULL DEFAULT NOW(),
+        meta         jsonb NOT NULL
+        );
+
         CREATE TABLE IF NOT EXISTS events (
         id           SERIAL PRIMARY KEY,
         created_at   TIMESTAMP NOT NULL DEFAULT NOW(),
@@ -45,48 +331,682 @@ class PostgresEventsStorage(BaseStorage):
         http_status  INTEGER,
         success      BOOLEAN,
         regex_match  BOOLEAN,
+        rule_hash    TEXT,
         meta         jsonb
+        );
+
+        ALTER TABLE events ADD COLUMN IF NOT EXISTS rule_hash TEXT;
+        ALTER TABLE events ADD COLUMN IF NOT EXISTS check_interval FLOAT;
+        ALTER TABLE events ADD COLUMN IF NOT EXISTS event_id UUID;
+        ALTER TABLE events ADD COLUMN IF NOT EXISTS transition BOOLEAN;
+
+        CREATE TABLE IF NOT EXISTS event_ids (
+        event_id     UUID PRIMARY KEY,
+        timestamp    TIMESTAMP NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS event_ids_timestamp_idx
+        ON event_ids (timestamp);
+
+        CREATE INDEX IF NOT EXISTS events_rule_name_timestamp_idx
+        ON events (rule_name, timestamp);
+
+        CREATE INDEX IF NOT EXISTS events_timestamp_rule_name_idx
+        ON events (timestamp, rule_name);
+
+        CREATE INDEX IF NOT EXISTS events_not_transition_timestamp_idx
+        ON events (timestamp) WHERE NOT transition;
+
+        CREATE OR REPLACE VIEW events_with_meta AS
+        SELECT
+            events.id, events.created_at, events.timestamp, events.latency,
+            events.url, events.rule_name, events.http_status, events.success,
+            events.regex_match, COALESCE(rules.meta, events.meta) AS meta,
+            events.check_interval, events.event_id
+        FROM events
+        LEFT JOIN rules ON rules.hash = events.rule_hash;
+
+        CREATE OR REPLACE FUNCTION merge_latency_sketch(a jsonb, b jsonb)
+        RETURNS jsonb AS $$
+            SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+            FROM (
+                SELECT key, SUM(value::bigint) AS total
+                FROM (
+                    SELECT * FROM jsonb_each_text(COALESCE(a, '{}'))
+                    UNION ALL
+                    SELECT * FROM jsonb_each_text(COALESCE(b, '{}'))
+                ) AS buckets
+                GROUP BY key
+            ) AS merged
+        $$ LANGUAGE SQL IMMUTABLE;
+        """
+        rollup_table_template = """
+        CREATE TABLE IF NOT EXISTS rollups_{resolution} (
+        rule_name       TEXT NOT NULL,
+        bucket          TIMESTAMP NOT NULL,
+        count           BIGINT NOT NULL,
+        success_count   BIGINT NOT NULL,
+        regex_failures  BIGINT NOT NULL,
+        latency_count   BIGINT NOT NULL,
+        latency_min     FLOAT,
+        latency_max     FLOAT,
+        latency_sum     FLOAT NOT NULL,
+        latency_sketch  jsonb NOT NULL,
+        PRIMARY KEY (rule_name, bucket)
         )
         """
-        with self._connection.cursor() as curs:
+        intervals_template = """
+        CREATE TABLE IF NOT EXISTS rule_state_intervals (
+        id             BIGSERIAL PRIMARY KEY,
+        rule_name      TEXT NOT NULL,
+        success        BOOLEAN,
+        http_status    INTEGER,
+        regex_match    BOOLEAN,
+        start_at       TIMESTAMP NOT NULL,
+        end_at         TIMESTAMP NOT NULL,
+        count          BIGINT NOT NULL,
+        latency_count  BIGINT NOT NULL,
+        latency_min    FLOAT,
+        latency_max    FLOAT,
+        latency_sum    FLOAT NOT NULL,
+        is_open        BOOLEAN NOT NULL
+        );
+
+        CREATE UNIQUE INDEX IF NOT EXISTS rule_state_intervals_open_idx
+        ON rule_state_intervals (rule_name) WHERE is_open;
+
+        CREATE INDEX IF NOT EXISTS rule_state_intervals_rule_name_start_idx
+        ON rule_state_intervals (rule_name, start_at);
+
+        CREATE INDEX IF NOT EXISTS rule_state_intervals_start_idx
+        ON rule_state_intervals (start_at);
+        """
+        with self._connection, self._connection.cursor() as curs:
             curs.execute(sql_template)
+            for resolution in RESOLUTIONS:
+                curs.execute(
+                    rollup_table_template.format(resolution=resolution)
+                )
+            if self._compact_intervals:
+                curs.execute(intervals_template)
+
+    @staticmethod
+    def dump_rule_meta(meta: RuleMeta) -> str:
+        data = meta.dict()
+        # fields added after rules were first stored are left out unless
+        # set, so that hashes of existing rules do not change
+        for name in RULE_META_OPTIONAL_FIELDS:
+            if not data.get(name):
+                data.pop(name, None)
+        schedule = data.get('schedule')
+        if schedule and schedule.get('adaptive', False) is None:
+            data['schedule'] = {
+                key: value for key, value in schedule.items()
+                if key != 'adaptive'
+            }
+        return json.dumps(data, cls=JSONEncoder, sort_keys=True)
+
+    @staticmethod
+    def get_rule_hash(meta: str) -> str:
+        return hashlib.sha1(meta.encode('utf-8')).hexdigest()
+
+    def _write_rules(self, curs, rules: Dict[str, str]) -> List[str]:
+        """
+        Insert rule definitions which were not seen by this process yet.
+        Returns their hashes, known only once the transaction is committed.
+        """
+        new_rules = [
+            (rule_hash, meta)
+            for rule_hash, meta in rules.items()
+            if rule_hash not in self._known_rule_hashes
+        ]
+        if not new_rules:
+            return []
+        execute_values(
+            curs,
+            """
+            INSERT INTO rules (hash, meta) VALUES %s
+            ON CONFLICT (hash) DO NOTHING
+            """,
+            new_rules,
+        )
+        return [rule_hash for rule_hash, _ in new_rules]
 
     def write_many(self, items: List[MonitoredEvent]):
-        """Using efficient `psycopg2.extra.execute_values` for bulk insert."""
+        self.write_batch(RecordBatch.from_models(MonitoredEvent, items))
+
+    def write_batch(self, batch: RecordBatch) -> RecordBatch:
+        """
+        Using efficient `psycopg2.extra.execute_values` for bulk insert.
+        Events are written once per `event_id`, so redelivered batches can
+        be written again safely.
+        """
         sql_template = """
             INSERT INTO events (
                 latency, http_status, success, regex_match,
-                timestamp, url, rule_name, meta
+                timestamp, url, rule_name, rule_hash, check_interval,
+                event_id, transition
             )
             VALUES %s
         """
-        with self._connection.cursor() as curs:
-            execute_values(
-                curs, sql_template,
-                [
-                    (
-                        event.latency,
-                        event.http_status,
-                        event.success,
-                        event.regex_match,
-                        event.timestamp,
-                        event.url,
-                        event.rule_name,
-                        json.dumps(event.meta.dict(), cls=JSONEncoder),
+        new_rule_hashes: List[str] = []
+        connection = self._get_connection()
+        try:
+            with connection, connection.cursor() as curs:
+                batch = self._insert_event_ids(curs, batch)
+                if len(batch):
+                    new_rule_hashes = self._write_events(
+                        curs, sql_template, batch,
                     )
-                    for event in items],
+                self._maybe_prune(curs)
+        except self._connection_errors:
+            self._drop_connection()
+            raise
+        self._known_rule_hashes.update(new_rule_hashes)
+        return batch
+
+    def _get_connection(self):
+        """The connection of writes, reopened if it was dropped."""
+        if self._connection is None:
+            import psycopg2
+            self._connection = psycopg2.connect(self._dsn)
+            logger.info('Reconnected to the events storage')
+        return self._connection
+
+    def _drop_connection(self):
+        logger.warning(
+            'Lost connection to the events storage, reconnecting on next '
+            'write',
+        )
+        try:
+            self._connection.close()
+        except Exception:
+            logger.debug('Failed to close the connection', exc_info=True)
+        self._connection = None
+
+    def _write_events(self,
+                      curs,
+                      sql_template: str,
+                      batch: RecordBatch) -> List[str]:
+        # identical meta of a decoded batch is shared between rows,
+        # so it is serialized and hashed once per object
+        meta_hashes: Dict[int, str] = {}
+        rules: Dict[str, str] = {}
+        rule_hashes = []
+        for meta in batch['meta']:
+            rule_hash = meta_hashes.get(id(meta))
+            if rule_hash is None:
+                meta_json = self.dump_rule_meta(meta)
+                rule_hash = meta_hashes[id(meta)] = \
+                    self.get_rule_hash(meta_json)
+                rules[rule_hash] = meta_json
+            rule_hashes.append(rule_hash)
+        event_ids = [
+            None if event_id is None else str(event_id)
+            for event_id in batch['event_id']
+        ]
+        new_rule_hashes = self._write_rules(curs, rules)
+        transitions: Optional[Set[int]] = None
+        if self._compact_intervals:
+            transitions = set(self._write_intervals(curs, batch))
+        keep_all = transitions is None or self._raw_window_seconds != 0
+        rows = [
+            row + (None if transitions is None else index in transitions, )
+            for index, row in enumerate(zip(
+                batch['latency'], batch['http_status'], batch['success'],
+                batch['regex_match'], batch['timestamp'], batch['url'],
+                batch['rule_name'], rule_hashes, batch['check_interval'],
+                event_ids,
+            ))
+            if keep_all or index in transitions
+        ]
+        if rows:
+            execute_values(curs, sql_template, rows)
+        for resolution in RESOLUTIONS:
+            self._write_rollups(
+                curs, resolution, aggregate_rollups(batch, resolution),
+            )
+        return new_rule_hashes
+
+    @staticmethod
+    def _insert_event_ids(curs, batch: RecordBatch) -> RecordBatch:
+        """
+        Insert ids of the batch events into `event_ids` and return only
+        the events whose id was inserted, dropping events stored already
+        or repeated in the batch, e.g. redelivered by Kafka. A concurrent
+        transaction inserting the same id waits for this one and skips
+        it. Events without an id are always written.
+        """
+        event_ids = batch['event_id']
+        # index of the first event of every id
+        first_indexes: Dict[str, int] = {}
+        for index, event_id in enumerate(event_ids):
+            if event_id is not None:
+                first_indexes.setdefault(str(event_id), index)
+        if not first_indexes:
+            return batch
+        timestamps = batch['timestamp']
+        inserted = execute_values(
+            curs,
+            """
+            INSERT INTO event_ids (event_id, timestamp) VALUES %s
+            ON CONFLICT (event_id) DO NOTHING
+            RETURNING event_id
+            """,
+            # in order of ids, so concurrent inserts do not deadlock
+            [
+                (event_id, timestamps[index])
+                for event_id, index in sorted(first_indexes.items())
+            ],
+            fetch=True,
+        )
+        new_indexes = {
+            first_indexes[str(event_id)] for event_id, in inserted
+        }
+        indexes = [
+            index for index, event_id in enumerate(event_ids)
+            if event_id is None or index in new_indexes
+        ]
+        if len(indexes) == len(event_ids):
+            return batch
+        DUPLICATE_EVENTS.inc(len(event_ids) - len(indexes))
+        return batch.take(indexes)
+
+    def _write_intervals(self, curs, batch: RecordBatch) -> List[int]:
+        """
+        Extend stored open intervals of rules of the batch, which are
+        locked until the end of the transaction, and insert new ones.
+        Returns indexes of events which are state transitions.
+        """
+        curs.execute(
+            """
+            SELECT
+                rule_name, success, http_status, regex_match, start_at,
+                end_at, count, latency_count, latency_min, latency_max,
+                latency_sum, id
+            FROM rule_state_intervals
+            WHERE is_open AND rule_name = ANY(%s)
+            ORDER BY rule_name
+            FOR UPDATE
+            """,
+            (sorted(set(batch['rule_name'])), ),
+        )
+        open_intervals = {
+            row[0]: StateInterval(*row) for row in curs.fetchall()
+        }
+        changed, transitions = extend_intervals(open_intervals, batch)
+        updated = []
+        inserted = []
+        for interval in changed:
+            is_open = open_intervals.get(interval.rule_name) is interval
+            row = (
+                interval.end, interval.count, interval.latency_count,
+                interval.latency_min, interval.latency_max,
+                interval.latency_sum, is_open,
+            )
+            if interval.id is None:
+                inserted.append((
+                    interval.rule_name, interval.success,
+                    interval.http_status, interval.regex_match,
+                    interval.start,
+                ) + row)
+            else:
+                updated.append((interval.id, ) + row)
+        if updated:
+            execute_values(
+                curs,
+                """
+                UPDATE rule_state_intervals AS i SET
+                    end_at = v.end_at, count = v.count,
+                    latency_count = v.latency_count,
+                    latency_min = v.latency_min, latency_max = v.latency_max,
+                    latency_sum = v.latency_sum, is_open = v.is_open
+                FROM (VALUES %s) AS v (
+                    id, end_at, count, latency_count, latency_min,
+                    latency_max, latency_sum, is_open
+                )
+                WHERE i.id = v.id
+                """,
+                updated,
+                template=(
+                    '(%s, %s::timestamp, %s, %s, %s::float, %s::float, '
+                    '%s, %s)'
+                ),
+            )
+        if inserted:
+            execute_values(
+                curs,
+                """
+                INSERT INTO rule_state_intervals (
+                    rule_name, success, http_status, regex_match, start_at,
+                    end_at, count, latency_count, latency_min, latency_max,
+                    latency_sum, is_open
+                )
+                VALUES %s
+                """,
+                inserted,
+            )
+        return transitions
+
+    def _maybe_prune(self, curs):
+        """
+        Delete raw events older than the window except transitions and
+        ids of events older than the dedup window.
+        """
+        prune_events = self._compact_intervals and self._raw_window_seconds
+        if not prune_events and self._dedup_window_seconds is None:
+            return
+        now = time.monotonic()
+        if now - self._pruned_at < self.PRUNE_INTERVAL_SECONDS:
+            return
+        self._pruned_at = now
+        if prune_events:
+            curs.execute(
+                'DELETE FROM events WHERE NOT transition AND timestamp < %s',
+                (
+                    datetime.datetime.now() -
+                    datetime.timedelta(seconds=self._raw_window_seconds),
+                ),
+            )
+            logger.debug('Pruned %s raw events', curs.rowcount)
+        if self._dedup_window_seconds is not None:
+            curs.execute(
+                'DELETE FROM event_ids WHERE timestamp < %s',
+                (
+                    datetime.datetime.now() -
+                    datetime.timedelta(seconds=self._dedup_window_seconds),
+                ),
+            )
+            logger.debug('Pruned %s event ids', curs.rowcount)
+
+    @staticmethod
+    def _write_rollups(curs, resolution: str,
+                       rollups: Dict[RollupKey, Rollup]):
+        """
+        Rollups are additive, so buckets already stored (e.g. for late
+        events) are merged with the new ones instead of being replaced.
+        """
+        sql_template = f"""
+            INSERT INTO rollups_{resolution} AS r (
+                rule_name, bucket, count, success_count, regex_failures,
+                latency_count, latency_min, latency_max, latency_sum,
+                latency_sketch
+            )
+            VALUES %s
+            ON CONFLICT (rule_name, bucket) DO UPDATE SET
+                count = r.count + EXCLUDED.count,
+                success_count = r.success_count + EXCLUDED.success_count,
+                regex_failures = r.regex_failures + EXCLUDED.regex_failures,
+                latency_count = r.latency_count + EXCLUDED.latency_count,
+                latency_min = LEAST(r.latency_min, EXCLUDED.latency_min),
+                latency_max = GREATEST(r.latency_max, EXCLUDED.latency_max),
+                latency_sum = r.latency_sum + EXCLUDED.latency_sum,
+                latency_sketch = merge_latency_sketch(
+                    r.latency_sketch, EXCLUDED.latency_sketch
+                )
+        """
+        # sorted to always lock rows in the same order between consumers
+        execute_values(
+            curs, sql_template,
+            [
+                (
+                    rule_name, bucket, rollup.count, rollup.success_count,
+                    rollup.regex_failures, rollup.latency_count,
+                    rollup.latency_min, rollup.latency_max,
+                    rollup.latency_sum,
+                    json.dumps(rollup.latency_sketch.to_dict()),
+                )
+                for (rule_name, bucket), rollup in sorted(rollups.items())
+            ],
+        )
+
+    def read_rollups(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     resolution: str = HOUR,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f'Unknown rollup resolution {resolution}')
+        sql_template = f"""
+            SELECT
+                rule_name, bucket, count, success_count, regex_failures,
+                latency_count, latency_min, latency_max, latency_sum,
+                latency_sketch
+            FROM rollups_{resolution}
+            WHERE bucket >= %(start)s AND bucket < %(end)s
+            AND (%(rule_name)s IS NULL OR rule_name = %(rule_name)s)
+        """
+        with self._read_connection() as connection, \
+                connection.cursor() as curs:
+            curs.execute(
+                sql_template,
+                {'start': start, 'end': end, 'rule_name': rule_name},
+            )
+            rows = curs.fetchall()
+        return merge_rollups(
+            (
+                (row[0], row[1]),
+                Rollup(
+                    *row[2:9],
+                    latency_sketch=LatencySketch.from_dict(row[9]),
+                ),
+            )
+            for row in rows
+        )
+
+    def read_latest(self,
+                    limit_per_rule: int,
+                    since: datetime.datetime) -> RecordBatch:
+        sql_template = """
+            SELECT
+                url, rule_name, timestamp, latency, http_status, success,
+                regex_match, check_interval, event_id, meta
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY rule_name ORDER BY timestamp DESC
+                ) AS position
+                FROM events_with_meta
+                WHERE timestamp >= %(since)s
+            ) AS latest
+            WHERE position <= %(limit)s
+            ORDER BY timestamp
+        """
+        with self._read_connection() as connection, \
+                connection.cursor() as curs:
+            curs.execute(
+                sql_template, {'since': since, 'limit': limit_per_rule},
+            )
+            names = [column.name for column in curs.description]
+            rows = [dict(zip(names, row)) for row in curs.fetchall()]
+        return decode_batch(MonitoredEvent, rows)
+
+    def read_events_page(self,
+                         limit: int,
+                         after: Optional[EventCursor] = None,
+                         rule_name: Optional[str] = None,
+                         start: Optional[datetime.datetime] = None,
+                         end: Optional[datetime.datetime] = None,
+                         ) -> RecordBatch:
+        after_timestamp, after_rule_name, after_event_id = \
+            after or (None, None, None)
+        sql_template = """
+            SELECT
+                url, rule_name, timestamp, latency, http_status, success,
+                regex_match, check_interval, event_id, meta
+            FROM events_with_meta
+            WHERE (%(rule_name)s IS NULL OR rule_name = %(rule_name)s)
+            AND (%(start)s IS NULL OR timestamp >= %(start)s)
+            AND (%(end)s IS NULL OR timestamp < %(end)s)
+            AND (
+                %(after_timestamp)s IS NULL OR
+                (timestamp, rule_name, COALESCE(event_id::text, '')) > (
+                    %(after_timestamp)s, %(after_rule_name)s,
+                    %(after_event_id)s
+                )
+            )
+            ORDER BY timestamp, rule_name, COALESCE(event_id::text, '')
+            LIMIT %(limit)s
+        """
+        with self._read_connection() as connection, \
+                connection.cursor() as curs:
+            curs.execute(sql_template, {
+                'rule_name': rule_name,
+                'start': start,
+                'end': end,
+                'after_timestamp': after_timestamp,
+                'after_rule_name': after_rule_name,
+                'after_event_id': after_event_id,
+                'limit': limit,
+            })
+            names = [column.name for column in curs.description]
+            rows = [dict(zip(names, row)) for row in curs.fetchall()]
+        return decode_batch(MonitoredEvent, rows)
+
+    def read_intervals(self,
+                       start: datetime.datetime,
+                       end: datetime.datetime,
+                       rule_name: Optional[str] = None,
+                       ) -> List[StateInterval]:
+        if not self._compact_intervals:
+            raise NotImplementedError
+        sql_template = """
+            SELECT
+                rule_name, success, http_status, regex_match, start_at,
+                end_at, count, latency_count, latency_min, latency_max,
+                latency_sum, id
+            FROM rule_state_intervals
+            WHERE start_at < %(end)s AND end_at >= %(start)s
+            AND (%(rule_name)s IS NULL OR rule_name = %(rule_name)s)
+            ORDER BY rule_name, start_at
+        """
+        with self._read_connection() as connection, \
+                connection.cursor() as curs:
+            curs.execute(
+                sql_template,
+                {'start': start, 'end': end, 'rule_name': rule_name},
             )
+            return [StateInterval(*row) for row in curs.fetchall()]
+
+    def _iter_columns(self, sql_template: str, params: Dict,
+                      chunk_size: int) -> Iterator[Columns]:
+        """Rows of a query in column chunks read by a server-side cursor."""
+        name = f'columns_reader_{next(self._cursor_names)}'
+        with self._read_connection() as connection, \
+                connection.cursor(name=name) as curs:
+            curs.itersize = chunk_size
+            curs.execute(sql_template, params)
+            while True:
+                rows = curs.fetchmany(chunk_size)
+                if not rows:
+                    return
+                names = [column.name for column in curs.description]
+                yield dict(zip(names, map(list, zip(*rows))))
+
+    def iter_event_columns(self,
+                           start: datetime.datetime,
+                           end: datetime.datetime,
+                           chunk_size: int = 100000) -> Iterator[Columns]:
+        sql_template = """
+            SELECT
+                rule_name,
+                (EXTRACT(EPOCH FROM timestamp) * 1000000)::bigint
+                AS timestamp_us,
+                latency, success
+            FROM events
+            WHERE timestamp >= %(start)s AND timestamp < %(end)s
+            ORDER BY timestamp, rule_name
+        """
+        return self._iter_columns(
+            sql_template, {'start': start, 'end': end}, chunk_size,
+        )
+
+    def iter_rollup_columns(self,
+                            start: datetime.datetime,
+                            end: datetime.datetime,
+                            resolution: str = HOUR,
+                            chunk_size: int = 100000) -> Iterator[Columns]:
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f'Unknown rollup resolution {resolution}')
+        sql_template = f"""
+            SELECT rule_name, count, success_count, latency_sketch
+            FROM rollups_{resolution}
+            WHERE bucket >= %(start)s AND bucket < %(end)s
+        """
+        return self._iter_columns(
+            sql_template, {'start': start, 'end': end}, chunk_size,
+        )
 
 
 class MockedEventsStorage(BaseStorage):
     def __init__(self, **configs):
         super().__init__(**configs)
         self._data = []
+        self._rollups: Dict[str, Dict[RollupKey, Rollup]] = {
+            resolution: {} for resolution in RESOLUTIONS
+        }
+        self._intervals: List[StateInterval] = []
+        self._open_intervals: Dict[str, StateInterval] = {}
 
     def write_many(self, items: List[MonitoredEvent]):
         _items = [event.dict() for event in items]
-        logger.info(f'Writing items {_items} to db')
+        logger.debug('Writing %s items to db', len(_items))
         self._data += _items
+        batch = RecordBatch.from_models(MonitoredEvent, items)
+        for resolution in RESOLUTIONS:
+            rollups = self._rollups[resolution]
+            for key, rollup in aggregate_rollups(batch, resolution).items():
+                if key in rollups:
+                    rollups[key].merge(rollup)
+                else:
+                    rollups[key] = rollup
+        changed, _ = extend_intervals(self._open_intervals, batch)
+        for interval in changed:
+            if interval.id is None:
+                interval.id = len(self._intervals)
+                self._intervals.append(interval)
+
+    def read_latest(self,
+                    limit_per_rule: int,
+                    since: datetime.datetime) -> RecordBatch:
+        batch = decode_batch(MonitoredEvent, [
+            item for item in self._data if item['timestamp'] >= since
+        ])
+        return select_latest(batch, limit_per_rule)
+
+    def read_events_page(self,
+                         limit: int,
+                         after: Optional[EventCursor] = None,
+                         rule_name: Optional[str] = None,
+                         start: Optional[datetime.datetime] = None,
+                         end: Optional[datetime.datetime] = None,
+                         ) -> RecordBatch:
+        batch = decode_batch(MonitoredEvent, self._data)
+        return select_page(
+            filter_events(batch, rule_name, start, end), limit, after,
+        )
+
+    def read_rollups(self,
+                     start: datetime.datetime,
+                     end: datetime.datetime,
+                     resolution: str = HOUR,
+                     rule_name: Optional[str] = None) -> Dict[str, Rollup]:
+        return merge_rollups(
+            filter_rollups(self._rollups[resolution], start, end, rule_name)
+        )
+
+    def read_intervals(self,
+                       start: datetime.datetime,
+                       end: datetime.datetime,
+                       rule_name: Optional[str] = None,
+                       ) -> List[StateInterval]:
+        return sorted(
+            (
+                interval for interval in self._intervals
+                if interval.start < end and interval.end >= start and
+                rule_name in (None, interval.rule_name)
+            ),
+            key=lambda interval: (interval.rule_name, interval.start),
+        )
 
 
 _storage: Optional[BaseStorage] = None
@@ -1,13 +1,57 @@
+import base64
+import datetime
+import http.client
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
 
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import List
 from unittest import mock
 
-from consumer.consume import initialize_consumer, get_consumer, MockedConsumer
+from freezegun import freeze_time
+
+from consumer.alerts import Alert, AlertEvaluator, FileAlertSink, \
+    MockedAlertSink, CONSECUTIVE_FAILURES, FAILURE_RATIO, SLOW_RESPONSE, \
+    FIRING, RESOLVED
+from consumer.api import ResponseCache, get_response_cache, \
+    initialize_response_cache, start_api_server
+from consumer.consume import initialize_consumer, get_consumer, \
+    FileConsumer, MockedConsumer
 from consumer.storage import initialize_storage, get_storage, \
-    MockedEventsStorage
+    MockedEventsStorage, PostgresEventsStorage, select_latest
+from consumer.dead_letter import DeadLetter, FileDeadLetterQueue, \
+    MockedDeadLetterQueue, get_dead_letter_queue, get_raw_message, \
+    initialize_dead_letter_queue
+from consumer.event_writer import EventWriteBuffer, WRITTEN_ROWS
+from consumer.fallback import FallbackStorage
 from consumer.main import start_consumer
+from consumer.replay import ReplayLedger, iter_file_chunks, \
+    iter_kafka_chunks, main as replay_main, replay
+from consumer.reports import Downtime, build_report, main as report_main
+from consumer.intervals import StateInterval, extend_intervals
+from consumer.rollups import aggregate_rollups, merge_rollups, \
+    split_range, MINUTE, HOUR
+from consumer.segments import SegmentEventsStorage, read_block_header
+from consumer.sketch import LatencySketch
+from consumer.state import RuleStateCache, get_state_cache, \
+    initialize_state_cache, warm_state_cache
+from schema_registry.batch import RecordBatch
 from schema_registry.models import MonitoredEvent
+from schema_registry.models.monitoring_event import RuleMeta
 from schema_registry.constants import TOPIC
+from schema_registry.exceptions import SchemaNotFound
+from schema_registry.utils import pydantic_to_json_serializer
 
 TIMEOUT_CONSUMER_MS = 5
 SLEEP_INTERVAL = (TIMEOUT_CONSUMER_MS + 2) / 1000.0
@@ -18,6 +62,28 @@ MOCKED_CONSUMER_CONFIG = {
     'timeout_ms': TIMEOUT_CONSUMER_MS,
     'custom_config_var': 'test',
 }
+# modules only the configured backends need, kept out of a mocked startup
+BACKEND_MODULES = ('kafka', 'psycopg2')
+STARTUP_SCRIPT = """
+import json, os, sys
+import consumer.main
+from consumer.consume import MockedConsumer
+
+def get_imported(names):
+    return sorted(name for name in names if name in sys.modules)
+
+imported = get_imported(%(modules)r)
+
+def first_poll(self, **kwargs):
+    print(json.dumps({
+        'imported_on_import': imported,
+        'imported_on_first_poll': get_imported(%(modules)r),
+    }), flush=True)
+    os._exit(0)
+
+MockedConsumer.poll = first_poll
+consumer.main.start_consumer()
+""" % {'modules': BACKEND_MODULES}
 
 
 class ConsumerTest(unittest.TestCase):
@@ -27,6 +93,7 @@ class ConsumerTest(unittest.TestCase):
             MockedConsumer,
             **MOCKED_CONSUMER_CONFIG
         )
+        initialize_dead_letter_queue(MockedDeadLetterQueue)
 
     def test_consumer_initialized_globally_with_config(self):
         initialize_consumer(
@@ -61,12 +128,12 @@ class ConsumerTest(unittest.TestCase):
         batches = list(consumer.run())
 
         self.assertEqual(len(batches), 1)
-        topic, messages = batches[0]
+        topic, batch = batches[0]
         self.assertEqual(topic, TOPIC.SiteAvailabilityMonitoring)
-        self.assertEqual(len(messages), 1)
+        self.assertEqual(len(batch), 1)
         self.maxDiff = None
         self.assertEqual(
-            messages[0],
+            batch.to_models()[0],
             MonitoredEvent(**MockedConsumer.get_fake_payload())
         )
 
@@ -82,16 +149,1304 @@ class ConsumerTest(unittest.TestCase):
             }
         )
     )
-    def test__consumer__run__data_validation__logged_exception(self):
+    def test__consumer__run__data_validation__dead_letter(self):
         consumer = get_consumer()
 
-        with mock.patch('consumer.consume.logger') as logger_mock:
+        with mock.patch.object(
+                consumer._validation_errors, '_logger',
+        ) as logger_mock:
             batches = list(consumer.run())
 
         self.assertEqual(len(batches), 1)
-        logger_mock.exception.assert_called_once_with(
-            f'Validation error for message against {MonitoredEvent}'
+        _, batch = batches[0]
+        self.assertEqual(len(batch), 1)
+        (letter, ) = get_dead_letter_queue()._sent_data
+        self.assertEqual(letter.topic, TOPIC.SiteAvailabilityMonitoring)
+        self.assertIn(b'MagicMock', letter.raw)
+        self.assertIn('mapping', letter.error)
+        logger_mock.warning.assert_called_once_with(
+            '%s: %s error(s), last error: %s',
+            'Invalid messages sent to dead letter queue', 1, letter.error,
+        )
+
+    def test_file_consumer__follows_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'events.jsonl'
+            line = pydantic_to_json_serializer(
+                MonitoredEvent(**MockedConsumer.get_fake_payload()),
+            )
+            path.write_bytes(line + b'\n\n' + line + b'\n' + line[:10])
+            consumer = FileConsumer(
+                [TOPIC.SiteAvailabilityMonitoring], 0, file_path=path,
+                max_poll_records=1,
+            )
+            self.addCleanup(consumer.close)
+
+            polls = [consumer.poll() for _ in range(3)]
+            with open(path, 'ab') as f:
+                f.write(line[10:] + b'\n')
+            polls.append(consumer.poll())
+
+        self.assertEqual(polls, [
+            {TOPIC.SiteAvailabilityMonitoring: [line]},
+            {TOPIC.SiteAvailabilityMonitoring: [line]},
+            {},
+            {TOPIC.SiteAvailabilityMonitoring: [line]},
+        ])
+
+
+class DeadLetterQueueTest(unittest.TestCase):
+
+    def test_file_dead_letter_queue(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory) / 'dead-letters.jsonl'
+            queue = FileDeadLetterQueue('.dead-letter', file_path)
+            self.addCleanup(queue.close)
+
+            queue.send_many([
+                DeadLetter('test', b'\xffbad', 'Invalid'),
+                DeadLetter('test', get_raw_message({'a': 1}), 'Invalid'),
+            ])
+
+            with open(file_path) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['topic'], 'test.dead-letter')
+        self.assertEqual(lines[0]['error'], 'Invalid')
+        self.assertEqual(base64.b64decode(lines[0]['raw']), b'\xffbad')
+        self.assertEqual(base64.b64decode(lines[1]['raw']), b'{"a": 1}')
+
+
+class EventWriteBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MockedEventsStorage()
+        self.consumer = mock.MagicMock()
+        self.event = MonitoredEvent(**MockedConsumer.get_fake_payload())
+
+    def get_batch(self, size: int) -> RecordBatch:
+        return RecordBatch.from_models(MonitoredEvent, [self.event] * size)
+
+    def test_flush_on_max_rows__written_in_chunks(self):
+        buffer = EventWriteBuffer(
+            self.storage, self.consumer,
+            max_rows=2, max_bytes=1024, max_latency_ms=60000,
+        )
+
+        buffer.add(self.get_batch(1))
+        self.assertFalse(buffer.is_full())
+        buffer.add(self.get_batch(2))
+        self.assertTrue(buffer.is_full())
+
+        written_rows = WRITTEN_ROWS.value
+        with mock.patch.object(
+                self.storage, 'write_batch',
+                wraps=self.storage.write_batch,
+        ) as write_batch_mock:
+            buffer.flush()
+
+        self.assertEqual(
+            [len(call[0][0]) for call in write_batch_mock.call_args_list],
+            [2, 1],
+        )
+        self.assertEqual(len(self.storage._data), 3)
+        self.assertEqual(WRITTEN_ROWS.value - written_rows, 3)
+        self.assertEqual(len(buffer), 0)
+        self.consumer.commit.assert_called_once_with()
+
+    def test_flush_on_max_bytes(self):
+        buffer = EventWriteBuffer(
+            self.storage, self.consumer,
+            max_rows=100, max_bytes=1024, max_latency_ms=60000,
+        )
+        batch = self.get_batch(1)
+        batch.nbytes = 1024
+
+        buffer.add(batch)
+
+        self.assertTrue(buffer.is_full())
+
+    def test_flush_on_max_latency(self):
+        buffer = EventWriteBuffer(
+            self.storage, self.consumer,
+            max_rows=100, max_bytes=1024, max_latency_ms=1000,
+        )
+
+        with mock.patch('consumer.event_writer.time.monotonic') as time_mock:
+            time_mock.return_value = 10.0
+            buffer.add(self.get_batch(1))
+            buffer.add(self.get_batch(1))
+            time_mock.return_value = 10.5
+            self.assertFalse(buffer.is_full())
+            time_mock.return_value = 11.0
+            self.assertTrue(buffer.is_full())
+
+    def test_flush__listeners_get_written_rows(self):
+        listener = mock.Mock()
+        buffer = EventWriteBuffer(
+            self.storage, self.consumer,
+            max_rows=2, max_bytes=1024, max_latency_ms=0,
+            listeners=[listener],
+        )
+        buffer.add(self.get_batch(3))
+        written = self.get_batch(1)
+
+        with mock.patch.object(
+                self.storage, 'write_batch',
+                side_effect=[written, self.get_batch(0)],
+        ):
+            buffer.flush()
+
+        listener.assert_called_once_with(written)
+        self.consumer.commit.assert_called_once_with()
+
+    def test_empty_flush_does_not_commit(self):
+        buffer = EventWriteBuffer(
+            self.storage, self.consumer,
+            max_rows=100, max_bytes=1024, max_latency_ms=0,
+        )
+
+        buffer.add(self.get_batch(0))
+        self.assertFalse(buffer.is_full())
+        buffer.flush()
+
+        self.consumer.commit.assert_not_called()
+
+    def test_flush__only_invalid_messages_committed(self):
+        buffer = EventWriteBuffer(
+            self.storage, self.consumer,
+            max_rows=100, max_bytes=1024, max_latency_ms=60000,
+        )
+        batch = self.get_batch(0)
+        batch.errors.append((0, 'invalid'))
+
+        buffer.add(batch)
+        self.assertTrue(buffer.is_full())
+        buffer.flush()
+        buffer.flush()
+
+        self.assertEqual(len(self.storage._data), 0)
+        self.consumer.commit.assert_called_once_with()
+
+
+class AlertsTest(unittest.TestCase):
+
+    @staticmethod
+    def get_batch(results, latency=0.25, start_minute=0):
+        payload = MockedConsumer.get_fake_payload()
+        return RecordBatch.from_models(MonitoredEvent, [
+            MonitoredEvent(**dict(
+                payload,
+                timestamp=payload['timestamp'] + datetime.timedelta(
+                    minutes=start_minute + i,
+                ),
+                success=success,
+                latency=latency,
+            ))
+            for i, success in enumerate(results)
+        ])
+
+    def get_alerts(self, evaluator, batch):
+        sink = evaluator._sink
+        sent = len(sink._sent_data)
+        evaluator.update(batch)
+        return [
+            (alert.kind, alert.state, alert.value)
+            for alert in sink._sent_data[sent:]
+        ]
+
+    def test_consecutive_failures(self):
+        evaluator = AlertEvaluator(
+            MockedAlertSink(), consecutive_failures=2, min_window_count=100,
+        )
+
+        self.assertEqual(
+            self.get_alerts(evaluator, self.get_batch([True, False])), [],
+        )
+        self.assertEqual(
+            self.get_alerts(
+                evaluator, self.get_batch([False, False], start_minute=2),
+            ),
+            [(CONSECUTIVE_FAILURES, FIRING, 2)],
+        )
+        self.assertEqual(
+            self.get_alerts(evaluator, self.get_batch([True], start_minute=4)),
+            [(CONSECUTIVE_FAILURES, RESOLVED, 0)],
+        )
+
+    def test_failure_ratio_over_window(self):
+        evaluator = AlertEvaluator(
+            MockedAlertSink(), consecutive_failures=100, failure_ratio=0.5,
+            window_minutes=4, min_window_count=3,
+        )
+
+        alerts = self.get_alerts(
+            evaluator, self.get_batch([False, True, False, True]),
+        )
+        self.assertEqual(alerts, [(FAILURE_RATIO, FIRING, 2 / 3)])
+        # minute 0 leaves the window
+        alerts = self.get_alerts(
+            evaluator, self.get_batch([True, True, True], start_minute=4),
+        )
+        self.assertEqual(alerts, [(FAILURE_RATIO, RESOLVED, 0.25)])
+        # too late for the window of minutes 3-6
+        self.get_alerts(evaluator, self.get_batch([False] * 3))
+        state = evaluator._states['fake-rule']
+        self.assertEqual(
+            (state.window_count, state.window_failures), (4, 0),
+        )
+        self.get_alerts(evaluator, self.get_batch([False], start_minute=60))
+        self.assertEqual(
+            (state.window_count, state.window_failures), (1, 1),
+        )
+
+    def test_slow_response(self):
+        evaluator = AlertEvaluator(MockedAlertSink(), latency_threshold=1.0)
+
+        self.assertEqual(
+            self.get_alerts(evaluator, self.get_batch([True], latency=2.0)),
+            [(SLOW_RESPONSE, FIRING, 2.0)],
+        )
+        self.assertEqual(
+            self.get_alerts(evaluator, self.get_batch([True], latency=None)),
+            [],
+        )
+        self.assertEqual(
+            self.get_alerts(evaluator, self.get_batch([True], latency=0.5)),
+            [(SLOW_RESPONSE, RESOLVED, 0.5)],
+        )
+
+    def test_file_alert_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory) / 'alerts.jsonl'
+            sink = FileAlertSink(file_path)
+            self.addCleanup(sink.close)
+
+            sink.send_many([Alert(
+                'fake-rule', FAILURE_RATIO, FIRING,
+                datetime.datetime(2020, 12, 13, 10, 0), 0.5,
+            )])
+
+            with open(file_path) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, [{
+            'rule_name': 'fake-rule',
+            'kind': FAILURE_RATIO,
+            'state': FIRING,
+            'timestamp': '2020-12-13T10:00:00',
+            'value': 0.5,
+        }])
+
+
+class RollupsTest(unittest.TestCase):
+
+    def test_sketch_quantiles_within_relative_accuracy(self):
+        sketch = LatencySketch()
+        values = [i / 1000.0 for i in range(1, 1001)]
+        for value in values:
+            sketch.add(value)
+
+        for q in (0.5, 0.95, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - expected) / expected,
+                LatencySketch.RELATIVE_ACCURACY,
+            )
+        self.assertIsNone(LatencySketch().quantile(0.5))
+
+    def test_sketch_serialization(self):
+        sketch = LatencySketch()
+        sketch.add(0.25)
+        sketch.add(0)
+
+        self.assertEqual(
+            LatencySketch.from_dict(json.loads(json.dumps(sketch.to_dict()))),
+            sketch,
+        )
+
+    def test_sketch_buckets_bounded(self):
+        sketch = LatencySketch()
+        with mock.patch.object(LatencySketch, 'MAX_BUCKETS', 10):
+            for i in range(1, 101):
+                sketch.add(i / 10.0)
+            sketch.merge(LatencySketch({-100: 1}))
+
+        self.assertEqual(len(sketch.counts), 10)
+        self.assertEqual(len(sketch), 101)
+        self.assertAlmostEqual(sketch.quantile(1), 10, delta=0.1)
+
+    def test_split_range(self):
+        def at(hour, minute=0, second=0):
+            return datetime.datetime(2020, 12, 13, hour, minute, second)
+
+        self.assertEqual(
+            split_range(at(10, 30, 15), at(13, 5)),
+            [
+                (MINUTE, at(10, 30), at(11)),
+                (HOUR, at(11), at(13)),
+                (MINUTE, at(13), at(13, 5)),
+            ],
         )
+        self.assertEqual(split_range(at(10), at(12)), [(HOUR, at(10), at(12))])
+        self.assertEqual(
+            split_range(at(10, 5), at(10, 6, 30)),
+            [(MINUTE, at(10, 5), at(10, 6, 30))],
+        )
+        self.assertEqual(split_range(at(10), at(10)), [])
+
+    def test_read_summary_merges_resolutions(self):
+        payload = MockedConsumer.get_fake_payload()
+        events = [
+            MonitoredEvent(**dict(
+                payload, timestamp=datetime.datetime(2020, 12, 13, 10, 0) +
+                datetime.timedelta(minutes=20 * i), latency=i / 10.0,
+            ))
+            for i in range(1, 10)
+        ]
+        storage = MockedEventsStorage()
+        storage.write_many(events)
+
+        with mock.patch.object(
+                storage, 'read_rollups', wraps=storage.read_rollups,
+        ) as read_mock:
+            summary = storage.read_summary(
+                datetime.datetime(2020, 12, 13, 10, 30),
+                datetime.datetime(2020, 12, 13, 12, 50),
+            )
+
+        self.assertEqual(
+            [call[0][2] for call in read_mock.call_args_list],
+            [MINUTE, HOUR, MINUTE],
+        )
+        rollup = summary['fake-rule']
+        self.assertEqual(rollup.count, 7)
+        self.assertEqual(rollup.latency_min, 0.2)
+        self.assertEqual(rollup.latency_max, 0.8)
+
+    def test_aggregate_rollups(self):
+        payload = MockedConsumer.get_fake_payload()
+        events = [
+            MonitoredEvent(**payload),
+            MonitoredEvent(**dict(
+                payload, latency=None, http_status=None, success=False,
+            )),
+            MonitoredEvent(**dict(
+                payload, latency=0.5, regex_match=False,
+                timestamp=datetime.datetime(2020, 12, 13, 10, 1, 0),
+            )),
+        ]
+
+        batch = RecordBatch.from_models(MonitoredEvent, events)
+        minute = aggregate_rollups(batch, MINUTE)
+        hour = aggregate_rollups(batch, HOUR)
+
+        self.assertEqual(len(minute), 2)
+        (key, rollup), = hour.items()
+        self.assertEqual(
+            key, ('fake-rule', datetime.datetime(2020, 12, 13, 10, 0, 0)),
+        )
+        self.assertEqual(rollup.count, 3)
+        self.assertEqual(rollup.success_count, 2)
+        self.assertEqual(rollup.regex_failures, 1)
+        self.assertEqual(rollup.latency_count, 2)
+        self.assertEqual(rollup.latency_min, 0.25)
+        self.assertEqual(rollup.latency_max, 0.5)
+        self.assertEqual(rollup.latency_avg, 0.375)
+        self.assertAlmostEqual(rollup.uptime, 2 / 3)
+
+    def test_mocked_storage__late_events_merged(self):
+        storage = MockedEventsStorage()
+        payload = MockedConsumer.get_fake_payload()
+        late_event = MonitoredEvent(**dict(payload, success=False))
+
+        storage.write_many([MonitoredEvent(**payload), ])
+        storage.write_many([late_event, ])
+
+        summary = storage.read_rollups(
+            start=datetime.datetime(2020, 12, 13),
+            end=datetime.datetime(2020, 12, 14),
+            resolution=MINUTE,
+        )
+        self.assertEqual(list(summary), ['fake-rule'])
+        self.assertEqual(summary['fake-rule'].count, 2)
+        self.assertEqual(summary['fake-rule'].uptime, 0.5)
+        self.assertEqual(
+            storage.read_rollups(
+                start=datetime.datetime(2020, 12, 14),
+                end=datetime.datetime(2020, 12, 15),
+            ),
+            {},
+        )
+
+
+def get_state_events(states: str, rule_name: str = 'fake-rule',
+                     first_second: int = 0) -> List[MonitoredEvent]:
+    """An event per second for every state: `s` success, `f` failure."""
+    payload = MockedConsumer.get_fake_payload()
+    return [
+        MonitoredEvent(**dict(
+            payload,
+            rule_name=rule_name,
+            timestamp=payload['timestamp'] + datetime.timedelta(
+                seconds=first_second + i,
+            ),
+            http_status=200 if state == 's' else 500,
+            success=state == 's',
+            latency=0.1 * (i + 1),
+        ))
+        for i, state in enumerate(states)
+    ]
+
+
+class IntervalsTest(unittest.TestCase):
+    def test_extend_intervals__runs_of_identical_states(self):
+        open_intervals = {}
+        batch = RecordBatch.from_models(
+            MonitoredEvent, get_state_events('ssffs'),
+        )
+
+        changed, transitions = extend_intervals(open_intervals, batch)
+
+        self.assertEqual(transitions, [0, 2, 4])
+        self.assertEqual(
+            [(i.success, i.count, i.start.second, i.end.second)
+             for i in changed],
+            [(True, 2, 0, 1), (False, 2, 2, 3), (True, 1, 4, 4)],
+        )
+        self.assertAlmostEqual(changed[1].latency_avg, 0.35)
+        self.assertIs(open_intervals['fake-rule'], changed[2])
+
+    def test_extend_intervals__open_interval_extended(self):
+        open_intervals = {}
+        extend_intervals(open_intervals, RecordBatch.from_models(
+            MonitoredEvent, get_state_events('ss'),
+        ))
+
+        changed, transitions = extend_intervals(
+            open_intervals,
+            RecordBatch.from_models(
+                MonitoredEvent, get_state_events('ss', first_second=2),
+            ),
+        )
+
+        (interval, ) = changed
+        self.assertEqual(transitions, [])
+        self.assertEqual((interval.count, interval.end.second), (4, 3))
+
+    def test_extend_intervals__replaced_open_interval_closed(self):
+        stored = StateInterval(
+            'fake-rule', True, 200, None,
+            datetime.datetime(2020, 12, 13, 9, 0, 0), count=10, id=42,
+        )
+        open_intervals = {'fake-rule': stored}
+
+        changed, transitions = extend_intervals(
+            open_intervals,
+            RecordBatch.from_models(MonitoredEvent, get_state_events('f')),
+        )
+
+        self.assertEqual(transitions, [0])
+        self.assertEqual(changed, [stored, open_intervals['fake-rule']])
+        self.assertFalse(open_intervals['fake-rule'].success)
+
+    def test_extend_intervals__late_event_kept_apart(self):
+        open_intervals = {}
+        extend_intervals(open_intervals, RecordBatch.from_models(
+            MonitoredEvent, get_state_events('ss', first_second=10),
+        ))
+
+        changed, transitions = extend_intervals(
+            open_intervals,
+            RecordBatch.from_models(MonitoredEvent, get_state_events('f')),
+        )
+
+        (late, ) = changed
+        self.assertEqual(transitions, [0])
+        self.assertFalse(late.success)
+        self.assertTrue(open_intervals['fake-rule'].success)
+
+    def test_mocked_storage__read_intervals(self):
+        storage = MockedEventsStorage()
+        storage.write_many(get_state_events('sssff'))
+        storage.write_many(get_state_events('f', first_second=5))
+        storage.write_many(get_state_events('s', rule_name='other'))
+
+        intervals = storage.read_intervals(
+            datetime.datetime(2020, 12, 13, 10, 0, 2),
+            datetime.datetime(2020, 12, 13, 11, 0, 0),
+            rule_name='fake-rule',
+        )
+
+        self.assertEqual(
+            [(i.success, i.count) for i in intervals],
+            [(True, 3), (False, 3)],
+        )
+
+
+class ReportsTest(unittest.TestCase):
+    start = datetime.datetime(2020, 12, 13, 10, 0, 0)
+    end = datetime.datetime(2020, 12, 13, 10, 1, 0)
+
+    def setUp(self):
+        self.storage = MockedEventsStorage()
+        self.storage.write_many(get_state_events('ssffsfffs'))
+        self.storage.write_many(get_state_events('sf', rule_name='other'))
+
+    def test_events_report__downtimes_across_chunks(self):
+        downtimes = []
+
+        report = build_report(
+            self.storage, self.start, self.end, chunk_size=2,
+            on_downtime=downtimes.append,
+        )
+
+        fake_rule, other = report.iter_rows()
+        self.assertEqual(
+            {key: fake_rule[key] for key in (
+                'checks', 'incidents', 'downtime_seconds', 'mttr_seconds',
+            )},
+            {
+                'checks': 9, 'incidents': 2, 'downtime_seconds': 5.0,
+                'mttr_seconds': 2.5,
+            },
+        )
+        self.assertAlmostEqual(fake_rule['uptime_percent'], 400 / 9)
+        sketch = LatencySketch()
+        for i in range(9):
+            sketch.add(0.1 * (i + 1))
+        self.assertAlmostEqual(fake_rule['latency_p50'], sketch.quantile(0.5))
+        self.assertAlmostEqual(
+            fake_rule['latency_p99'], sketch.quantile(0.99),
+        )
+        self.assertEqual(
+            (other['incidents'], other['mttr_seconds']), (1, None),
+        )
+        second = datetime.timedelta(seconds=1)
+        self.assertEqual(downtimes, [
+            Downtime('fake-rule', self.start + 2 * second,
+                     self.start + 4 * second, 2.0),
+            Downtime('fake-rule', self.start + 5 * second,
+                     self.start + 8 * second, 3.0),
+            Downtime('other', self.start + second, None, 59.0),
+        ])
+
+    def test_rollups_report__uptime_and_latency(self):
+        events_rows = list(
+            build_report(self.storage, self.start, self.end).iter_rows()
+        )
+
+        rows = list(build_report(
+            self.storage, self.start, self.end, source='rollups',
+            resolution=MINUTE, chunk_size=1,
+        ).iter_rows())
+
+        self.assertEqual(
+            rows,
+            [
+                dict(row, incidents=None, downtime_seconds=None,
+                     mttr_seconds=None)
+                for row in events_rows
+            ],
+        )
+
+    def test_main__csv_report_and_downtimes(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch(
+                'consumer.reports.initialize_storage',
+        ), mock.patch(
+            'consumer.reports.get_storage', return_value=self.storage,
+        ):
+            report_path = Path(directory) / 'report.csv'
+            downtime_path = Path(directory) / 'downtime.csv'
+            report_main([
+                '--start', self.start.isoformat(),
+                '--end', self.end.isoformat(),
+                '--output', str(report_path),
+                '--downtime-output', str(downtime_path),
+                '--format', 'csv',
+            ])
+            report_lines = report_path.read_text().splitlines()
+            downtime_lines = downtime_path.read_text().splitlines()
+
+        self.assertEqual(
+            report_lines[0],
+            'rule_name,checks,uptime_percent,incidents,downtime_seconds,'
+            'mttr_seconds,latency_p50,latency_p95,latency_p99',
+        )
+        self.assertTrue(report_lines[1].startswith('fake-rule,9,'))
+        self.assertEqual(len(report_lines), 3)
+        self.assertEqual(downtime_lines[0], 'rule_name,start,end,seconds')
+        self.assertEqual(
+            downtime_lines[3], 'other,2020-12-13T10:00:01,,59.0',
+        )
+
+
+class SegmentStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self._directory.name)
+        self.addCleanup(self._directory.cleanup)
+
+    def get_storage(self, **configs) -> SegmentEventsStorage:
+        storage = SegmentEventsStorage(
+            segments_directory=self.directory, **configs,
+        )
+        self.addCleanup(storage.close)
+        return storage
+
+    @staticmethod
+    def get_events(count: int, rule_names=('rule-a', 'rule-b')):
+        payload = MockedConsumer.get_fake_payload()
+        return [
+            MonitoredEvent(**dict(
+                payload,
+                rule_name=rule_names[i % len(rule_names)],
+                timestamp=payload['timestamp'] + datetime.timedelta(
+                    seconds=i, microseconds=i,
+                ),
+                latency=None if i % 5 == 0 else round(0.1234 + i / 1e3, 6),
+                http_status=None if i % 5 == 0 else 200,
+                success=i % 5 != 0,
+                regex_match=(None, True, False)[i % 3],
+                meta=dict(payload['meta'], regex_pattern='Try (Now)?'),
+            ))
+            for i in range(count)
+        ]
+
+    def test_write_and_read__round_trip(self):
+        events = self.get_events(10)
+        storage = self.get_storage()
+
+        storage.write_many(events[:6])
+        storage.write_many(events[6:])
+
+        self.assertEqual(storage.read_events().to_models(), events)
+        self.assertEqual(
+            storage.read_events(rule_name='rule-a').to_models(),
+            events[::2],
+        )
+        self.assertEqual(
+            storage.read_events(
+                start=events[3].timestamp, end=events[7].timestamp,
+            ).to_models(),
+            events[3:7],
+        )
+        self.assertEqual(len(storage.read_events(rule_name='unknown')), 0)
+
+    def test_write_and_read__event_ids(self):
+        events = [
+            event.copy(update={
+                'event_id': None if i == 1 else uuid.uuid4(),
+            })
+            for i, event in enumerate(self.get_events(3))
+        ]
+        storage = self.get_storage()
+
+        storage.write_many(events)
+
+        self.assertEqual(storage.read_events().to_models(), events)
+        block = self.directory.joinpath('000000000000.seg').read_bytes()
+        header, _ = read_block_header(block, 0)
+        self.assertIn(['event_id', 'uuid'], [
+            column[:2] for column in header['columns']
+        ])
+        self.assertNotIn(str(events[0].event_id).encode(), block)
+
+    def test_segments_rotated_and_indexed(self):
+        events = self.get_events(30)
+        storage = self.get_storage(segment_max_bytes=1)
+
+        for i in range(0, 30, 10):
+            storage.write_many(events[i:i + 10])
+
+        self.assertEqual(len(list(self.directory.glob('*.seg'))), 3)
+        self.assertEqual(len(list(self.directory.glob('*.idx'))), 3)
+        reopened = self.get_storage()
+        reopened.write_many(events[:1])
+        self.assertEqual(
+            reopened.read_events().to_models(), events + events[:1],
+        )
+        with mock.patch('consumer.segments.decode_block') as decode_mock:
+            reopened.read_events(
+                start=events[25].timestamp, end=events[26].timestamp,
+            )
+        self.assertEqual(decode_mock.call_count, 1)
+
+    def test_sealed_segments_summarized(self):
+        events = self.get_events(30, rule_names=('rule-a', ))
+        storage = self.get_storage(segment_max_bytes=1)
+        for i in range(0, 30, 10):
+            storage.write_many(events[i:i + 10])
+        log = storage._log
+
+        self.assertEqual(log.next_row_id, 30)
+        self.assertEqual(log._active_blocks, [])
+        self.assertEqual(
+            [(segment.first_row_id, segment.rows)
+             for segment in log._sealed_segments],
+            [(0, 10), (10, 10), (20, 10)],
+        )
+        with mock.patch.object(
+                log, '_read_index', wraps=log._read_index,
+        ) as read_index_mock:
+            self.assertEqual(len(log.get_blocks(first_row_id=10)), 2)
+            self.assertEqual(log.get_blocks(rule_name='rule-b'), [])
+        self.assertEqual(read_index_mock.call_count, 2)
+
+        log.drop_segments(20)
+        self.assertEqual(len(list(self.directory.glob('*.seg'))), 1)
+        self.assertEqual(storage.read_events().to_models(), events[20:])
+        self.assertEqual(self.get_storage()._log.next_row_id, 30)
+
+    def test_incomplete_block_truncated_on_open(self):
+        events = self.get_events(10)
+        storage = self.get_storage()
+        storage.write_many(events[:5])
+        storage.write_many(events[5:])
+        storage.close()
+        (segment, ) = self.directory.glob('*.seg')
+        with open(segment, 'r+b') as f:
+            f.truncate(segment.stat().st_size - 3)
+
+        reopened = self.get_storage()
+        reopened.write_many(events[5:])
+
+        self.assertEqual(reopened.read_events().to_models(), events)
+
+    def test_read_rollups(self):
+        events = self.get_events(10)
+        storage = self.get_storage()
+        storage.write_many(events)
+
+        summary = storage.read_rollups(
+            start=datetime.datetime(2020, 12, 13, 10),
+            end=datetime.datetime(2020, 12, 13, 11),
+        )
+
+        self.assertEqual(
+            summary,
+            merge_rollups(aggregate_rollups(
+                RecordBatch.from_models(MonitoredEvent, events), HOUR,
+            ).items()),
+        )
+
+    def test_read_rollups__whole_buckets_read_from_their_blocks(self):
+        events = self.get_events(180)
+        storage = self.get_storage(segment_max_bytes=1)
+        for minute in range(3):
+            storage.write_many(events[minute * 60:(minute + 1) * 60])
+
+        with mock.patch.object(
+                storage._log, 'iter_batches',
+                wraps=storage._log.iter_batches,
+        ) as iter_batches_mock:
+            summary = storage.read_rollups(
+                start=datetime.datetime(2020, 12, 13, 10, 0, 30),
+                end=datetime.datetime(2020, 12, 13, 10, 1, 30),
+                resolution=MINUTE,
+            )
+
+        (blocks, ), _ = iter_batches_mock.call_args
+        self.assertEqual([block.first_row_id for block in blocks], [60])
+        # only the 10:01 bucket, with its events after `end`
+        self.assertEqual(
+            summary,
+            merge_rollups(aggregate_rollups(
+                RecordBatch.from_models(MonitoredEvent, events[60:120]),
+                MINUTE,
+            ).items()),
+        )
+
+
+class FallbackStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self._directory.name)
+        self.addCleanup(self._directory.cleanup)
+        self.storage = MockedEventsStorage()
+        self.write_mock = mock.patch.object(
+            self.storage, 'write_batch', wraps=self.storage.write_batch,
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        self.events = SegmentStorageTest.get_events(10)
+
+    def get_storage(self, **configs) -> FallbackStorage:
+        storage = FallbackStorage(
+            self.storage, self.directory, fsync=False,
+            retry_interval_seconds=60, **configs,
+        )
+        self.addCleanup(storage.close)
+        return storage
+
+    def write(self, storage: FallbackStorage, events: List[MonitoredEvent]):
+        storage.write_batch(RecordBatch.from_models(MonitoredEvent, events))
+
+    def test_failed_writes_buffered_and_drained(self):
+        storage = self.get_storage(drain_rows=4)
+        self.write(storage, self.events[:2])
+        self.write_mock.side_effect = ConnectionError('database is down')
+
+        self.write(storage, self.events[2:5])
+        self.write_mock.side_effect = None
+        # events are kept in order while the buffer is not drained
+        self.write(storage, self.events[5:])
+
+        self.assertTrue(storage.is_buffering)
+        self.assertEqual(storage.buffered_rows, 8)
+        self.assertEqual(self.storage._data, [
+            event.dict() for event in self.events[:2]
+        ])
+
+        storage.drain()
+
+        self.assertFalse(storage.is_buffering)
+        self.assertEqual(storage.buffered_rows, 0)
+        self.assertEqual(self.storage._data, [
+            event.dict() for event in self.events
+        ])
+        # buffered blocks of 3 and 5 events are drained one batch each
+        self.assertEqual(
+            [len(call.args[0]) for call in self.write_mock.call_args_list],
+            [2, 3, 3, 5],
+        )
+        self.assertEqual(list(self.directory.glob('*.seg')), [])
+        self.write(storage, self.events[:1])
+        self.assertEqual(len(self.storage._data), 11)
+
+    def test_slow_write_buffered(self):
+        storage = self.get_storage(latency_budget_seconds=0.01)
+        released = threading.Event()
+        self.write_mock.side_effect = lambda batch: released.wait(5)
+
+        self.write(storage, self.events)
+        released.set()
+
+        self.assertTrue(storage.is_buffering)
+        self.assertEqual(storage.buffered_rows, 10)
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_drained_after_database_reconnect(self, execute_values_mock):
+        import psycopg2
+        broken, reader, reconnected = (mock.MagicMock() for _ in range(3))
+        with mock.patch(
+                'psycopg2.connect', side_effect=[broken, reader, reconnected],
+        ):
+            self.storage = PostgresEventsStorage(
+                dsn='test-dsn', read_connections=1,
+            )
+            storage = self.get_storage()
+            execute_values_mock.side_effect = psycopg2.OperationalError(
+                'server closed the connection unexpectedly',
+            )
+            self.write(storage, self.events[:2])
+            execute_values_mock.side_effect = None
+
+            storage.drain()
+
+        self.assertFalse(storage.is_buffering)
+        broken.close.assert_called_once_with()
+        self.assertTrue(reconnected.cursor.called)
+        (events_call, ) = [
+            call for call in execute_values_mock.call_args_list
+            if 'INSERT INTO events' in call[0][1]
+        ]
+        self.assertEqual(len(events_call[0][2]), 2)
+
+    def test_drain__nothing_left(self):
+        storage = self.get_storage()
+        storage._buffering = True
+
+        storage.drain()
+
+        self.assertFalse(storage.is_buffering)
+        self.write_mock.assert_not_called()
+
+    def test_drain__slow_write_waited_for_again(self):
+        storage = self.get_storage(drain_timeout_seconds=0.01)
+        self.write_mock.side_effect = ConnectionError('database is down')
+        self.write(storage, self.events)
+        released = threading.Event()
+        self.write_mock.side_effect = lambda batch: released.wait(5)
+
+        with self.assertRaises(FutureTimeoutError):
+            storage.drain()
+        released.set()
+        storage.drain()
+
+        self.assertFalse(storage.is_buffering)
+        # the timed out write is not submitted again
+        self.assertEqual(self.write_mock.call_count, 2)
+
+    def test_buffer_drained_after_restart(self):
+        self.write_mock.side_effect = ConnectionError('database is down')
+        storage = self.get_storage(segment_max_bytes=1, drain_rows=2)
+        for i in range(0, 10, 2):
+            self.write(storage, self.events[i:i + 2])
+        drained = []
+
+        def fail_after_first_drain(batch):
+            if drained:
+                raise ConnectionError('database is down again')
+            drained.append(batch)
+            return mock.DEFAULT
+
+        self.write_mock.side_effect = fail_after_first_drain
+        with self.assertRaises(ConnectionError):
+            storage.drain()
+        storage.close()
+
+        reopened = self.get_storage(segment_max_bytes=1, drain_rows=2)
+
+        self.assertTrue(reopened.is_buffering)
+        self.assertEqual(reopened.buffered_rows, 8)
+        # drained segments are deleted
+        self.assertEqual(len(list(self.directory.glob('*.seg'))), 4)
+        self.write_mock.side_effect = None
+        reopened.drain()
+        self.assertEqual(self.storage._data, [
+            event.dict() for event in self.events
+        ])
+
+
+class StateCacheTest(unittest.TestCase):
+
+    @staticmethod
+    def get_batch(count: int, rule_names=('rule-a', 'rule-b')) -> RecordBatch:
+        return RecordBatch.from_models(
+            MonitoredEvent,
+            SegmentStorageTest.get_events(count, rule_names),
+        )
+
+    def test_history_wraps_around(self):
+        batch = self.get_batch(10, rule_names=('rule-a', ))
+        cache = RuleStateCache(history_size=5)
+
+        cache.update(batch)
+
+        history = cache.get_history('rule-a')
+        self.assertEqual(
+            [state.timestamp for state in history], batch['timestamp'][-5:],
+        )
+        self.assertEqual(
+            [state.latency for state in history], batch['latency'][-5:],
+        )
+        self.assertEqual(history[0].http_status, None)
+        self.assertEqual(history[0].success, False)
+        self.assertEqual(history[-1].regex_match, None)
+        self.assertEqual(cache.get_latest('rule-a'), history[-1])
+        self.assertEqual(cache.get_rule_names(), ['rule-a'])
+        self.assertIsNone(cache.get_latest('unknown'))
+
+    def test_older_events_skipped(self):
+        batch = self.get_batch(6)
+        cache = RuleStateCache()
+
+        cache.update(batch.take([4, 5]))
+        cache.update(batch.take([0, 1, 2, 3]))
+
+        latest = cache.get_all_latest()
+        self.assertEqual(list(latest), ['rule-a', 'rule-b'])
+        self.assertEqual(latest['rule-a'].timestamp, batch['timestamp'][4])
+        self.assertEqual(len(cache.get_history('rule-a')), 1)
+
+    def test_warm_from_storage(self):
+        events = SegmentStorageTest.get_events(10)
+        initialize_storage(MockedEventsStorage)
+        get_storage().write_many(events)
+        initialize_state_cache(history_size=2)
+
+        with freeze_time(events[-1].timestamp):
+            warm_state_cache(hours=1)
+
+        cache = get_state_cache()
+        self.assertEqual(
+            [state.timestamp for state in cache.get_history('rule-b')],
+            [events[7].timestamp, events[9].timestamp],
+        )
+
+    def test_select_latest(self):
+        batch = self.get_batch(6)
+
+        latest = select_latest(batch.take([5, 4, 3, 2, 1, 0]), 2)
+
+        self.assertEqual(latest['timestamp'], batch['timestamp'][2:])
+
+
+class ApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(ApiTest, cls).setUpClass()
+        server = start_api_server('127.0.0.1', 0)
+        cls.addClassCleanup(server.server_close)
+        cls.addClassCleanup(server.shutdown)
+        cls.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    def setUp(self):
+        self.events = SegmentStorageTest.get_events(10)
+        initialize_storage(MockedEventsStorage)
+        get_storage().write_many(self.events)
+        initialize_state_cache()
+        get_state_cache().update(
+            RecordBatch.from_models(MonitoredEvent, self.events)
+        )
+        initialize_response_cache()
+
+    def get(self, path: str):
+        with urllib.request.urlopen(self.url + path) as response:
+            return json.load(response)
+
+    def test_status(self):
+        status = self.get('/status')
+
+        self.assertEqual(list(status), ['rule-a', 'rule-b'])
+        self.assertEqual(
+            status['rule-b']['timestamp'], '2020-12-13T10:00:09.000',
+        )
+        self.assertEqual(status['rule-b']['latency'], self.events[9].latency)
+
+    def test_summary(self):
+        summary = self.get(
+            '/summary?start=2020-12-13T10:00:00&end=2020-12-13T11:00:00'
+            '&rule_name=rule-a'
+        )
+
+        self.assertEqual(list(summary), ['rule-a'])
+        self.assertEqual(summary['rule-a']['count'], 5)
+        self.assertEqual(summary['rule-a']['uptime'], 0.8)
+        self.assertAlmostEqual(
+            summary['rule-a']['latency_p50'], 0.1274, delta=0.1274 * 0.01,
+        )
+
+    def test_events_pages(self):
+        first = self.get('/events?limit=4&rule_name=rule-a')
+        second = self.get('/events?limit=4&rule_name=rule-a&cursor={}'.format(
+            first['next_cursor'],
+        ))
+
+        self.assertEqual(
+            [event['latency'] for event in first['events'] + second['events']],
+            [event.latency for event in self.events[::2]],
+        )
+        self.assertIsNone(second['next_cursor'])
+
+    def test_events_pages__same_time_events(self):
+        timestamp = self.events[0].timestamp
+        events = [
+            event.copy(update={'timestamp': timestamp, 'event_id': event_id})
+            for event, event_id in zip(
+                get_state_events('sfss', rule_name='rule-c'),
+                [uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), None],
+            )
+        ]
+        get_storage().write_many(events)
+
+        first = self.get('/events?limit=2&rule_name=rule-c')
+        second = self.get('/events?limit=2&rule_name=rule-c&cursor={}'.format(
+            first['next_cursor'],
+        ))
+
+        self.assertEqual(
+            sorted(
+                event['latency']
+                for event in first['events'] + second['events']
+            ),
+            sorted(event.latency for event in events),
+        )
+        self.assertIsNone(first['events'][0]['event_id'])
+
+    def test_intervals(self):
+        response = self.get(
+            '/intervals?start=2020-12-13T10:00:00&end=2020-12-13T11:00:00'
+            '&rule_name=rule-a'
+        )
+
+        self.assertEqual(
+            [interval['count'] for interval in response['intervals']],
+            [1, 1, 1, 1, 1],
+        )
+        self.assertEqual(
+            response['intervals'][0]['start'], '2020-12-13T10:00:00',
+        )
+
+    def test_bad_requests(self):
+        for path, status in [
+            ('/events?limit=0', 400),
+            ('/events?cursor=bad', 400),
+            ('/summary?start=yesterday', 400),
+            # `+` of the offset is URL encoded
+            ('/summary?start=2020-12-13T10:00:00%2B01:00', 400),
+            ('/events?start=2020-12-13T10:00:00'
+             '&end=2020-12-13T11:00:00%2B01:00', 400),
+            ('/unknown', 404),
+        ]:
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                self.get(path)
+            self.assertEqual(context.exception.code, status)
+
+    def test_server_error__keep_alive_connection_served(self):
+        connection = http.client.HTTPConnection(
+            urllib.parse.urlsplit(self.url).netloc, timeout=5,
+        )
+        self.addCleanup(connection.close)
+
+        with mock.patch.object(
+                get_storage(), 'read_events_page',
+                side_effect=RuntimeError('connection pool exhausted'),
+        ):
+            connection.request('GET', '/events')
+            response = connection.getresponse()
+            error = json.load(response)
+        connection.request('GET', '/status')
+        status = connection.getresponse()
+
+        self.assertEqual(response.status, 500)
+        self.assertEqual(error, {'error': 'Internal server error'})
+        self.assertEqual(status.status, 200)
+        self.assertEqual(list(json.load(status)), ['rule-a', 'rule-b'])
+
+    def test_responses_cached_until_write(self):
+        self.get('/events?limit=100')
+        get_storage().write_many(self.events[:1])
+
+        self.assertEqual(len(self.get('/events?limit=100')['events']), 10)
+        get_response_cache().invalidate()
+        self.assertEqual(len(self.get('/events?limit=100')['events']), 11)
+
+    def test_response_cache_lru_and_ttl(self):
+        cache = ResponseCache(max_size=2, ttl_seconds=10)
+        with mock.patch('consumer.api.time.monotonic', return_value=0):
+            cache.set('a', b'a', cache.generation)
+            cache.set('b', b'b', cache.generation)
+            cache.get('a')
+            cache.set('c', b'c', cache.generation)
+            self.assertEqual((cache.get('a'), cache.get('b')), (b'a', None))
+            stale_generation = cache.generation
+            cache.invalidate()
+            cache.set('b', b'b', stale_generation)
+            self.assertIsNone(cache.get('b'))
+            cache.set('b', b'b', cache.generation)
+        with mock.patch('consumer.api.time.monotonic', return_value=11):
+            self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 0)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self._directory.name)
+        self.addCleanup(self._directory.cleanup)
+        self.events = SegmentStorageTest.get_events(10)
+        self.dump_path = self.directory / 'events.jsonl'
+        with open(self.dump_path, 'wb') as f:
+            for event in self.events[:5]:
+                f.write(pydantic_to_json_serializer(event) + b'\n')
+            f.write(b'\n{"bad": "message"}\n')
+            for event in self.events[5:]:
+                f.write(pydantic_to_json_serializer(event) + b'\n')
+
+    def test_file_chunks(self):
+        chunks = list(iter_file_chunks(self.dump_path, 4))
+
+        self.assertEqual(
+            {chunk.source for chunk in chunks},
+            {str(self.dump_path.resolve())},
+        )
+        self.assertEqual(
+            [chunk.positions for chunk in chunks],
+            [[0, 1, 2, 3], [4, 6, 7, 8], [9, 10, 11]],
+        )
+        self.assertEqual(sum(len(chunk.messages) for chunk in chunks), 11)
+
+    def test_replay__ledger_skips_written_chunks(self):
+        storage = MockedEventsStorage()
+        ledger_path = self.directory / 'ledger.txt'
+
+        stats = replay(
+            iter_file_chunks(self.dump_path, 4), storage,
+            ReplayLedger(ledger_path), processes=2,
+        )
+        rerun_stats = replay(
+            iter_file_chunks(self.dump_path, 4), storage,
+            ReplayLedger(ledger_path),
+        )
+
+        self.assertEqual(
+            (stats.chunks, stats.rows, stats.errors), (3, 10, 1),
+        )
+        self.assertEqual((rerun_stats.chunks, rerun_stats.skipped_chunks),
+                         (0, 3))
+        # timestamps are serialized with millisecond precision
+        self.assertEqual(
+            [(item['rule_name'], item['latency']) for item in storage._data],
+            [(event.rule_name, event.latency) for event in self.events],
+        )
+
+    def test_replay__ledger_independent_of_chunk_size_and_path(self):
+        storage = MockedEventsStorage()
+        ledger_path = self.directory / 'ledger.txt'
+        first_chunk = next(iter_file_chunks(self.dump_path, 4))
+        replay([first_chunk], storage, ReplayLedger(ledger_path))
+
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        relative_chunks = list(iter_file_chunks(Path('events.jsonl'), 3))
+        stats = replay(relative_chunks, storage, ReplayLedger(ledger_path))
+
+        self.assertEqual((stats.skipped_chunks, stats.rows), (1, 6))
+        self.assertEqual(
+            [item['latency'] for item in storage._data],
+            [event.latency for event in self.events],
+        )
+
+    def test_kafka_chunks__partition_left_when_idle(self):
+        from kafka import TopicPartition
+
+        partition = TopicPartition(TOPIC.SiteAvailabilityMonitoring, 0)
+        records = [
+            mock.Mock(offset=offset, value=b'{}') for offset in range(3)
+        ]
+        with mock.patch('kafka.KafkaConsumer') as consumer_class:
+            consumer = consumer_class.return_value
+            consumer.partitions_for_topic.return_value = {0}
+            # compacted messages or a transaction marker before the end
+            consumer.end_offsets.return_value = {partition: 5}
+            consumer.offsets_for_times.return_value = {
+                partition: mock.Mock(offset=0),
+            }
+            consumer.poll.side_effect = [{partition: records}] + [{}] * 10
+            consumer.position.return_value = 3
+
+            chunks = list(iter_kafka_chunks(
+                TOPIC.SiteAvailabilityMonitoring,
+                datetime.datetime(2020, 12, 13), None, 10,
+                max_idle_polls=2,
+            ))
+
+        self.assertEqual(
+            [chunk.positions for chunk in chunks], [[0, 1, 2]],
+        )
+        self.assertEqual(consumer.poll.call_count, 3)
+        consumer.close.assert_called_once_with()
+
+    def test_main__unknown_topic_rejected(self):
+        with mock.patch('consumer.replay.initialize_storage') as init_mock:
+            with self.assertRaises(SchemaNotFound):
+                replay_main([
+                    '--file', str(self.dump_path), '--topic', 'unknown',
+                ])
+        init_mock.assert_not_called()
+
+    def test_ledger__ranges_merged(self):
+        ledger = ReplayLedger()
+        for first, last in ((10, 19), (0, 4), (30, 39), (5, 9), (18, 25)):
+            ledger.add('topic:0', first, last)
+
+        self.assertEqual(ledger._ranges, {'topic:0': [(0, 25), (30, 39)]})
+        self.assertTrue(ledger.is_written('topic:0', 25))
+        self.assertFalse(ledger.is_written('topic:0', 26))
+        self.assertFalse(ledger.is_written('topic:1', 0))
 
 
 class StorageTest(unittest.TestCase):
@@ -117,6 +1472,414 @@ class StorageTest(unittest.TestCase):
         )
 
 
+@mock.patch('psycopg2.connect', mock.MagicMock())
+class PostgresStorageTest(unittest.TestCase):
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_many__rules_written_once(self, execute_values_mock):
+        storage = PostgresEventsStorage(dsn='test-dsn')
+        fake_event = MonitoredEvent(**MockedConsumer.get_fake_payload())
+
+        storage.write_many([fake_event, fake_event, ])
+        storage.write_many([fake_event, ])
+
+        rules_call, events_call, second_events_call = [
+            call for call in execute_values_mock.call_args_list
+            if 'INSERT INTO rules' in call[0][1] or
+            'INSERT INTO events' in call[0][1]
+        ]
+        rule_hash, meta = rules_call[0][2][0]
+        self.assertEqual(len(rules_call[0][2]), 1)
+        self.assertEqual(rule_hash, PostgresEventsStorage.get_rule_hash(meta))
+        self.assertIn('INSERT INTO events', events_call[0][1])
+        self.assertEqual(
+            [row[7] for row in events_call[0][2]], [rule_hash, rule_hash, ]
+        )
+        self.assertEqual(second_events_call[0][2][0][7], rule_hash)
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_many__rules_written_again_after_rollback(
+            self, execute_values_mock,
+    ):
+        storage = PostgresEventsStorage(dsn='test-dsn')
+        fake_event = MonitoredEvent(**MockedConsumer.get_fake_payload())
+
+        def fail_events_insert(curs, sql, rows, template=None):
+            if 'INSERT INTO events' in sql:
+                raise RuntimeError('connection lost')
+
+        execute_values_mock.side_effect = fail_events_insert
+        with self.assertRaises(RuntimeError):
+            storage.write_many([fake_event, ])
+        execute_values_mock.side_effect = None
+        storage.write_many([fake_event, ])
+
+        rules_calls = [
+            call for call in execute_values_mock.call_args_list
+            if 'INSERT INTO rules' in call[0][1]
+        ]
+        self.assertEqual(len(rules_calls), 2)
+
+    def test_dump_rule_meta__fixed_schedule_hash_kept(self):
+        for schedule in (
+                {'interval': {'seconds': 10}},
+                {'interval': {'seconds': 10}, 'adaptive': None},
+        ):
+            meta = RuleMeta(schedule=schedule, timeout=10.0)
+
+            self.assertEqual(
+                PostgresEventsStorage.get_rule_hash(
+                    PostgresEventsStorage.dump_rule_meta(meta),
+                ),
+                # hash of the rule before adaptive schedules were added
+                'f77e4c8a6e5fbba4945e68042f404aa193f0a01b',
+            )
+
+    def test_dump_rule_meta__unset_content_patterns_left_out(self):
+        meta = {'schedule': {'interval': {'seconds': 10}}, 'timeout': 10.0}
+
+        for content_patterns in ({}, {'required_patterns': []}):
+            self.assertEqual(
+                PostgresEventsStorage.dump_rule_meta(
+                    RuleMeta(**meta, **content_patterns),
+                ),
+                json.dumps(
+                    dict(meta, regex_pattern=None), sort_keys=True,
+                ),
+            )
+        self.assertIn(
+            '"required_patterns": ["Welcome"]',
+            PostgresEventsStorage.dump_rule_meta(
+                RuleMeta(**meta, required_patterns=['Welcome']),
+            ),
+        )
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_many__events_columns_in_schema(self, execute_values_mock):
+        for compact_intervals in (False, True):
+            with mock.patch('psycopg2.connect'):
+                storage = PostgresEventsStorage(
+                    dsn='test-dsn', compact_intervals=compact_intervals,
+                )
+            curs = storage._connection.cursor.return_value.__enter__ \
+                .return_value
+            curs.fetchall.return_value = []
+            schema = '\n'.join(
+                call[0][0] for call in curs.execute.call_args_list
+            )
+            table = re.search(
+                r'CREATE TABLE IF NOT EXISTS events \((.*?)\n\s*\);',
+                schema, re.DOTALL,
+            ).group(1)
+            columns = {
+                line.split()[0] for line in table.splitlines() if line.strip()
+            } | set(re.findall(
+                r'ALTER TABLE events ADD COLUMN IF NOT EXISTS (\w+)', schema,
+            ))
+
+            storage.write_many(get_state_events('sf'))
+
+            (events_call, ) = [
+                call for call in execute_values_mock.call_args_list
+                if 'INSERT INTO events' in call[0][1]
+            ]
+            inserted = re.search(
+                r'INSERT INTO events \((.*?)\)', events_call[0][1], re.DOTALL,
+            ).group(1)
+            self.assertLessEqual(
+                {column.strip() for column in inserted.split(',')}, columns,
+            )
+            execute_values_mock.reset_mock()
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_many__rollups_upserted_per_resolution(
+            self, execute_values_mock,
+    ):
+        storage = PostgresEventsStorage(dsn='test-dsn')
+        fake_event = MonitoredEvent(**MockedConsumer.get_fake_payload())
+
+        storage.write_many([fake_event, fake_event, ])
+
+        rollup_calls = [
+            call for call in execute_values_mock.call_args_list
+            if 'ON CONFLICT (rule_name, bucket)' in call[0][1]
+        ]
+        self.assertEqual(len(rollup_calls), 2)
+        self.assertIn('INSERT INTO rollups_minute', rollup_calls[0][0][1])
+        self.assertIn('INSERT INTO rollups_hour', rollup_calls[1][0][1])
+        (row, ) = rollup_calls[1][0][2]
+        self.assertEqual(
+            row[:9],
+            (
+                'fake-rule', datetime.datetime(2020, 12, 13, 10, 0, 0),
+                2, 2, 0, 2, 0.25, 0.25, 0.5,
+            ),
+        )
+
+    @staticmethod
+    def insert_new_ids(stored_ids):
+        """`execute_values` mock returning ids inserted into `event_ids`."""
+        def execute_values(curs, sql, rows, template=None, fetch=False):
+            if 'INSERT INTO event_ids' in sql:
+                return [
+                    (event_id, ) for event_id, _ in rows
+                    if event_id not in stored_ids
+                ]
+        return execute_values
+
+    @staticmethod
+    def get_events_with_ids(event_ids, states='s'):
+        events = get_state_events(states * len(event_ids))
+        return [
+            event.copy(update={'event_id': event_id})
+            for event, event_id in zip(events, event_ids)
+        ]
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_batch__duplicate_events_skipped(self, execute_values_mock):
+        storage = PostgresEventsStorage(dsn='test-dsn')
+        stored, new = uuid.uuid4(), uuid.uuid4()
+        execute_values_mock.side_effect = self.insert_new_ids({str(stored)})
+        events = self.get_events_with_ids([stored, new, new, None])
+
+        written = storage.write_batch(
+            RecordBatch.from_models(MonitoredEvent, events),
+        )
+
+        self.assertEqual(written.to_models(), [events[1], events[3]])
+        calls = {
+            call[0][1].split()[2]: call
+            for call in execute_values_mock.call_args_list
+        }
+        self.assertIn('RETURNING event_id', calls['event_ids'][0][1])
+        self.assertEqual(
+            calls['event_ids'][0][2],
+            sorted([
+                (str(stored), events[0].timestamp),
+                (str(new), events[1].timestamp),
+            ]),
+        )
+        self.assertEqual(
+            [row[9] for row in calls['events'][0][2]], [str(new), None],
+        )
+        self.assertEqual(calls['rollups_hour'][0][2][0][2], 2)
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_batch__duplicates_of_pruned_events_skipped(
+            self, execute_values_mock,
+    ):
+        # non-transition events are not kept in `events`, their ids are
+        storage = PostgresEventsStorage(
+            dsn='test-dsn', compact_intervals=True, raw_window_seconds=0,
+        )
+        curs = storage._connection.cursor.return_value.__enter__.return_value
+        curs.fetchall.return_value = []
+        event_ids = [uuid.uuid4() for _ in range(3)]
+        events = self.get_events_with_ids(event_ids)
+        execute_values_mock.side_effect = self.insert_new_ids(set())
+        storage.write_many(events[:2])
+        execute_values_mock.side_effect = self.insert_new_ids(
+            {str(event_id) for event_id in event_ids[:2]},
+        )
+
+        # redelivered with a new event
+        written = storage.write_batch(
+            RecordBatch.from_models(MonitoredEvent, events),
+        )
+
+        self.assertEqual(written.to_models(), events[2:])
+        (intervals_call, ) = [
+            call for call in execute_values_mock.call_args_list
+            if 'INSERT INTO rule_state_intervals' in call[0][1]
+        ][-1:]
+        # count of the new interval
+        self.assertEqual(intervals_call[0][2][0][6], 1)
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_batch__all_events_stored(self, execute_values_mock):
+        storage = PostgresEventsStorage(dsn='test-dsn')
+        event_id = uuid.uuid4()
+        execute_values_mock.side_effect = self.insert_new_ids({str(event_id)})
+
+        written = storage.write_batch(RecordBatch.from_models(
+            MonitoredEvent, self.get_events_with_ids([event_id]),
+        ))
+
+        self.assertEqual(len(written), 0)
+        (call, ) = execute_values_mock.call_args_list
+        self.assertIn('INSERT INTO event_ids', call[0][1])
+
+    @mock.patch('consumer.storage.execute_values', mock.MagicMock())
+    def test_write_batch__event_ids_pruned(self):
+        storage = PostgresEventsStorage(
+            dsn='test-dsn', dedup_window_seconds=3600,
+        )
+        curs = storage._connection.cursor.return_value.__enter__.return_value
+        storage._pruned_at -= storage.PRUNE_INTERVAL_SECONDS
+
+        with freeze_time('2020-12-13 12:00:00'):
+            storage.write_many(get_state_events('s'))
+
+        curs.execute.assert_called_with(
+            'DELETE FROM event_ids WHERE timestamp < %s',
+            (datetime.datetime(2020, 12, 13, 11, 0, 0), ),
+        )
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_batch__compacted_intervals(self, execute_values_mock):
+        storage = PostgresEventsStorage(
+            dsn='test-dsn', compact_intervals=True, raw_window_seconds=0,
+        )
+        curs = storage._connection.cursor.return_value.__enter__.return_value
+        curs.fetchall.return_value = []
+
+        storage.write_many(get_state_events('ssf'))
+
+        calls = {
+            call[0][1].split()[0] + ' ' + call[0][1].split()[2]: call[0][2]
+            for call in execute_values_mock.call_args_list
+        }
+        # only transitions are kept as raw events
+        self.assertEqual(
+            [row[-1] for row in calls['INSERT events']], [True, True],
+        )
+        self.assertEqual(
+            [(row[1], row[6], row[-1])
+             for row in calls['INSERT rule_state_intervals']],
+            [(True, 2, False), (False, 1, True)],
+        )
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_batch__open_interval_extended(self, execute_values_mock):
+        storage = PostgresEventsStorage(
+            dsn='test-dsn', compact_intervals=True, raw_window_seconds=0,
+        )
+        curs = storage._connection.cursor.return_value.__enter__.return_value
+        curs.fetchall.return_value = [(
+            'fake-rule', True, 200, None,
+            datetime.datetime(2020, 12, 13, 9, 0, 0),
+            datetime.datetime(2020, 12, 13, 9, 59, 0),
+            100, 100, 0.1, 0.5, 20.0, 42,
+        )]
+
+        storage.write_many(get_state_events('ss'))
+
+        (call, ) = execute_values_mock.call_args_list[-3:-2]
+        self.assertIn('UPDATE rule_state_intervals', call[0][1])
+        self.assertEqual(
+            call[0][2],
+            [(
+                42, datetime.datetime(2020, 12, 13, 10, 0, 1), 102, 102,
+                0.1, 0.5, 20.3, True,
+            )],
+        )
+        self.assertFalse(any(
+            'INSERT INTO events' in call[0][1] or
+            'INSERT INTO rule_state_intervals' in call[0][1]
+            for call in execute_values_mock.call_args_list
+        ))
+
+    @mock.patch('consumer.storage.execute_values')
+    def test_write_batch__open_interval_closed(self, execute_values_mock):
+        storage = PostgresEventsStorage(
+            dsn='test-dsn', compact_intervals=True, raw_window_seconds=0,
+        )
+        curs = storage._connection.cursor.return_value.__enter__.return_value
+        curs.fetchall.return_value = [(
+            'fake-rule', True, 200, None,
+            datetime.datetime(2020, 12, 13, 9, 0, 0),
+            datetime.datetime(2020, 12, 13, 9, 59, 0),
+            100, 100, 0.1, 0.5, 20.0, 42,
+        )]
+
+        storage.write_many(get_state_events('f'))
+
+        update_call, insert_call = [
+            call for call in execute_values_mock.call_args_list
+            if 'rule_state_intervals' in call[0][1]
+        ]
+        self.assertIn('UPDATE rule_state_intervals', update_call[0][1])
+        self.assertEqual([row[0] for row in update_call[0][2]], [42])
+        self.assertFalse(update_call[0][2][0][-1])
+        self.assertIn('INSERT INTO rule_state_intervals', insert_call[0][1])
+        self.assertEqual(
+            [(row[1], row[-1]) for row in insert_call[0][2]], [(False, True)],
+        )
+
+    def test_iter_event_columns__server_side_cursor(self):
+        storage = PostgresEventsStorage(dsn='test-dsn')
+        curs = storage._connection.cursor.return_value.__enter__.return_value
+        curs.description = []
+        for name in ('rule_name', 'timestamp_us', 'latency', 'success'):
+            column = mock.Mock()
+            column.name = name
+            curs.description.append(column)
+        timestamp = datetime.datetime(2020, 12, 13, 10, 0, 0)
+        curs.fetchmany.side_effect = [
+            [
+                ('rule-a', 1607853600000000, 0.5, True),
+                ('rule-b', 1607853600000000, None, False),
+            ],
+            [],
+        ]
+
+        (columns, ) = storage.iter_event_columns(
+            timestamp, timestamp, chunk_size=2,
+        )
+
+        self.assertEqual(columns, {
+            'rule_name': ['rule-a', 'rule-b'],
+            'timestamp_us': [1607853600000000, 1607853600000000],
+            'latency': [0.5, None],
+            'success': [True, False],
+        })
+        self.assertEqual(
+            storage._connection.cursor.call_args[1],
+            {'name': 'columns_reader_0'},
+        )
+        self.assertEqual(curs.itersize, 2)
+
+        curs.fetchmany.side_effect = [[]]
+        list(storage.iter_event_columns(timestamp, timestamp))
+
+        self.assertEqual(
+            storage._connection.cursor.call_args[1],
+            {'name': 'columns_reader_1'},
+        )
+
+    def test_read_events_page__read_only_connection(self):
+        writer, reader = mock.MagicMock(), mock.MagicMock()
+        reader.readonly = False
+        reader.closed = 0
+        reader.set_session.side_effect = (
+            lambda readonly: setattr(reader, 'readonly', readonly)
+        )
+        with mock.patch('psycopg2.connect', side_effect=[writer, reader]):
+            storage = PostgresEventsStorage(
+                dsn='test-dsn', read_connections=1,
+            )
+            writer.reset_mock()
+            curs = reader.cursor.return_value.__enter__.return_value
+            curs.fetchall.return_value = []
+            after = (
+                datetime.datetime(2020, 12, 13, 10, 0, 0), 'rule-a',
+                str(uuid.uuid4()),
+            )
+
+            storage.read_events_page(10, after=after)
+            storage.read_events_page(10)
+
+        reader.set_session.assert_called_once_with(readonly=True)
+        self.assertFalse(writer.method_calls)
+        self.assertEqual(
+            curs.execute.call_args_list[0][0][1]['after_event_id'], after[2],
+        )
+        self.assertIn(
+            "ORDER BY timestamp, rule_name, COALESCE(event_id::text, '')",
+            curs.execute.call_args[0][0],
+        )
+
+
 @mock.patch(
     'consumer.main.CONSUMER_CONFIG',
     MOCKED_CONSUMER_CONFIG,
@@ -129,6 +1892,10 @@ class StorageTest(unittest.TestCase):
     'consumer.consume.CONSUMER_IMPLEMENTATION',
     'consumer.consume.MockedConsumer',
 )
+@mock.patch(
+    'consumer.dead_letter.DEAD_LETTER_IMPLEMENTATION',
+    'consumer.dead_letter.MockedDeadLetterQueue',
+)
 class ConsumerIntegrationTest(unittest.TestCase):
     def test_write_consumed_events(self):
         fake_event = MonitoredEvent(**MockedConsumer.get_fake_payload())
@@ -139,3 +1906,31 @@ class ConsumerIntegrationTest(unittest.TestCase):
         self.assertEqual(
             storage._data, [fake_event.dict(), ]
         )
+        self.assertEqual(
+            get_state_cache().get_latest(fake_event.rule_name).timestamp,
+            fake_event.timestamp,
+        )
+
+
+class StartupTest(unittest.TestCase):
+    def test_startup__backends_not_imported(self):
+        env = dict(
+            os.environ,
+            CONSUMER_IMPLEMENTATION_CLASS='consumer.consume.MockedConsumer',
+            STORAGE_IMPLEMENTATION_CLASS=(
+                'consumer.storage.MockedEventsStorage'
+            ),
+            DEAD_LETTER_IMPLEMENTATION_CLASS=(
+                'consumer.dead_letter.MockedDeadLetterQueue'
+            ),
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            cwd=Path(__file__).parent.parent, env=env, timeout=30,
+            check=True, capture_output=True,
+        ).stdout
+        imported = json.loads(output)
+
+        self.assertEqual(imported, {
+            'imported_on_import': [], 'imported_on_first_poll': [],
+        })
@@ -0,0 +1,61 @@
+from typing import Optional
+
+from producer.checker import MonitoringResult
+from producer.rules import AdaptiveSchedule, Schedule
+
+
+# weight of the latest latency in its moving average
+LATENCY_SMOOTHING = 0.2
+
+
+class AdaptiveInterval:
+    """
+    Current check interval of a rule with an adaptive schedule: it grows
+    by `backoff` after `stable_checks` stable checks in a row, up to the
+    maximum, and snaps back to the minimum on a failure or when latency
+    differs from its moving average by more than `latency_change`.
+    """
+
+    __slots__ = (
+        'min_seconds', 'max_seconds', 'adaptive', 'seconds', '_stable',
+        '_latency',
+    )
+
+    def __init__(self, schedule: Schedule):
+        if schedule.adaptive is None:
+            raise ValueError('Schedule is not adaptive')
+        self.adaptive: AdaptiveSchedule = schedule.adaptive
+        self.min_seconds = schedule.interval.total_seconds()
+        self.max_seconds = max(
+            self.adaptive.max_interval.total_seconds(), self.min_seconds,
+        )
+        self.seconds = self.min_seconds
+        self._stable = 0
+        self._latency: Optional[float] = None
+
+    def _is_latency_changed(self, latency: Optional[float]) -> bool:
+        if latency is None:
+            return False
+        average = self._latency
+        if average is None:
+            self._latency = latency
+            return False
+        self._latency = (
+            LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * average
+        )
+        return abs(latency - average) > self.adaptive.latency_change * average
+
+    def update(self, result: MonitoringResult) -> float:
+        """Interval until the next check after `result`."""
+        latency_changed = self._is_latency_changed(result.latency)
+        if not result.is_success or latency_changed:
+            self.seconds = self.min_seconds
+            self._stable = 0
+            return self.seconds
+        self._stable += 1
+        if self._stable >= self.adaptive.stable_checks:
+            self._stable = 0
+            self.seconds = min(
+                self.seconds * self.adaptive.backoff, self.max_seconds,
+            )
+        return self.seconds
@@ -1,43 +1,82 @@
+import array
 import datetime
 import logging
+import math
+import threading
+import time
 
 import requests
 
-from typing import Optional, Pattern
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Pattern, Tuple
 
-from producer.rules import MonitoringRule
-from producer.produce import get_producer
+from producer.content import ContentMatcher
+from producer.rules import Rule
+from producer.produce import SEND_ERRORS, get_producer
 from schema_registry.constants import TOPIC
+from schema_registry.metrics import registry
+from schema_registry.utils import new_event_id
 
 
 logger = logging.getLogger(__name__)
 
+CHECKS = registry.counter(
+    'producer_checks_total', 'Site checks run by their result', ('result', ),
+)
+CHECK_LATENCY = registry.histogram(
+    'producer_check_latency_seconds', 'Latency of site responses',
+)
+SEND_SECONDS = registry.histogram(
+    'producer_send_seconds', 'Duration of validating and sending events',
+)
+
+
+# longer error messages (e.g. with a response body) are truncated
+MAX_ERROR_LENGTH = 200
+
+
+def summarize_error(error: BaseException) -> str:
+    summary = f'{type(error).__name__}: {error}'
+    if len(summary) > MAX_ERROR_LENGTH:
+        summary = summary[:MAX_ERROR_LENGTH - 3] + '...'
+    return summary
+
 
 class MonitoringResult:
+    """
+    Measured fields of a single check. Neither the response nor the
+    exception are kept, only a bounded `error` summary.
+    """
+
+    __slots__ = (
+        'url', 'http_status', 'latency', 'regex_match', 'error',
+        'matched_patterns',
+    )
+
     def __init__(
             self, url: str,
             http_status: Optional[int] = None,
             latency: Optional[float] = None,
-            meta: Optional[dict] = None,
             regex_match: Optional[bool] = None,
-            response: Optional[requests.Response] = None,
+            error: Optional[str] = None,
+            matched_patterns: Optional[Tuple[str, ...]] = None,
     ):
         """
 
         :param url: url for which request was made
         :param http_status: response HTTP status
         :param latency: time spent on requests
-        :param response: related requests.Response object
-        :param meta: other meta info
         :param regex_match: Has html response body matched to the
         the expected regex pattern? Defaults to None - to regex check was done.
+        :param error: summary of the request error, if any
+        :param matched_patterns: content patterns found in the body
         """
         self.url = url
         self.http_status = http_status
         self.latency = latency
-        self.response = response
         self.regex_match = regex_match
-        self.meta = meta
+        self.error = error
+        self.matched_patterns = matched_patterns
 
     @property
     def is_success_http_status(self) -> bool:
@@ -56,74 +95,270 @@ class SiteChecker:
     def __init__(self, url: str,
                  timeout: float,
                  expected_regex_pattern: Optional[Pattern] = None,
+                 content_matcher: Optional[ContentMatcher] = None,
                  ):
         self.url = url
         self.timeout = timeout
         self.expected_regex_pattern = expected_regex_pattern
+        self.content_matcher = content_matcher
 
-    def _validate_regex_pattern(self, body: str) -> Optional[bool]:
+    def _validate_regex_pattern(
+            self, response: requests.Response,
+    ) -> Tuple[Optional[bool], Optional[Tuple[str, ...]]]:
+        """Whether the body is as expected and the patterns found."""
+        if self.content_matcher is not None:
+            match = self.content_matcher.match(response.text)
+            return match.is_ok, match.matched
         if self.expected_regex_pattern is None:
-            return None
-        return bool(self.expected_regex_pattern.search(body))
+            return None, None
+        if self.expected_regex_pattern.search(response.text):
+            return True, (self.expected_regex_pattern.pattern, )
+        return False, ()
 
     def _request(self) -> requests.Response:
-        return requests.get(self.url, timeout=self.timeout)
+        # the body is only downloaded when it is matched against a regex
+        return requests.get(self.url, timeout=self.timeout, stream=True)
 
-    def _get_result_from_response(self, response):
-        regex_match = self._validate_regex_pattern(response.text)
-        latency = response.elapsed.total_seconds()
-        http_status = response.status_code
+    def _get_result_from_response(self, response: requests.Response,
+                                  error: Optional[str] = None,
+                                  ) -> MonitoringResult:
+        try:
+            regex_match, matched_patterns = self._validate_regex_pattern(
+                response,
+            )
+        finally:
+            response.close()
         return MonitoringResult(
             url=self.url,
-            http_status=http_status,
-            latency=latency,
+            http_status=response.status_code,
+            latency=response.elapsed.total_seconds(),
             regex_match=regex_match,
-            response=response,
+            error=error,
+            matched_patterns=matched_patterns,
         )
 
     def run(self) -> MonitoringResult:
-        response, error = None, None
         try:
             response = self._request()
         except requests.RequestException as exc:
-            response = exc.response
-            error = exc
-        finally:
-            if response is not None:
-                return self._get_result_from_response(response)
-            else:
-                return MonitoringResult(
-                    url=self.url,
-                    meta={'exception': error}
+            if exc.response is not None:
+                return self._get_result_from_response(
+                    exc.response, summarize_error(exc),
                 )
+            return MonitoringResult(url=self.url, error=summarize_error(exc))
+        try:
+            return self._get_result_from_response(response)
+        except requests.RequestException as exc:
+            # failed to read the body
+            return MonitoringResult(
+                url=self.url,
+                http_status=response.status_code,
+                latency=response.elapsed.total_seconds(),
+                error=summarize_error(exc),
+            )
+
+
+class ResultBatch:
+    """
+    Results of many checks kept in flat arrays until they are sent, with
+    missing values stored as sentinels (NaN latency or check interval, -1
+    status or flag).
+    """
+
+    def __init__(self):
+        self.rules: List[Rule] = []
+        self.timestamps: List[datetime.datetime] = []
+        # NaN for the schedule interval of the rule
+        self.check_intervals = array.array('d')
+        self.latencies = array.array('d')
+        self.http_statuses = array.array('i')
+        self.regex_matches = array.array('b')
+        # errors are rare, kept by the index of the result
+        self.errors: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def append(self,
+               rule: Rule,
+               result: MonitoringResult,
+               timestamp: Optional[datetime.datetime] = None,
+               check_interval: Optional[float] = None):
+        if result.error is not None:
+            self.errors[len(self.rules)] = result.error
+        self.rules.append(rule)
+        self.timestamps.append(timestamp or datetime.datetime.now())
+        self.check_intervals.append(
+            math.nan if check_interval is None else check_interval
+        )
+        self.latencies.append(
+            math.nan if result.latency is None else result.latency
+        )
+        self.http_statuses.append(
+            -1 if result.http_status is None else result.http_status
+        )
+        self.regex_matches.append(
+            -1 if result.regex_match is None else int(result.regex_match)
+        )
+
+    def get(self, index: int) -> MonitoringResult:
+        latency = self.latencies[index]
+        http_status = self.http_statuses[index]
+        regex_match = self.regex_matches[index]
+        return MonitoringResult(
+            url=self.rules[index].url,
+            http_status=None if http_status == -1 else http_status,
+            latency=None if math.isnan(latency) else latency,
+            regex_match=None if regex_match == -1 else bool(regex_match),
+            error=self.errors.get(index),
+        )
+
+    def iter_messages(self) -> Iterator[dict]:
+        for index, rule in enumerate(self.rules):
+            check_interval = self.check_intervals[index]
+            yield prepare_data_to_report(
+                rule, self.get(index), self.timestamps[index],
+                None if math.isnan(check_interval) else check_interval,
+            )
+
+
+class ResultBuffer:
+    """
+    Collects results of checks run by many workers into a `ResultBatch`,
+    which is sent once it has `max_results` results or at the latest
+    `max_delay_seconds` after the previous send.
+    """
+
+    def __init__(self, max_results: int = 500,
+                 max_delay_seconds: float = 1.0):
+        self._max_results = max_results
+        self._max_delay_seconds = max_delay_seconds
+        self._batch = ResultBatch()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sender = threading.Thread(
+            target=self._send_periodically, name='results-sender',
+            daemon=True,
+        )
+        self._sender.start()
+
+    def __len__(self) -> int:
+        return len(self._batch)
+
+    def append(self,
+               rule: Rule,
+               result: MonitoringResult,
+               check_interval: Optional[float] = None):
+        with self._lock:
+            self._batch.append(rule, result, check_interval=check_interval)
+            is_full = len(self._batch) >= self._max_results
+        if is_full:
+            self.send()
+
+    def send(self):
+        with self._lock:
+            batch, self._batch = self._batch, ResultBatch()
+        send_results(batch)
+
+    def _send_periodically(self):
+        while not self._stopped.wait(self._max_delay_seconds):
+            try:
+                self.send()
+            except Exception:
+                logger.exception('Failed to send check results')
+
+    def close(self):
+        """Stop sending periodically and send the remaining results."""
+        self._stopped.set()
+        self._sender.join()
+        self.send()
 
 
-def prepare_data_to_report(rule: MonitoringRule,
-                           result: MonitoringResult) -> dict:
+def prepare_data_to_report(
+        rule: Rule,
+        result: MonitoringResult,
+        timestamp: Optional[datetime.datetime] = None,
+        check_interval: Optional[float] = None,
+) -> dict:
+    if check_interval is None:
+        check_interval = rule.schedule.interval.total_seconds()
     return {
+        'event_id': new_event_id(),
         'url': rule.url,
         'rule_name': rule.rule_name,
 
-        'timestamp': datetime.datetime.now(),
+        'timestamp': timestamp or datetime.datetime.now(),
         'latency': result.latency,
         'http_status': result.http_status,
         'success': result.is_success_http_status,
         'regex_match': result.regex_match,
+        'check_interval': check_interval,
 
         'meta': rule.dict()
     }
 
 
-def run_check(rule: MonitoringRule):
+def _check(rule: Rule) -> MonitoringResult:
     logger.debug('Received rule %s', rule)
     checker = SiteChecker(
         url=rule.url,
         timeout=rule.timeout,
-        expected_regex_pattern=rule.regex_pattern,
+        content_matcher=rule.content_matcher,
     )
     result = checker.run()
-    event_message = prepare_data_to_report(rule, result)
-    get_producer().send(
-        TOPIC.SiteAvailabilityMonitoring,
-        event_message,
-    )
+    if result.regex_match is False:
+        logger.info(
+            'Unexpected content of %s, patterns found: %s',
+            rule, result.matched_patterns,
+        )
+    if result.http_status is None:
+        CHECKS.labels('error').inc()
+    else:
+        CHECKS.labels('success' if result.is_success else 'failure').inc()
+    if result.latency is not None:
+        CHECK_LATENCY.observe(result.latency)
+    return result
+
+
+def _send(event_message: dict):
+    started_at = time.perf_counter()
+    try:
+        get_producer().send(
+            TOPIC.SiteAvailabilityMonitoring,
+            event_message,
+        )
+    except Exception:
+        SEND_ERRORS.inc()
+        raise
+    SEND_SECONDS.observe(time.perf_counter() - started_at)
+
+
+def send_results(batch: ResultBatch):
+    for event_message in batch.iter_messages():
+        _send(event_message)
+
+
+def run_check(rule: Rule,
+              check_interval: Optional[float] = None,
+              results: Optional[ResultBuffer] = None) -> MonitoringResult:
+    """
+    Check the rule and send the result, checked every `check_interval`.
+    With `results` the result is sent with others of the buffer.
+    """
+    result = _check(rule)
+    if results is not None:
+        results.append(rule, result, check_interval)
+    else:
+        _send(prepare_data_to_report(
+            rule, result, check_interval=check_interval,
+        ))
+    return result
+
+
+def run_checks(rules: List[Rule], max_workers: int = 32):
+    """Check many rules concurrently, then send all results."""
+    batch = ResultBatch()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for rule, result in zip(rules, executor.map(_check, rules)):
+            batch.append(rule, result)
+    send_results(batch)
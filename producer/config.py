@@ -8,12 +8,20 @@ from pydantic import BaseModel
 
 class Config(BaseModel):
     RULES_YAML_DATA_FILE_PATH: Optional[Path]
+    RULES_DATABASE_URI: Optional[str]
+    RULES_DATABASE_TABLE: str
     PRODUCER_SERVER: str
     PRODUCER_SECURITY_PROTOCOL: str
     PRODUCER_CA_CERTIFICATE: Optional[Path]
     PRODUCER_ACCESS_CERTIFICATE: Optional[Path]
     PRODUCER_ACCESS_KEY: Optional[Path]
     DEFAULT_HTTP_TIMEOUT: int
+    CHECK_WORKERS: int
+    SEND_BATCH_SIZE: int
+    SEND_INTERVAL_SECONDS: float
+    LOG_LEVEL: str
+    METRICS_HOST: str
+    METRICS_PORT: Optional[int]
 
 
 PRODUCER_IMPLEMENTATION = os.environ.get(
@@ -24,6 +32,10 @@ config = Config(
     RULES_YAML_DATA_FILE_PATH=os.environ.get(
         'RULES_YAML_DATA_FILE_PATH'
     ),
+    RULES_DATABASE_URI=os.environ.get('RULES_DATABASE_URI'),
+    RULES_DATABASE_TABLE=os.environ.get(
+        'RULES_DATABASE_TABLE', 'monitoring_rules'
+    ),
     PRODUCER_SERVER=os.environ.get('KAFKA_SERVER', 'unknown'),
     PRODUCER_SECURITY_PROTOCOL=os.environ.get(
         'KAFKA_SECURITY_PROTOCOL', 'SSL'),
@@ -31,6 +43,12 @@ config = Config(
     PRODUCER_ACCESS_CERTIFICATE=os.environ.get('KAFKA_ACCESS_CERTIFICATE'),
     PRODUCER_ACCESS_KEY=os.environ.get('KAFKA_ACCESS_KEY'),
     DEFAULT_HTTP_TIMEOUT=10,
+    CHECK_WORKERS=os.environ.get('PRODUCER_CHECK_WORKERS', 10),
+    SEND_BATCH_SIZE=os.environ.get('PRODUCER_SEND_BATCH_SIZE', 500),
+    SEND_INTERVAL_SECONDS=os.environ.get('PRODUCER_SEND_INTERVAL_SECONDS', 1),
+    LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    METRICS_HOST=os.environ.get('METRICS_HOST', '0.0.0.0'),
+    METRICS_PORT=os.environ.get('METRICS_PORT'),
 )
 
 
@@ -42,7 +60,24 @@ PRODUCER_CONFIG: Dict[str, Any] = dict(
     ssl_keyfile=config.PRODUCER_ACCESS_KEY,
 )
 
+RULES_CONFIG: Dict[str, Any] = dict(
+    file_path=config.RULES_YAML_DATA_FILE_PATH,
+    database_uri=config.RULES_DATABASE_URI,
+    database_table=config.RULES_DATABASE_TABLE,
+)
+
+SCHEDULER_CONFIG: Dict[str, Any] = dict(
+    max_workers=config.CHECK_WORKERS,
+    send_batch_size=config.SEND_BATCH_SIZE,
+    send_interval_seconds=config.SEND_INTERVAL_SECONDS,
+)
+
+METRICS_CONFIG: Dict[str, Any] = dict(
+    host=config.METRICS_HOST,
+    port=config.METRICS_PORT,
+)
+
 logging.basicConfig(
     format='%(asctime)s:%(levelname)s:%(name)s:%(message)s',
-    level=logging.DEBUG,
+    level=config.LOG_LEVEL,
 )
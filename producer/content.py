@@ -0,0 +1,143 @@
+import re
+
+from typing import Iterator, List, NamedTuple, Optional, Pattern, \
+    Sequence, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# characters with a special meaning in `re` patterns
+_REGEX_SYNTAX = frozenset('.^$*+?{}[]\\|()')
+
+
+class ContentMatch(NamedTuple):
+    # patterns found in the body, in order of the matcher patterns
+    matched: Tuple[str, ...]
+    # all required patterns are found and no forbidden one is
+    is_ok: bool
+
+
+class _Search(NamedTuple):
+    # string every match contains, lowercase if `ignore_case`
+    literal: Optional[str]
+    ignore_case: bool
+    # None for patterns without regex syntax, found by the literal alone
+    regex: Optional[Pattern]
+
+
+def _iter_literals(parsed, ignore_case: bool) -> Iterator[Tuple[str, bool]]:
+    """Runs of literal characters outside of repeats and alternatives."""
+    run: List[str] = []
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            yield ''.join(run), ignore_case
+            run = []
+        if op == sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, subpattern = av
+            yield from _iter_literals(
+                subpattern,
+                bool(ignore_case or add_flags & re.IGNORECASE) and
+                not del_flags & re.IGNORECASE,
+            )
+    if run:
+        yield ''.join(run), ignore_case
+
+
+def get_required_literal(pattern: str) -> Optional[Tuple[str, bool]]:
+    """
+    The longest string every match of `pattern` contains and whether it
+    is matched ignoring case, None if there is no such string.
+    """
+    parsed = sre_parse.parse(pattern)
+    literals = [
+        (literal, ignore_case)
+        for literal, ignore_case in _iter_literals(
+            parsed, bool(parsed.state.flags & re.IGNORECASE),
+        )
+        # other characters may match ASCII ones ignoring case, e.g. 'K'
+        if not ignore_case or literal.isascii()
+    ]
+    if not literals:
+        return None
+    return max(literals, key=lambda literal: len(literal[0]))
+
+
+def check_pattern(pattern: str):
+    """Raise `re.error` if `pattern` is invalid, without compiling it."""
+    sre_parse.parse(pattern)
+
+
+def compile_search(pattern: str) -> _Search:
+    if not _REGEX_SYNTAX.intersection(pattern):
+        return _Search(pattern, False, None)
+    regex = re.compile(pattern)
+    literal = get_required_literal(pattern)
+    if literal is None:
+        return _Search(None, False, regex)
+    text, ignore_case = literal
+    return _Search(text.lower() if ignore_case else text, ignore_case, regex)
+
+
+class ContentMatcher:
+    """
+    Required and forbidden regex patterns of a page, checked when created,
+    compiled on first use and shared by rules with the same patterns.
+
+    Patterns without regex syntax are found by a substring search, others
+    are searched for only if the body contains a literal string every
+    match of them contains. A body is scanned once per pattern by these
+    C-level searches, which skip ahead much faster than `re` does on a
+    single regex of all patterns (see `benchmarks.content`).
+    """
+
+    __slots__ = ('required', 'forbidden', '_patterns', '_searches', )
+
+    def __init__(self,
+                 required: Sequence[str] = (),
+                 forbidden: Sequence[str] = ()):
+        self.required = tuple(required)
+        self.forbidden = tuple(forbidden)
+        self._patterns = self.required + self.forbidden
+        for pattern in self._patterns:
+            check_pattern(pattern)
+        self._searches: Optional[Tuple[_Search, ...]] = None
+
+    @property
+    def searches(self) -> Tuple[_Search, ...]:
+        if self._searches is None:
+            self._searches = tuple(
+                compile_search(pattern) for pattern in self._patterns
+            )
+        return self._searches
+
+    @staticmethod
+    def _is_found(search: _Search, text: str, lowered: Optional[str]) -> bool:
+        if search.literal is not None:
+            if not search.ignore_case:
+                if search.literal not in text:
+                    return False
+            # only ASCII text is lowered, see `get_required_literal`
+            elif lowered is not None and search.literal not in lowered:
+                return False
+        return search.regex is None or search.regex.search(text) is not None
+
+    def match(self, text: str) -> ContentMatch:
+        searches = self.searches
+        lowered = None
+        if text.isascii() and any(search.ignore_case for search in searches):
+            lowered = text.lower()
+        found = [self._is_found(search, text, lowered) for search in searches]
+        required = len(self.required)
+        return ContentMatch(
+            matched=tuple(
+                pattern
+                for pattern, is_found in zip(self._patterns, found)
+                if is_found
+            ),
+            is_ok=all(found[:required]) and not any(found[required:]),
+        )
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+from producer.rules import Rule
+from schema_registry.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+# checks of this class are never dropped, only delayed
+HIGHEST_PRIORITY = 0
+COALESCED = 'coalesced'
+DEADLINE = 'deadline'
+
+QUEUED_CHECKS = registry.gauge(
+    'producer_queued_checks', 'Checks waiting for a worker by priority',
+    ('priority', ),
+)
+CHECK_DELAY = registry.histogram(
+    'producer_check_delay_seconds',
+    'Time from scheduling to the start of checks by priority',
+    ('priority', ),
+)
+DROPPED_CHECKS = registry.counter(
+    'producer_dropped_checks_total',
+    'Checks not run under overload by priority and reason',
+    ('priority', 'reason', ),
+)
+
+# priority, deadline, sequence, scheduled at, rule
+_QueueItem = Tuple[int, float, int, float, Rule]
+
+
+def get_deadline_seconds(rule: Rule) -> float:
+    if rule.deadline_seconds is not None:
+        return rule.deadline_seconds
+    return rule.schedule.interval.total_seconds()
+
+
+class CheckDispatcher:
+    """
+    Runs scheduled checks on a pool of workers, ordered by priority class
+    (lower value first) and by earliest deadline within a class.
+
+    When workers cannot keep up, lower classes are degraded first: a rule
+    with a check still queued or running is not queued again, which
+    stretches its interval, and checks past their deadline are dropped,
+    except for the highest class which is only delayed.
+    """
+
+    def __init__(self, run: Callable[[Rule], Any], max_workers: int = 10):
+        self._run = run
+        self._queue: List[_QueueItem] = []
+        # names of rules with a check queued or running
+        self._pending: Set[str] = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._workers = [
+            threading.Thread(
+                target=self._work, name=f'check-worker-{i}', daemon=True,
+            )
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, rule: Rule, scheduled_at: Optional[float] = None):
+        """Queue a check scheduled at `scheduled_at` (monotonic time)."""
+        if scheduled_at is None:
+            scheduled_at = time.monotonic()
+        priority = str(rule.priority)
+        with self._condition:
+            if rule.rule_name in self._pending:
+                DROPPED_CHECKS.labels(priority, COALESCED).inc()
+                return
+            self._pending.add(rule.rule_name)
+            heapq.heappush(self._queue, (
+                rule.priority, scheduled_at + get_deadline_seconds(rule),
+                next(self._sequence), scheduled_at, rule,
+            ))
+            QUEUED_CHECKS.labels(priority).inc()
+            self._condition.notify()
+
+    def _next(self) -> Optional[Tuple[Rule, float]]:
+        with self._condition:
+            while True:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return None
+                priority, deadline, _, scheduled_at, rule = heapq.heappop(
+                    self._queue,
+                )
+                QUEUED_CHECKS.labels(str(priority)).inc(-1)
+                if priority > HIGHEST_PRIORITY and \
+                        time.monotonic() > deadline:
+                    self._pending.discard(rule.rule_name)
+                    DROPPED_CHECKS.labels(str(priority), DEADLINE).inc()
+                    continue
+                return rule, scheduled_at
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            rule, scheduled_at = item
+            CHECK_DELAY.labels(str(rule.priority)).observe(
+                time.monotonic() - scheduled_at,
+            )
+            try:
+                self._run(rule)
+            except Exception:
+                logger.exception('Check of rule %s failed', rule)
+            finally:
+                with self._condition:
+                    self._pending.discard(rule.rule_name)
+
+    def shutdown(self, wait: bool = True):
+        """Stop workers, queued checks are discarded."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,259 @@
+"""
+Synthetic monitoring events for load testing the consumer and storage
+without running HTTP checks:
+
+    python -m producer.generator --rules 1000 --rate 5000 --duration 600
+    python -m producer.generator --rate 50000 --duration 60 --file events.jsonl
+
+Events are sent with the configured producer, or written as JSON lines
+to a file read by `consumer.consume.FileConsumer` or `consumer.replay`.
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import random
+import time
+
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, IO, List, NamedTuple, Optional
+
+from producer.config import PRODUCER_CONFIG
+from producer.produce import BaseProducer, get_producer, initialize_producer
+from schema_registry.constants import TOPIC
+from schema_registry.utils import JSONEncoder, new_event_id
+
+
+logger = logging.getLogger(__name__)
+
+# events are generated in batches of a tick
+TICK_SECONDS = 0.1
+
+
+class TrafficProfile(NamedTuple):
+    rules: int = 1000
+    # events per second outside of bursts
+    rate: float = 1000.0
+    failure_ratio: float = 0.01
+    # latency is log-normally distributed
+    latency_median: float = 0.2
+    latency_sigma: float = 0.5
+    # every `burst_interval_seconds` the rate is multiplied by
+    # `burst_factor` for `burst_seconds`, no bursts when zero
+    burst_interval_seconds: float = 0.0
+    burst_seconds: float = 0.0
+    burst_factor: float = 1.0
+
+    def get_rate(self, elapsed_seconds: float) -> float:
+        if self.burst_interval_seconds and (
+                elapsed_seconds % self.burst_interval_seconds
+                < self.burst_seconds
+        ):
+            return self.rate * self.burst_factor
+        return self.rate
+
+
+class GeneratorStats(NamedTuple):
+    events: int
+    seconds: float
+
+
+class SyntheticEvents:
+    """
+    `MonitoredEvent` messages of `profile.rules` rules checked in turn,
+    every rule once per `rules / rate` seconds. A failed check is either
+    an error response or a timeout without a status.
+    """
+
+    def __init__(self, profile: TrafficProfile, seed: Optional[int] = None):
+        self.profile = profile
+        self._random = random.Random(seed)
+        self._mu = math.log(profile.latency_median)
+        check_interval = profile.rules / profile.rate
+        self._rules = [
+            (
+                f'synthetic-{i:06d}',
+                f'https://synthetic-{i:06d}.example.com/',
+                {
+                    'schedule': {'interval': {'seconds': check_interval}},
+                    'timeout': 10.0,
+                    'regex_pattern': None,
+                },
+            )
+            for i in range(profile.rules)
+        ]
+        self._check_interval = check_interval
+        self._next_rule = 0
+
+    def make_messages(self,
+                      count: int,
+                      timestamp: datetime.datetime) -> List[Dict]:
+        messages = []
+        rules = self._rules
+        rng = self._random
+        for _ in range(count):
+            rule_name, url, meta = rules[self._next_rule]
+            self._next_rule = (self._next_rule + 1) % len(rules)
+            latency: Optional[float] = rng.lognormvariate(
+                self._mu, self.profile.latency_sigma,
+            )
+            http_status: Optional[int] = 200
+            if rng.random() < self.profile.failure_ratio:
+                if rng.random() < 0.5:
+                    http_status = 503
+                else:
+                    latency = http_status = None
+            messages.append({
+                'event_id': new_event_id(),
+                'url': url,
+                'rule_name': rule_name,
+                'timestamp': timestamp,
+                'latency': latency,
+                'http_status': http_status,
+                'success': http_status == 200,
+                'regex_match': None,
+                'check_interval': self._check_interval,
+                'meta': meta,
+            })
+        return messages
+
+
+def send_messages(producer: BaseProducer, messages: List[Dict]):
+    for message in messages:
+        producer.send(TOPIC.SiteAvailabilityMonitoring, message)
+
+
+def write_messages(f: IO[str], messages: List[Dict]):
+    f.writelines(
+        json.dumps(message, cls=JSONEncoder) + '\n' for message in messages
+    )
+    f.flush()
+
+
+def generate(events: SyntheticEvents,
+             send: Callable[[List[Dict]], None],
+             duration_seconds: float,
+             start: Optional[datetime.datetime] = None,
+             realtime: bool = True,
+             report_interval_seconds: float = 10.0) -> GeneratorStats:
+    """
+    Send events of `duration_seconds` of traffic starting at `start`
+    (now by default) in batches per tick. Unless `realtime`, timestamps
+    are simulated and events are generated as fast as possible.
+    """
+    if start is None:
+        start = datetime.datetime.now()
+    started_at = reported_at = time.monotonic()
+    total = ticks = 0
+    # fractions of events carried over to the next tick
+    pending = 0.0
+    while ticks * TICK_SECONDS < duration_seconds:
+        elapsed = ticks * TICK_SECONDS
+        pending += events.profile.get_rate(elapsed) * TICK_SECONDS
+        count = int(pending)
+        pending -= count
+        if count:
+            send(events.make_messages(
+                count, start + datetime.timedelta(seconds=elapsed),
+            ))
+            total += count
+        ticks += 1
+        now = time.monotonic()
+        behind = now - started_at - ticks * TICK_SECONDS
+        if realtime and behind < 0:
+            time.sleep(-behind)
+        if now - reported_at >= report_interval_seconds:
+            reported_at = now
+            logger.info(
+                'Generated %s events (%.0f events/s)',
+                total, total / (now - started_at),
+            )
+            if realtime and behind > TICK_SECONDS:
+                logger.warning(
+                    'Generator is %.1fs behind the target rate', behind,
+                )
+    seconds = time.monotonic() - started_at
+    logger.info(
+        'Generated %s events in %.1fs (%.0f events/s)',
+        total, seconds, total / max(seconds, 1e-9),
+    )
+    return GeneratorStats(total, seconds)
+
+
+def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    defaults = TrafficProfile()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rules', type=int, default=defaults.rules)
+    parser.add_argument(
+        '--rate', type=float, default=defaults.rate,
+        help='events per second',
+    )
+    parser.add_argument(
+        '--duration', type=float, default=60.0, help='seconds of traffic',
+    )
+    parser.add_argument(
+        '--failure-ratio', type=float, default=defaults.failure_ratio,
+    )
+    parser.add_argument(
+        '--latency-median', type=float, default=defaults.latency_median,
+    )
+    parser.add_argument(
+        '--latency-sigma', type=float, default=defaults.latency_sigma,
+        help='sigma of the log-normal latency distribution',
+    )
+    parser.add_argument(
+        '--burst-interval', type=float,
+        default=defaults.burst_interval_seconds,
+        help='seconds between starts of bursts, no bursts by default',
+    )
+    parser.add_argument(
+        '--burst-seconds', type=float, default=defaults.burst_seconds,
+    )
+    parser.add_argument(
+        '--burst-factor', type=float, default=defaults.burst_factor,
+        help='rate multiplier during bursts',
+    )
+    parser.add_argument(
+        '--file', type=Path,
+        help='write JSON lines as fast as possible instead of sending',
+    )
+    parser.add_argument(
+        '--start', type=datetime.datetime.fromisoformat,
+        help='timestamp of the first events, default is now',
+    )
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args(args)
+
+
+def main(args: Optional[List[str]] = None) -> GeneratorStats:
+    options = parse_args(args)
+    events = SyntheticEvents(
+        TrafficProfile(
+            rules=options.rules,
+            rate=options.rate,
+            failure_ratio=options.failure_ratio,
+            latency_median=options.latency_median,
+            latency_sigma=options.latency_sigma,
+            burst_interval_seconds=options.burst_interval,
+            burst_seconds=options.burst_seconds,
+            burst_factor=options.burst_factor,
+        ),
+        seed=options.seed,
+    )
+    if options.file is not None:
+        with open(options.file, 'w') as f:
+            return generate(
+                events, partial(write_messages, f), options.duration,
+                start=options.start, realtime=False,
+            )
+    initialize_producer(**PRODUCER_CONFIG)
+    return generate(
+        events, partial(send_messages, get_producer()), options.duration,
+        start=options.start,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,21 @@
 import schema_registry  # noqa
 
 from producer.scheduler import run_periodic_rules
-from producer.rules import get_monitoring_rules
+from producer.rules import get_rules_loader
 from producer.produce import initialize_producer
-from producer.config import config, PRODUCER_CONFIG
+from producer.config import PRODUCER_CONFIG, METRICS_CONFIG, RULES_CONFIG, \
+    SCHEDULER_CONFIG
+from schema_registry.metrics import start_metrics_server
 
 
 def start_producer():
+    if METRICS_CONFIG['port'] is not None:
+        start_metrics_server(METRICS_CONFIG['host'], METRICS_CONFIG['port'])
     initialize_producer(**PRODUCER_CONFIG)
-    rules = get_monitoring_rules(config.RULES_YAML_DATA_FILE_PATH)
-    run_periodic_rules(rules)
+    run_periodic_rules(
+        get_rules_loader(**RULES_CONFIG).iter_monitoring_rules(),
+        **SCHEDULER_CONFIG
+    )
 
 
 if __name__ == '__main__':
@@ -4,16 +4,19 @@ import logging
 
 from typing import Optional, Dict, List, Type
 
-from kafka import KafkaProducer as _KafkaProducer
-
 from producer.config import PRODUCER_IMPLEMENTATION
 from schema_registry.registry import get_schema
 from schema_registry.registry import BasePydanticSchema
+from schema_registry.metrics import registry
 from schema_registry.utils import pydantic_to_json_serializer
 
 
 logger = logging.getLogger(__name__)
 
+SEND_ERRORS = registry.counter(
+    'producer_send_errors_total', 'Events failed to be delivered',
+)
+
 
 class BaseProducer(abc.ABC):
     def __init__(self, **configs):
@@ -33,6 +36,8 @@ class BaseProducer(abc.ABC):
 class KafkaProducer(BaseProducer):
     def __init__(self, **configs):
         super(KafkaProducer, self).__init__(**configs)
+        # imported on use, so that other producers start without kafka
+        from kafka import KafkaProducer as _KafkaProducer
         self._producer = _KafkaProducer(
             value_serializer=pydantic_to_json_serializer,
             **configs
@@ -43,7 +48,12 @@ class KafkaProducer(BaseProducer):
         self._producer.send(
             topic=message_type,
             value=parsed_message,
-        )
+        ).add_errback(self._on_send_error, message_type)
+
+    @staticmethod
+    def _on_send_error(message_type: str, exc: Exception):
+        SEND_ERRORS.inc()
+        logger.error('Failed to send %s message: %s', message_type, exc)
 
 
 class MockedProducer(BaseProducer):
@@ -55,8 +65,8 @@ class MockedProducer(BaseProducer):
     def send(self, message_type: str, message: Dict, **kwargs):
         parsed_message = self.get_validated_message(message_type, message)
         logger.debug(
-            f'Fake sending message from producer {message_type}: '
-            f'{parsed_message}'
+            'Fake sending message from producer %s: %s',
+            message_type, parsed_message,
         )
         self._sent_data.append((message_type, parsed_message))
 
@@ -1,10 +1,24 @@
 import abc
+import datetime
+import json
+import re
+import sys
 import yaml
 
 from pathlib import Path
 from pydantic import BaseModel, AnyHttpUrl
-from typing import Optional, Pattern, List
+from typing import Any, Dict, Iterator, Optional, Pattern, List, Sequence, \
+    Tuple, Union
 from producer.config import config
+from producer.content import ContentMatcher, check_pattern
+
+
+# the libyaml parser is used when PyYAML is built with it
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_MERGE_TAG = 'tag:yaml.org,2002:merge'
+# left out of rule data unless set, so the meta of rules without content
+# patterns is the same as before they were supported
+_CONTENT_PATTERN_FIELDS = ('required_patterns', 'forbidden_patterns', )
 
 
 class IntervalSchedule(BaseModel):
@@ -14,9 +28,40 @@ class IntervalSchedule(BaseModel):
     minutes: int = 0
     seconds: int = 0
 
+    def total_seconds(self) -> float:
+        return datetime.timedelta(**self.dict()).total_seconds()
+
+
+class AdaptiveSchedule(BaseModel):
+    """
+    Checks of a stable site back off from the schedule interval up to
+    `max_interval`, any change snaps the rule back to the interval.
+    """
+    max_interval: IntervalSchedule
+    # the interval grows by this factor ...
+    backoff: float = 2.0
+    # ... after this many stable checks in a row
+    stable_checks: int = 3
+    # relative difference of latency from its recent average which is
+    # a change of the site, like a failure
+    latency_change: float = 0.5
+
 
 class Schedule(BaseModel):
+    # the fixed interval, the shortest one of an adaptive schedule
     interval: IntervalSchedule
+    adaptive: Optional[AdaptiveSchedule] = None
+
+    def dict(self, **kwargs) -> Dict[str, Any]:
+        return _drop_unset_adaptive(super().dict(**kwargs))
+
+
+def _drop_unset_adaptive(schedule: Dict[str, Any]) -> Dict[str, Any]:
+    # left out unless set, so the meta of rules with a fixed schedule is
+    # the same as before adaptive schedules were supported
+    if schedule.get('adaptive', False) is None:
+        del schedule['adaptive']
+    return schedule
 
 
 class MonitoringRule(BaseModel):
@@ -25,34 +70,402 @@ class MonitoringRule(BaseModel):
     schedule: Schedule
     timeout: float = config.DEFAULT_HTTP_TIMEOUT
     regex_pattern: Optional[Pattern] = None
+    # the body must match all required and none of forbidden patterns,
+    # checked together with `regex_pattern` in one pass
+    required_patterns: List[Pattern] = []
+    forbidden_patterns: List[Pattern] = []
+    # class of the rule under overload, 0 is the highest, see `dispatcher`
+    priority: int = 0
+    # a check should start within this time after it is scheduled,
+    # the schedule interval by default
+    deadline_seconds: Optional[float] = None
+
+    @property
+    def content_matcher(self) -> Optional[ContentMatcher]:
+        regex_patterns = (
+            [] if self.regex_pattern is None else [self.regex_pattern]
+        )
+        return get_content_matcher(
+            [
+                pattern.pattern
+                for pattern in regex_patterns + self.required_patterns
+            ],
+            [pattern.pattern for pattern in self.forbidden_patterns],
+        )
+
+    def dict(self, **kwargs) -> Dict[str, Any]:
+        data = super().dict(**kwargs)
+        for name in _CONTENT_PATTERN_FIELDS:
+            if not data.get(name):
+                data.pop(name, None)
+        if isinstance(data.get('schedule'), dict):
+            _drop_unset_adaptive(data['schedule'])
+        return data
 
     def __str__(self):
         return self.rule_name
 
 
+class LazyPattern:
+    """Regex source, checked when created and compiled on first use."""
+
+    __slots__ = ('pattern', '_compiled', )
+
+    def __init__(self, pattern: str):
+        check_pattern(pattern)
+        self.pattern = pattern
+        self._compiled: Optional[Pattern] = None
+
+    @property
+    def compiled(self) -> Pattern:
+        if self._compiled is None:
+            self._compiled = re.compile(self.pattern)
+        return self._compiled
+
+
+# values shared by many rules, one instance per distinct value
+_patterns: Dict[str, LazyPattern] = {}
+_schedules: Dict[str, Schedule] = {}
+_content_matchers: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]],
+                        ContentMatcher] = {}
+_URL_FIELD = MonitoringRule.__fields__['url']
+
+
+def get_pattern(pattern: str) -> LazyPattern:
+    lazy_pattern = _patterns.get(pattern)
+    if lazy_pattern is None:
+        lazy_pattern = _patterns.setdefault(pattern, LazyPattern(pattern))
+    return lazy_pattern
+
+
+def get_content_matcher(required: Sequence[str],
+                        forbidden: Sequence[str],
+                        ) -> Optional[ContentMatcher]:
+    if not required and not forbidden:
+        return None
+    key = (tuple(required), tuple(forbidden))
+    matcher = _content_matchers.get(key)
+    if matcher is None:
+        matcher = _content_matchers.setdefault(
+            key, ContentMatcher(required, forbidden),
+        )
+    return matcher
+
+
+def get_schedule(data: Dict[str, Dict[str, Any]]) -> Schedule:
+    key = json.dumps(data, sort_keys=True)
+    schedule = _schedules.get(key)
+    if schedule is None:
+        schedule = _schedules.setdefault(key, Schedule(**data))
+    return schedule
+
+
+class CompactRule:
+    """
+    Memory-lean rule, with the same fields as `MonitoringRule`: strings
+    are interned, schedules, regexes and content matchers are shared
+    between rules and regexes are compiled when a rule is checked first.
+    """
+
+    __slots__ = (
+        'rule_name', 'url', 'schedule', 'timeout', '_regex', 'priority',
+        'deadline_seconds', 'content_matcher', 'required_patterns',
+        'forbidden_patterns',
+    )
+
+    def __init__(self,
+                 rule_name: str,
+                 url: str,
+                 schedule: Schedule,
+                 timeout: float = config.DEFAULT_HTTP_TIMEOUT,
+                 regex: Optional[LazyPattern] = None,
+                 priority: int = 0,
+                 deadline_seconds: Optional[float] = None,
+                 required_patterns: Sequence[str] = (),
+                 forbidden_patterns: Sequence[str] = (),
+                 ):
+        self.rule_name = sys.intern(rule_name)
+        self.url = sys.intern(url)
+        self.schedule = schedule
+        self.timeout = timeout
+        self._regex = regex
+        self.priority = priority
+        self.deadline_seconds = deadline_seconds
+        self.required_patterns = tuple(required_patterns)
+        self.forbidden_patterns = tuple(forbidden_patterns)
+        regex_patterns = () if regex is None else (regex.pattern, )
+        self.content_matcher = get_content_matcher(
+            regex_patterns + self.required_patterns, self.forbidden_patterns,
+        )
+
+    @classmethod
+    def from_data(cls, rule_name: str, meta: Dict[str, Any]) -> 'CompactRule':
+        """
+        Validate fields of the rule data one by one, falling back to
+        `MonitoringRule` validation for anything unexpected, so invalid
+        rules fail with the same `ValidationError`. Pattern syntax is
+        checked once per distinct pattern, compiling is left to first use.
+        """
+        try:
+            url, errors = _URL_FIELD.validate(meta['url'], {}, loc='url')
+            if errors:
+                raise ValueError(errors)
+            regex_pattern = meta.get('regex_pattern')
+            deadline_seconds = meta.get('deadline_seconds')
+            required_patterns = meta.get('required_patterns', [])
+            forbidden_patterns = meta.get('forbidden_patterns', [])
+            if not isinstance(required_patterns, list) or \
+                    not isinstance(forbidden_patterns, list):
+                raise TypeError('Patterns must be lists')
+            return cls(
+                rule_name=rule_name,
+                url=str(url),
+                schedule=get_schedule(meta['schedule']),
+                timeout=float(
+                    meta.get('timeout', config.DEFAULT_HTTP_TIMEOUT)
+                ),
+                regex=(
+                    None if regex_pattern is None
+                    else get_pattern(str(regex_pattern))
+                ),
+                priority=int(meta.get('priority', 0)),
+                deadline_seconds=(
+                    None if deadline_seconds is None
+                    else float(deadline_seconds)
+                ),
+                required_patterns=[
+                    sys.intern(str(pattern)) for pattern in required_patterns
+                ],
+                forbidden_patterns=[
+                    sys.intern(str(pattern)) for pattern in forbidden_patterns
+                ],
+            )
+        except (KeyError, TypeError, ValueError, AttributeError, re.error):
+            return cls.from_model(MonitoringRule(rule_name=rule_name, **meta))
+
+    @classmethod
+    def from_model(cls, rule: MonitoringRule) -> 'CompactRule':
+        return cls(
+            rule_name=rule.rule_name,
+            url=str(rule.url),
+            schedule=get_schedule(rule.schedule.dict()),
+            timeout=rule.timeout,
+            regex=(
+                None if rule.regex_pattern is None
+                else get_pattern(rule.regex_pattern.pattern)
+            ),
+            priority=rule.priority,
+            deadline_seconds=rule.deadline_seconds,
+            required_patterns=[
+                pattern.pattern for pattern in rule.required_patterns
+            ],
+            forbidden_patterns=[
+                pattern.pattern for pattern in rule.forbidden_patterns
+            ],
+        )
+
+    @property
+    def regex_pattern(self) -> Optional[Pattern]:
+        return None if self._regex is None else self._regex.compiled
+
+    def dict(self) -> Dict[str, Any]:
+        data = {
+            'rule_name': self.rule_name,
+            'url': self.url,
+            'schedule': self.schedule.dict(),
+            'timeout': self.timeout,
+            'regex_pattern': self.regex_pattern,
+            'priority': self.priority,
+            'deadline_seconds': self.deadline_seconds,
+        }
+        if self.required_patterns:
+            data['required_patterns'] = list(self.required_patterns)
+        if self.forbidden_patterns:
+            data['forbidden_patterns'] = list(self.forbidden_patterns)
+        return data
+
+    def __str__(self):
+        return self.rule_name
+
+
+Rule = Union[MonitoringRule, CompactRule]
+
+
 class BaseRulesLoader(abc.ABC):
-    def get_monitoring_rules(self) -> List[MonitoringRule]:
-        data = self.load_data()
-        return [
-            MonitoringRule(rule_name=rule_name, **meta)
-            for rule_name, meta in data.items()
-        ]
+    def iter_monitoring_rules(self) -> Iterator[CompactRule]:
+        """Rules one by one, as they are read from the source."""
+        for rule_name, meta in self.iter_data():
+            yield CompactRule.from_data(rule_name, meta)
+
+    def get_monitoring_rules(self) -> List[CompactRule]:
+        return list(self.iter_monitoring_rules())
 
     @abc.abstractmethod
-    def load_data(self) -> dict:
+    def iter_data(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
         pass
 
 
+class _YamlEventsReader:
+    """
+    Builds values of a document from parser events, so entries of the
+    top-level mapping are returned one at a time instead of composing
+    the whole document. Anchors, aliases and merge keys are supported.
+    """
+
+    def __init__(self, stream):
+        self._loader = _YamlLoader(stream)
+        self._anchors: Dict[str, Any] = {}
+
+    def _scalar_tag(self, event: yaml.ScalarEvent) -> str:
+        if event.tag is None or event.tag == '!':
+            return self._loader.resolve(
+                yaml.ScalarNode, event.value, event.implicit,
+            )
+        return event.tag
+
+    def _scalar(self, event: yaml.ScalarEvent,
+                tag: Optional[str] = None) -> Any:
+        tag = tag or self._scalar_tag(event)
+        node = yaml.ScalarNode(tag, event.value, style=event.style)
+        constructors = self._loader.yaml_constructors
+        return constructors.get(tag, constructors[None])(self._loader, node)
+
+    def _value(self, event: yaml.Event) -> Any:
+        value: Any
+        if isinstance(event, yaml.AliasEvent):
+            return self._anchors[event.anchor]
+        elif isinstance(event, yaml.ScalarEvent):
+            value = self._scalar(event)
+        elif isinstance(event, yaml.SequenceStartEvent):
+            value = []
+            while not self._loader.check_event(yaml.SequenceEndEvent):
+                value.append(self._value(self._loader.get_event()))
+            self._loader.get_event()
+        else:
+            value = self._mapping()
+        if event.anchor is not None:
+            self._anchors[event.anchor] = value
+        return value
+
+    def _mapping(self) -> Dict[Any, Any]:
+        value: Dict[Any, Any] = {}
+        merged: Dict[Any, Any] = {}
+        while not self._loader.check_event(yaml.MappingEndEvent):
+            key_event = self._loader.get_event()
+            if isinstance(key_event, yaml.ScalarEvent) and \
+                    key_event.anchor is None:
+                tag = self._scalar_tag(key_event)
+                if tag == _MERGE_TAG:
+                    item = self._value(self._loader.get_event())
+                    # earlier merged mappings take precedence
+                    for defaults in reversed(
+                            item if isinstance(item, list) else [item]
+                    ):
+                        merged.update(defaults)
+                    continue
+                key = self._scalar(key_event, tag)
+            else:
+                key = self._value(key_event)
+            value[key] = self._value(self._loader.get_event())
+        self._loader.get_event()
+        return {**merged, **value} if merged else value
+
+    def iter_items(self) -> Iterator[Tuple[Any, Any]]:
+        try:
+            self._loader.get_event()  # stream start
+            if self._loader.check_event(yaml.StreamEndEvent):
+                return
+            self._loader.get_event()  # document start
+            event = self._loader.get_event()
+            if isinstance(event, yaml.ScalarEvent) and \
+                    self._scalar(event) is None:
+                # empty document
+                return
+            if not isinstance(event, yaml.MappingStartEvent):
+                raise ValueError('Rules document must be a mapping')
+            while not self._loader.check_event(yaml.MappingEndEvent):
+                key = self._value(self._loader.get_event())
+                yield key, self._value(self._loader.get_event())
+        finally:
+            self._loader.dispose()
+
+
 class YamlDataLoader(BaseRulesLoader):
+    """Mapping of rule names to rules in a YAML file."""
 
     def __init__(self, file_path: Path):
         self.file_path = file_path
 
-    def load_data(self):
-        with open(self.file_path) as f:
-            data = yaml.safe_load(f)
-        return data
+    def iter_data(self):
+        with open(self.file_path, 'rb') as f:
+            yield from _YamlEventsReader(f).iter_items()
+
+
+class JsonLinesDataLoader(BaseRulesLoader):
+    """
+    A rule per line as a JSON object with `rule_name` and the other
+    fields of the rule, the fastest format to read for large rule sets.
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+
+    def iter_data(self):
+        with open(self.file_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    meta = json.loads(line)
+                    yield meta.pop('rule_name'), meta
+
+
+class DatabaseDataLoader(BaseRulesLoader):
+    """
+    Rules from a `(rule_name text, meta jsonb)` table, read in chunks of
+    `itersize` rows by a server-side cursor.
+    """
+
+    def __init__(self,
+                 dsn: str,
+                 table: str = 'monitoring_rules',
+                 itersize: int = 10000):
+        self.dsn = dsn
+        self.table = table
+        self.itersize = itersize
+
+    def iter_data(self):
+        # imported on use, so that file based rules start without psycopg2
+        import psycopg2
+        from psycopg2 import sql
+
+        connection = psycopg2.connect(self.dsn)
+        try:
+            with connection, connection.cursor(name='rules_loader') as curs:
+                curs.itersize = self.itersize
+                curs.execute(
+                    sql.SQL(
+                        'SELECT rule_name, meta FROM {} ORDER BY rule_name'
+                    ).format(sql.Identifier(self.table))
+                )
+                for rule_name, meta in curs:
+                    if isinstance(meta, str):
+                        meta = json.loads(meta)
+                    yield rule_name, meta
+        finally:
+            connection.close()
+
+
+def get_rules_loader(file_path: Optional[Path] = None,
+                     database_uri: Optional[str] = None,
+                     database_table: str = 'monitoring_rules',
+                     ) -> BaseRulesLoader:
+    if database_uri is not None:
+        return DatabaseDataLoader(database_uri, database_table)
+    if file_path is None:
+        raise RuntimeError('Rules file path or database URI must be set')
+    if Path(file_path).suffix == '.jsonl':
+        return JsonLinesDataLoader(file_path)
+    return YamlDataLoader(file_path)
 
 
-def get_monitoring_rules(file_path: Path) -> List[MonitoringRule]:
-    return YamlDataLoader(file_path).get_monitoring_rules()
+def get_monitoring_rules(file_path: Path) -> List[CompactRule]:
+    return get_rules_loader(file_path).get_monitoring_rules()
@@ -1,25 +1,132 @@
-from typing import List
+import datetime
+import logging
+import threading
+import uuid
 
-from apscheduler.schedulers.blocking import BlockingScheduler
-from producer.rules import MonitoringRule
-from producer.checker import run_check
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from producer.adaptive import AdaptiveInterval
+from producer.rules import Rule
+from producer.checker import ResultBuffer, run_check
+from producer.dispatcher import CheckDispatcher
 
-def _run_monitoring_rule(rule: MonitoringRule) -> None:
-    run_check(rule)
 
+logger = logging.getLogger(__name__)
+
+# fractional part of the golden ratio, consecutive multiples of it are
+# spread evenly over [0, 1) however many there are
+_SPREAD_STEP = (5 ** 0.5 - 1) / 2
+
+
+def get_first_run_delay(index: int, interval_seconds: float) -> float:
+    """
+    Delay of the first check of the `index`-th scheduled rule, so that
+    first checks are spread over the interval instead of running at once.
+    """
+    return interval_seconds * (index * _SPREAD_STEP % 1.0)
+
+
+def _run_monitoring_rule(
+        rule: Rule,
+        interval: Optional[AdaptiveInterval] = None,
+        results: Optional[ResultBuffer] = None,
+) -> Optional[float]:
+    """
+    Check the rule, returned is the next interval of an adaptive schedule
+    if it has changed.
+    """
+    if interval is None:
+        run_check(rule, results=results)
+        return None
+    seconds = interval.seconds
+    result = run_check(rule, check_interval=seconds, results=results)
+    if interval.update(result) == seconds:
+        return None
+    return interval.seconds
+
+
+def run_periodic_rules(rules: Iterable[Rule],
+                       max_workers: int = 10,
+                       send_batch_size: int = 500,
+                       send_interval_seconds: float = 1.0) -> None:
+    """
+    Schedule rules while they are being loaded: the scheduler starts
+    right away and jobs are added from a loader thread. The first rule is
+    checked as soon as it is added, first checks of the others are spread
+    over their intervals (see `get_first_run_delay`).
+
+    Jobs only queue checks, they are run by `max_workers` workers of
+    `CheckDispatcher` in order of rule priority and deadline. Jobs of
+    rules with an adaptive schedule are rescheduled after checks which
+    change their interval. Results are sent in batches of up to
+    `send_batch_size`, at least every `send_interval_seconds`.
+    """
+    from apscheduler.events import EVENT_SCHEDULER_STARTED
+    from apscheduler.schedulers.blocking import BlockingScheduler
 
-def run_periodic_rules(rules: List[MonitoringRule]) -> None:
     scheduler = BlockingScheduler()
-    for rule in rules:
-        if rule.schedule.interval is None:
-            raise RuntimeError(
-                f'Interval schedule must be defined for all rules: {rule}'
+    # job id and interval of adaptive rules by rule name
+    adaptive: Dict[str, Tuple[str, AdaptiveInterval]] = {}
+    errors: List[Exception] = []
+    results = ResultBuffer(send_batch_size, send_interval_seconds)
+
+    def run(rule: Rule):
+        job_id, interval = adaptive.get(rule.rule_name, (None, None))
+        seconds = _run_monitoring_rule(rule, interval, results)
+        if seconds is not None:
+            logger.debug('Rule %s is checked every %ss now', rule, seconds)
+            scheduler.reschedule_job(
+                job_id, trigger='interval', seconds=seconds,
             )
-        scheduler.add_job(
-            _run_monitoring_rule,
-            kwargs={'rule': rule},
-            trigger='interval',
-            **rule.schedule.interval.dict()
-        )
-    scheduler.start()
+
+    dispatcher = CheckDispatcher(run, max_workers)
+
+    def add_jobs():
+        count = 0
+        started_at = datetime.datetime.now()
+        try:
+            for rule in rules:
+                if rule.schedule.interval is None:
+                    raise RuntimeError(
+                        'Interval schedule must be defined for all rules: '
+                        f'{rule}'
+                    )
+                job_id = uuid.uuid4().hex
+                if rule.schedule.adaptive is not None:
+                    adaptive[rule.rule_name] = (
+                        job_id, AdaptiveInterval(rule.schedule),
+                    )
+                delay = get_first_run_delay(
+                    count, rule.schedule.interval.total_seconds(),
+                )
+                scheduler.add_job(
+                    dispatcher.submit,
+                    id=job_id,
+                    kwargs={'rule': rule},
+                    trigger='interval',
+                    next_run_time=max(
+                        started_at + datetime.timedelta(seconds=delay),
+                        datetime.datetime.now(),
+                    ),
+                    **rule.schedule.interval.dict()
+                )
+                count += 1
+        except Exception as exc:
+            errors.append(exc)
+            scheduler.shutdown(wait=False)
+            return
+        logger.info('Scheduled %s rules', count)
+
+    loader = threading.Thread(
+        target=add_jobs, name='rules-loader', daemon=True,
+    )
+    scheduler.add_listener(
+        lambda event: loader.start(), EVENT_SCHEDULER_STARTED,
+    )
+    try:
+        scheduler.start()
+    finally:
+        dispatcher.shutdown(wait=False)
+        results.close()
+    if errors:
+        raise errors[0]
@@ -1,10 +1,21 @@
 import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import uuid
 
 import requests
 import responses
 
+from functools import partial
 from pathlib import Path
+from unittest import mock
 
 from pydantic import ValidationError
 
@@ -12,8 +23,49 @@ from producer.produce import initialize_producer, get_producer, MockedProducer
 from schema_registry.constants import TOPIC
 from schema_registry.models import MonitoredEvent
 from schema_registry.exceptions import SchemaNotFound
-from producer.rules import MonitoringRule, get_monitoring_rules
-from producer.checker import SiteChecker, MonitoringResult
+from producer.rules import MonitoringRule, CompactRule, DatabaseDataLoader, \
+    get_monitoring_rules, get_rules_loader
+from producer.checker import SiteChecker, MonitoringResult, ResultBatch, \
+    ResultBuffer, prepare_data_to_report, run_check, run_checks, \
+    summarize_error, CHECKS, SEND_SECONDS, MAX_ERROR_LENGTH
+from producer.scheduler import get_first_run_delay, run_periodic_rules, \
+    _run_monitoring_rule
+from producer.adaptive import AdaptiveInterval
+from producer.content import ContentMatch, ContentMatcher, \
+    get_required_literal
+from producer.generator import SyntheticEvents, TrafficProfile, generate, \
+    main as generator_main, send_messages
+from producer.dispatcher import CheckDispatcher, CHECK_DELAY, \
+    DROPPED_CHECKS, QUEUED_CHECKS
+
+# modules only the configured producer and the scheduler loop need
+LAZY_MODULES = ('apscheduler', 'kafka')
+STARTUP_SCRIPT = """
+import json, os, sys, threading
+import producer.main
+import producer.scheduler
+
+def get_imported(names):
+    return sorted(name for name in names if name in sys.modules)
+
+imported = get_imported(%(modules)r)
+lock = threading.Lock()
+
+def first_check(rule, **kwargs):
+    # checks run concurrently, only the first one reports
+    with lock:
+        print(json.dumps({
+            'imported_on_import': imported,
+            'imported_on_first_check': get_imported(%(modules)r),
+        }), flush=True)
+        os._exit(0)
+
+producer.scheduler.run_check = first_check
+producer.main.start_producer()
+""" % {'modules': LAZY_MODULES}
+
+
+EVENT_ID = uuid.UUID('0176597c-8a00-7000-8000-000000000000')
 
 
 def get_fake_payload() -> dict:
@@ -34,6 +86,8 @@ def create_monitoring_rule(
     timeout=10,
     schedule=None,
     regex_pattern=None,
+    priority=0,
+    deadline_seconds=None,
 ) -> MonitoringRule:
     schedule = schedule or {'interval': {'seconds': 10}}
     return MonitoringRule(
@@ -42,6 +96,8 @@ def create_monitoring_rule(
         timeout=timeout,
         schedule=schedule,
         regex_pattern=regex_pattern,
+        priority=priority,
+        deadline_seconds=deadline_seconds,
     )
 
 
@@ -92,15 +148,498 @@ class RulesLoaderTest(unittest.TestCase):
         rules = get_monitoring_rules(self.yaml_fixture_path)
 
         self.assertEqual(len(rules), 3)
+        self.assertIsInstance(rules[2], CompactRule)
         self.assertEqual(
-            rules[2],
+            rules[2].dict(),
             MonitoringRule(
                 rule_name='aiven-try-free',
                 url='https://aiven.io/',
                 timeout=10,
                 schedule={'interval': {'seconds': 10}},
+                priority=1,
                 regex_pattern='Try (Now For )?Free',
+            ).dict()
+        )
+
+    def test_load_rules_from_yaml__anchors_and_merge_keys(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'rules.yaml'
+            path.write_text(
+                'first: &defaults\n'
+                '  url: https://first.example.com/\n'
+                '  timeout: 3\n'
+                '  schedule: {interval: {seconds: 30}}\n'
+                'second:\n'
+                '  <<: *defaults\n'
+                '  url: https://second.example.com/\n'
+            )
+            first, second = get_monitoring_rules(path)
+
+        self.assertEqual(second.url, 'https://second.example.com/')
+        self.assertEqual(second.timeout, 3)
+        self.assertIs(second.schedule, first.schedule)
+
+    def test_iter_rules_from_jsonl__streamed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'rules.jsonl'
+            path.write_text(
+                json.dumps({
+                    'rule_name': 'first',
+                    'url': 'https://first.example.com/',
+                    'schedule': {'interval': {'seconds': 30}},
+                }) + '\n' +
+                json.dumps({'rule_name': 'invalid', 'url': 'not-url'}) + '\n'
+            )
+            rules = get_rules_loader(path).iter_monitoring_rules()
+
+            # rules before an invalid one are available right away
+            self.assertEqual(next(rules).rule_name, 'first')
+            with self.assertRaises(ValidationError):
+                next(rules)
+
+    def test_compact_rules__regex_shared_and_compiled_once(self):
+        meta = {
+            'url': 'https://example.com/',
+            'schedule': {'interval': {'seconds': 30}},
+            'regex_pattern': 'Shared (regex)?',
+        }
+        with mock.patch('re.compile', wraps=re.compile) as compile_mock:
+            first, second = [
+                CompactRule.from_data(rule_name, meta)
+                for rule_name in ('first', 'second')
+            ]
+
+            self.assertIs(first._regex, second._regex)
+            # compiled on first use only
+            compile_mock.assert_not_called()
+            self.assertTrue(first.regex_pattern.search('Shared regex'))
+            self.assertIs(second.regex_pattern, first.regex_pattern)
+
+        compile_mock.assert_called_once_with('Shared (regex)?')
+        self.assertFalse(hasattr(first, '__dict__'))
+
+    def test_compact_rules__invalid_patterns_fail_load(self):
+        meta = {
+            'url': 'https://example.com/',
+            'schedule': {'interval': {'seconds': 30}},
+        }
+        for patterns in (
+                {'regex_pattern': '('},
+                {'required_patterns': ['ok', '[']},
+                {'forbidden_patterns': ['(?P<']},
+        ):
+            with self.assertRaises(ValidationError):
+                CompactRule.from_data('invalid', dict(meta, **patterns))
+
+    def test_rule_dict__unset_adaptive_schedule_left_out(self):
+        meta = {
+            'url': 'https://example.com/',
+            'schedule': {'interval': {'seconds': 30}},
+        }
+        model = MonitoringRule(rule_name='fixed', **meta)
+
+        for rule in (model, CompactRule.from_data('fixed', meta)):
+            self.assertNotIn('adaptive', rule.dict()['schedule'])
+            self.assertNotIn(
+                'adaptive', prepare_data_to_report(
+                    rule, MonitoringResult(rule.url),
+                )['meta']['schedule'],
             )
+        adaptive = MonitoringRule(rule_name='adaptive', **dict(
+            meta, schedule=dict(
+                meta['schedule'], adaptive={'max_interval': {'minutes': 5}},
+            ),
+        ))
+        self.assertEqual(
+            adaptive.dict()['schedule']['adaptive']['max_interval']['minutes'],
+            5,
+        )
+
+    def test_compact_rules__content_patterns(self):
+        meta = {
+            'url': 'https://example.com/',
+            'schedule': {'interval': {'seconds': 30}},
+            'regex_pattern': 'Welcome',
+            'required_patterns': ['Sign (in|up)'],
+            'forbidden_patterns': ['Internal Server Error'],
+        }
+        first, second = [
+            CompactRule.from_data(rule_name, meta)
+            for rule_name in ('first', 'second')
+        ]
+        model = MonitoringRule(rule_name='first', **meta)
+
+        self.assertIs(first.content_matcher, second.content_matcher)
+        self.assertIs(first.content_matcher, model.content_matcher)
+        self.assertEqual(
+            first.content_matcher.required, ('Welcome', 'Sign (in|up)'),
+        )
+        self.assertEqual(first.dict(), CompactRule.from_model(model).dict())
+        self.assertEqual(
+            first.dict()['forbidden_patterns'], ['Internal Server Error'],
+        )
+        self.assertIsNone(create_monitoring_rule().content_matcher)
+        for rule in (
+                CompactRule.from_model(create_monitoring_rule()),
+                create_monitoring_rule(),
+        ):
+            self.assertNotIn('required_patterns', rule.dict())
+            self.assertNotIn('forbidden_patterns', rule.dict())
+        with self.assertRaises(ValidationError):
+            CompactRule.from_data('invalid', dict(
+                meta, required_patterns='Welcome',
+            ))
+
+    @mock.patch('psycopg2.connect')
+    def test_iter_rules_from_database(self, connect_mock):
+        cursor = connect_mock.return_value.cursor.return_value.__enter__ \
+            .return_value
+        cursor.__iter__.return_value = iter([
+            ('first', {
+                'url': 'https://first.example.com/',
+                'schedule': {'interval': {'minutes': 1}},
+            }),
+        ])
+
+        (rule, ) = DatabaseDataLoader('test-dsn').get_monitoring_rules()
+
+        self.assertEqual(rule.rule_name, 'first')
+        self.assertEqual(rule.schedule.interval.minutes, 1)
+        self.assertEqual(cursor.itersize, 10000)
+        connect_mock.return_value.close.assert_called_once()
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_run_periodic_rules__checks_start_while_loading(self):
+        checked = threading.Event()
+
+        def iter_rules():
+            yield create_monitoring_rule(rule_name='first')
+            # the rest is loaded only after the first rule was checked
+            self.assertTrue(checked.wait(5))
+            raise RuntimeError('Failed to load rules')
+
+        with mock.patch(
+                'producer.scheduler.run_check',
+                lambda rule, **kwargs: checked.set(),
+        ):
+            with self.assertRaisesRegex(RuntimeError, 'Failed to load'):
+                run_periodic_rules(iter_rules())
+
+    def test_first_run_delay__spread_over_interval(self):
+        delays = sorted(get_first_run_delay(index, 60) for index in range(100))
+
+        self.assertEqual(delays[0], 0)
+        self.assertLess(delays[-1], 60)
+        # evenly spread: no gap is much wider than 60s / 100 rules
+        self.assertLess(
+            max(b - a for a, b in zip(delays, delays[1:])), 60 * 0.03,
+        )
+
+
+class CheckDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.started = []
+        self.release = threading.Event()
+        self.done = threading.Semaphore(0)
+
+        self.running = threading.Event()
+
+        def run(rule):
+            self.started.append(rule.rule_name)
+            self.running.set()
+            self.release.wait(5)
+            self.done.release()
+
+        self.dispatcher = CheckDispatcher(run, max_workers=1)
+        self.addCleanup(self.dispatcher.shutdown)
+        self.addCleanup(self.release.set)
+
+    def occupy_worker(self):
+        self.dispatcher.submit(create_monitoring_rule(rule_name='running'))
+        self.assertTrue(self.running.wait(5))
+
+    def wait_done(self, count):
+        for _ in range(count):
+            self.assertTrue(self.done.acquire(timeout=5))
+
+    def test_checks_ordered_by_priority_and_deadline(self):
+        self.occupy_worker()
+        self.dispatcher.submit(create_monitoring_rule(
+            rule_name='low', priority=1, deadline_seconds=100,
+        ))
+        self.dispatcher.submit(create_monitoring_rule(
+            rule_name='late', deadline_seconds=100,
+        ))
+        self.dispatcher.submit(create_monitoring_rule(
+            rule_name='soon', deadline_seconds=50,
+        ))
+        self.release.set()
+        self.wait_done(4)
+
+        self.assertEqual(self.started, ['running', 'soon', 'late', 'low'])
+
+    def test_pending_rule_not_queued_again(self):
+        rule = create_monitoring_rule(priority=2)
+        coalesced = DROPPED_CHECKS.labels('2', 'coalesced').value
+        queued = QUEUED_CHECKS.labels('2').value
+
+        self.dispatcher.submit(rule)
+        self.dispatcher.submit(rule)
+        self.dispatcher.submit(rule)
+        self.release.set()
+        self.wait_done(1)
+
+        self.assertEqual(self.started, ['test-rule'])
+        self.assertEqual(
+            DROPPED_CHECKS.labels('2', 'coalesced').value - coalesced, 2,
+        )
+        self.assertEqual(QUEUED_CHECKS.labels('2').value, queued)
+        # checked again once the previous check is done
+        self.dispatcher.submit(rule)
+        self.wait_done(1)
+        self.assertEqual(self.started, ['test-rule', 'test-rule'])
+
+    def test_late_checks_dropped_except_highest_priority(self):
+        expired = DROPPED_CHECKS.labels('1', 'deadline').value
+        delays = CHECK_DELAY.labels('0').count
+        scheduled_at = time.monotonic() - 60
+
+        self.occupy_worker()
+        self.dispatcher.submit(create_monitoring_rule(
+            rule_name='low', priority=1,
+        ), scheduled_at)
+        self.dispatcher.submit(create_monitoring_rule(
+            rule_name='high',
+        ), scheduled_at)
+        self.release.set()
+        self.wait_done(2)
+        # a later check of the dropped rule is queued again
+        self.dispatcher.submit(create_monitoring_rule(
+            rule_name='low', priority=1,
+        ))
+        self.wait_done(1)
+
+        self.assertEqual(self.started, ['running', 'high', 'low'])
+        self.assertEqual(
+            DROPPED_CHECKS.labels('1', 'deadline').value - expired, 1,
+        )
+        self.assertEqual(CHECK_DELAY.labels('0').count - delays, 2)
+
+
+class AdaptiveScheduleTest(unittest.TestCase):
+    schedule = {
+        'interval': {'seconds': 10},
+        'adaptive': {'max_interval': {'minutes': 1}, 'stable_checks': 2},
+    }
+
+    def get_result(self, success=True, latency=0.1):
+        return MonitoringResult(
+            url='http://localhost:8000/test/',
+            http_status=200 if success else 500,
+            latency=latency,
+        )
+
+    def test_interval_backs_off_while_stable(self):
+        interval = AdaptiveInterval(
+            create_monitoring_rule(schedule=self.schedule).schedule,
+        )
+
+        intervals = [interval.update(self.get_result()) for _ in range(8)]
+
+        self.assertEqual(
+            intervals, [10, 20, 20, 40, 40, 60, 60, 60],
+        )
+
+    def test_interval_snaps_back_on_failure_and_latency_change(self):
+        interval = AdaptiveInterval(
+            create_monitoring_rule(schedule=self.schedule).schedule,
+        )
+        for _ in range(4):
+            interval.update(self.get_result())
+
+        self.assertEqual(interval.update(self.get_result(False)), 10)
+        for _ in range(4):
+            interval.update(self.get_result())
+        self.assertEqual(interval.update(self.get_result(latency=0.12)), 40)
+        self.assertEqual(interval.update(self.get_result(latency=1.0)), 10)
+
+    def test_fixed_schedule_not_adaptive(self):
+        with self.assertRaises(ValueError):
+            AdaptiveInterval(create_monitoring_rule().schedule)
+
+    def test_run_monitoring_rule__interval_sent_and_updated(self):
+        initialize_producer(MockedProducer)
+        rule = create_monitoring_rule(schedule=self.schedule)
+        interval = AdaptiveInterval(rule.schedule)
+
+        with mock.patch(
+                'producer.checker._check', return_value=self.get_result(),
+        ):
+            changes = [
+                _run_monitoring_rule(rule, interval) for _ in range(3)
+            ]
+            _run_monitoring_rule(create_monitoring_rule())
+
+        self.assertEqual(changes, [None, 20, None])
+        self.assertEqual(
+            [message.check_interval
+             for _, message in get_producer()._sent_data],
+            [10, 10, 20, 10],
+        )
+
+
+class GeneratorTest(unittest.TestCase):
+    profile = TrafficProfile(
+        rules=10, rate=100, failure_ratio=0.2,
+        burst_interval_seconds=1, burst_seconds=0.5, burst_factor=3,
+    )
+
+    def test_messages_valid_and_rules_checked_in_turn(self):
+        events = SyntheticEvents(self.profile, seed=1)
+        timestamp = datetime.datetime(2020, 12, 13, 10)
+
+        messages = [
+            MonitoredEvent(**message)
+            for message in events.make_messages(1000, timestamp)
+        ]
+
+        self.assertEqual(
+            [message.rule_name for message in messages[:11]],
+            [f'synthetic-{i:06d}' for i in range(10)] + ['synthetic-000000'],
+        )
+        failures = [message for message in messages if not message.success]
+        self.assertAlmostEqual(len(failures) / len(messages), 0.2, delta=0.05)
+        self.assertIn(None, {message.http_status for message in failures})
+        self.assertIn(503, {message.http_status for message in failures})
+        self.assertEqual(messages[0].check_interval, 0.1)
+        self.assertEqual(messages[0].meta.schedule, {
+            'interval': {'seconds': 0.1},
+        })
+
+    def test_generate__bursts_simulated(self):
+        batches = []
+        start = datetime.datetime(2020, 12, 13, 10)
+
+        stats = generate(
+            SyntheticEvents(self.profile), batches.append, 2,
+            start=start, realtime=False,
+        )
+
+        # half of every second is a burst at three times the rate
+        self.assertEqual(stats.events, 400)
+        self.assertEqual(len(batches), 20)
+        self.assertEqual(len(batches[0]), 30)
+        self.assertEqual(len(batches[5]), 10)
+        self.assertEqual(
+            batches[-1][0]['timestamp'],
+            start + datetime.timedelta(seconds=1.9),
+        )
+
+    def test_generate__sent_with_producer(self):
+        initialize_producer(MockedProducer)
+
+        generate(
+            SyntheticEvents(TrafficProfile(rules=2, rate=50)),
+            partial(send_messages, get_producer()), 0.2,
+        )
+
+        self.assertEqual(len(get_producer()._sent_data), 10)
+
+    def test_main__file_written(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'events.jsonl'
+
+            stats = generator_main([
+                '--rules', '5', '--rate', '1000', '--duration', '1',
+                '--file', str(path), '--start', '2020-12-13T10:00',
+            ])
+
+            lines = path.read_text().splitlines()
+        self.assertEqual(stats.events, 1000)
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(
+            MonitoredEvent(**json.loads(lines[0])).timestamp,
+            datetime.datetime(2020, 12, 13, 10),
+        )
+
+
+class ContentMatcherTest(unittest.TestCase):
+
+    def test_required_and_forbidden_patterns(self):
+        matcher = ContentMatcher(
+            required=['Welcome', 'Sign (in|up)'],
+            forbidden=['Internal Server Error', 'Maintenance'],
+        )
+
+        self.assertEqual(
+            matcher.match('Welcome! Sign up'),
+            ContentMatch(('Welcome', 'Sign (in|up)'), True),
+        )
+        self.assertEqual(
+            matcher.match('Sign in. Welcome'),
+            ContentMatch(('Welcome', 'Sign (in|up)'), True),
+        )
+        self.assertEqual(
+            matcher.match('Welcome to Maintenance'),
+            ContentMatch(('Welcome', 'Maintenance'), False),
+        )
+        self.assertEqual(matcher.match(''), ContentMatch((), False))
+        self.assertEqual(ContentMatcher().match('any'), ContentMatch((), True))
+
+    def test_overlapping_matches_found(self):
+        matcher = ContentMatcher(
+            required=['Server', 'Error'],
+            forbidden=['Internal Server Error'],
+        )
+
+        match = matcher.match('500 Internal Server Error')
+
+        self.assertEqual(
+            match.matched, ('Server', 'Error', 'Internal Server Error'),
+        )
+        self.assertFalse(match.is_ok)
+
+    def test_searches_compiled_once(self):
+        matcher = ContentMatcher(required=['a'], forbidden=['b+'])
+        self.assertIsNone(matcher._searches)
+
+        matcher.match('a')
+        searches = matcher.searches
+        matcher.match('b')
+
+        self.assertIs(matcher.searches, searches)
+        self.assertEqual(
+            [search.regex for search in searches], [None, re.compile('b+')],
+        )
+        self.assertFalse(hasattr(matcher, '__dict__'))
+
+    def test_get_required_literal(self):
+        for pattern, literal in [
+            ('Sign (in|up)', ('Sign ', False)),
+            (r'[Ee]rror \d{3}', ('rror ', False)),
+            ('(?i:Bad Gateway)', ('Bad Gateway', True)),
+            ('(?i)x(?-i:AB)', ('AB', False)),
+            ('(ab)+c', ('c', False)),
+            ('(?i)Straße', None),
+            ('a|bc', None),
+        ]:
+            self.assertEqual(get_required_literal(pattern), literal, pattern)
+
+    def test_patterns_prefiltered_by_literals(self):
+        matcher = ContentMatcher(
+            required=['Sign (in|up)'], forbidden=['(?i:bad gateway)'],
+        )
+
+        self.assertEqual(
+            matcher.match('Sign in. BAD Gateway'),
+            ContentMatch(('Sign (in|up)', '(?i:bad gateway)'), False),
+        )
+        self.assertEqual(matcher.match('Sign out'), ContentMatch((), False))
+        # text which is not ASCII is searched by regex alone
+        self.assertEqual(
+            ContentMatcher(required=['(?i:sign)']).match('\u017fign').matched,
+            ('(?i:sign)', ),
         )
 
 
@@ -145,6 +684,24 @@ class SiteCheckerTest(unittest.TestCase):
         self.assertEqual(result.http_status, 200)
         self.assertIsInstance(result.latency, float)
 
+    @responses.activate
+    def test_site_check_content_patterns(self):
+        url = 'http://localhost:8000/test/'
+        rule = create_monitoring_rule(url=url, regex_pattern='Welcome')
+        rule.forbidden_patterns = [re.compile('Error')]
+        responses.add(
+            responses.GET, url, body='Welcome, Error page', status=200,
+        )
+
+        result = SiteChecker(
+            url=rule.url, timeout=rule.timeout,
+            content_matcher=rule.content_matcher,
+        ).run()
+
+        self.assertFalse(result.is_success)
+        self.assertFalse(result.is_regex_ok)
+        self.assertEqual(result.matched_patterns, ('Welcome', 'Error'))
+
     @responses.activate
     def test_site_check_regex_mismatch(self):
         url = 'http://localhost:8000/test/'
@@ -184,6 +741,133 @@ class SiteCheckerTest(unittest.TestCase):
         self.assertEqual(str(result.url), url)
         self.assertIsNone(result.http_status, None)
         self.assertIsNone(result.latency)
+        self.assertEqual(result.error, 'Timeout: timeoit')
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    @responses.activate
+    def test_run_check__metrics(self):
+        initialize_producer(MockedProducer)
+        url = 'http://localhost:8000/test/'
+        responses.add(responses.GET, url, body='OK', status=200)
+        responses.add(responses.GET, url, body='Error', status=500)
+        failures = CHECKS.labels('failure').value
+        successes = CHECKS.labels('success').value
+        sends = SEND_SECONDS.count
+
+        run_check(create_monitoring_rule(url=url))
+        run_check(create_monitoring_rule(url=url))
+
+        self.assertEqual(CHECKS.labels('success').value - successes, 1)
+        self.assertEqual(CHECKS.labels('failure').value - failures, 1)
+        self.assertEqual(SEND_SECONDS.count - sends, 2)
+        self.assertEqual(len(get_producer()._sent_data), 2)
+
+    def test_error_summary_bounded(self):
+        summary = summarize_error(requests.HTTPError('x' * 1000))
+
+        self.assertEqual(len(summary), MAX_ERROR_LENGTH)
+        self.assertTrue(summary.startswith('HTTPError: xxx'))
+
+    def test_result_batch(self):
+        rule = create_monitoring_rule()
+        timestamp = datetime.datetime(2020, 12, 13, 10, 0, 0)
+        results = [
+            MonitoringResult(rule.url, 200, 0.25, True),
+            MonitoringResult(rule.url, error='Timeout: timeout'),
+        ]
+        batch = ResultBatch()
+        for result in results:
+            batch.append(rule, result, timestamp)
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(
+            [
+                (result.http_status, result.latency, result.regex_match,
+                 result.error)
+                for result in (batch.get(0), batch.get(1))
+            ],
+            [(200, 0.25, True, None), (None, None, None, 'Timeout: timeout')],
+        )
+        with mock.patch(
+                'producer.checker.new_event_id', return_value=EVENT_ID,
+        ):
+            self.assertEqual(
+                list(batch.iter_messages())[0],
+                prepare_data_to_report(rule, results[0], timestamp),
+            )
+
+    def test_result_buffer__sent_in_batches(self):
+        initialize_producer(MockedProducer)
+        rule = create_monitoring_rule()
+        result = MonitoringResult(rule.url, 200, 0.25)
+        results = ResultBuffer(max_results=2, max_delay_seconds=60)
+
+        results.append(rule, result)
+        self.assertEqual(get_producer()._sent_data, [])
+        results.append(rule, result, check_interval=20)
+        self.assertEqual(len(get_producer()._sent_data), 2)
+        results.append(rule, result)
+        results.close()
+
+        self.assertEqual(len(results), 0)
         self.assertEqual(
-            result.meta, {'exception': timeout_exception},
+            [message.check_interval
+             for _, message in get_producer()._sent_data],
+            [10, 20, 10],
+        )
+
+    def test_result_buffer__sent_after_delay(self):
+        initialize_producer(MockedProducer)
+        rule = create_monitoring_rule()
+        results = ResultBuffer(max_results=100, max_delay_seconds=0.01)
+        self.addCleanup(results.close)
+
+        with mock.patch(
+                'producer.checker._check',
+                return_value=MonitoringResult(rule.url, 200, 0.25),
+        ):
+            _run_monitoring_rule(rule, results=results)
+        deadline = time.monotonic() + 5
+        while not get_producer()._sent_data and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(len(get_producer()._sent_data), 1)
+
+    @responses.activate
+    def test_run_checks__results_sent(self):
+        initialize_producer(MockedProducer)
+        rules = [
+            create_monitoring_rule(
+                rule_name=f'rule-{i}', url=f'http://localhost:8000/{i}/',
+            )
+            for i in range(3)
+        ]
+        for rule in rules:
+            responses.add(responses.GET, rule.url, body='OK', status=200)
+
+        run_checks(rules, max_workers=2)
+
+        self.assertEqual(
+            [message.rule_name for _, message in get_producer()._sent_data],
+            ['rule-0', 'rule-1', 'rule-2'],
+        )
+
+
+class StartupTest(unittest.TestCase):
+    def test_startup__kafka_not_imported(self):
+        env = dict(
+            os.environ,
+            PRODUCER_IMPLEMENTATION_CLASS='producer.produce.MockedProducer',
+            RULES_YAML_DATA_FILE_PATH='producer/sites.yaml',
         )
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            cwd=Path(__file__).parent.parent, env=env, timeout=30,
+            check=True, capture_output=True,
+        ).stdout
+        imported = json.loads(output)
+
+        self.assertEqual(imported, {
+            'imported_on_import': [],
+            'imported_on_first_check': ['apscheduler'],
+        })
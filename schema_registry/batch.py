@@ -0,0 +1,250 @@
+import datetime
+import json
+import re
+import uuid
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import MissingError
+from pydantic.fields import ModelField, SHAPE_SINGLETON
+
+from schema_registry.base import BasePydanticSchema
+
+
+_IDENTITY_TYPES = (str, int, float, bool, uuid.UUID, )
+_JSON_CONTAINER_TYPES = (dict, list, )
+# subset of formats accepted by pydantic which `datetime.fromisoformat`
+# parses to the same value on all supported python versions
+_SIMPLE_ISO_DATETIME = re.compile(
+    r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{3}|\.\d{6})?'
+)
+_MISSING = object()
+
+
+class RecordBatch:
+    """
+    Columnar batch of validated records of a schema: a list of values per
+    schema field, all columns of the same length. Invalid input messages
+    are reported in `errors` as `(message index, error)` pairs and
+    `nbytes` is the size of raw messages the valid rows were decoded from.
+    """
+
+    def __init__(self,
+                 schema: Type[BasePydanticSchema],
+                 columns: Optional[Dict[str, List]] = None,
+                 errors: Optional[List[Tuple[int, str]]] = None,
+                 nbytes: int = 0,
+                 ):
+        self.schema = schema
+        self.columns: Dict[str, List] = columns or {
+            name: [] for name in schema.__fields__
+        }
+        self.errors: List[Tuple[int, str]] = errors or []
+        self.nbytes = nbytes
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name: str) -> List:
+        return self.columns[name]
+
+    def extend(self, other: 'RecordBatch'):
+        """Append valid rows of `other`, its errors are not carried over."""
+        for name, column in self.columns.items():
+            column.extend(other.columns[name])
+        self.nbytes += other.nbytes
+
+    def chunks(self, size: int) -> Iterator['RecordBatch']:
+        total = len(self)
+        for start in range(0, total, size):
+            stop = min(start + size, total)
+            yield RecordBatch(
+                self.schema,
+                {
+                    name: column[start:stop]
+                    for name, column in self.columns.items()
+                },
+                nbytes=self.nbytes * (stop - start) // total,
+            )
+
+    def take(self, indexes: List[int]) -> 'RecordBatch':
+        """Batch of rows at `indexes`, in the given order."""
+        return RecordBatch(self.schema, {
+            name: [column[index] for index in indexes]
+            for name, column in self.columns.items()
+        })
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+    def to_models(self) -> List[BasePydanticSchema]:
+        """Models built from already validated values, without validation."""
+        return [self.schema.construct(**row) for row in self.rows()]
+
+    @classmethod
+    def from_models(cls,
+                    schema: Type[BasePydanticSchema],
+                    models: List[BasePydanticSchema]) -> 'RecordBatch':
+        return cls(schema, {
+            name: [getattr(model, name) for model in models]
+            for name in schema.__fields__
+        })
+
+
+def _freeze(value: Any) -> Any:
+    """
+    Hashable and type-aware key of a decoded JSON value, so that e.g. `1`
+    and `True` (which are validated differently) never share a key.
+    """
+    if isinstance(value, dict):
+        return dict, tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return list, tuple(_freeze(v) for v in value)
+    return type(value), value
+
+
+def _get_field_validator(
+        schema: Type[BasePydanticSchema],
+        field: ModelField,
+) -> Callable[[Any, bool], Tuple[Any, Any]]:
+    """
+    Validator of a single field with the same semantics as model creation,
+    with shortcuts for the common cases:
+    - values of the exact field type which pydantic would return as is;
+    - simple ISO 8601 datetime strings;
+    - repeated values (urls, rule meta) validated once per batch.
+    """
+    config = schema.__config__
+    is_plain = (
+        field.shape == SHAPE_SINGLETON and
+        not field.class_validators and
+        not field.pre_validators and
+        not field.post_validators
+    )
+    is_datetime = is_plain and field.type_ is datetime.datetime
+    identity_type = None
+    if (is_plain and
+            field.type_ in _IDENTITY_TYPES and
+            not config.anystr_strip_whitespace and
+            not config.anystr_lower and
+            config.min_anystr_length == 0 and
+            config.max_anystr_length is None and
+            getattr(config, 'allow_inf_nan', True)):
+        identity_type = field.type_
+    allow_none = field.allow_none and not field.post_validators
+    cache: Dict[Any, Tuple[Any, Any]] = {}
+
+    def validate(value: Any, from_json: bool) -> Tuple[Any, Any]:
+        if type(value) is identity_type or (value is None and allow_none):
+            return value, None
+        if (is_datetime and type(value) is str and
+                _SIMPLE_ISO_DATETIME.fullmatch(value)):
+            try:
+                return datetime.datetime.fromisoformat(value), None
+            except ValueError:
+                pass
+        try:
+            # repr of decoded JSON is cheaper than freezing and unambiguous
+            if from_json and type(value) in _JSON_CONTAINER_TYPES:
+                key = repr(value)
+            else:
+                key = _freeze(value)
+            return cache[key]
+        except KeyError:
+            result = cache[key] = field.validate(
+                value, {}, loc=field.alias, cls=schema,
+            )
+            return result
+        except TypeError:
+            # unhashable value
+            return field.validate(value, {}, loc=field.alias, cls=schema)
+
+    return validate
+
+
+def _validate_row(schema: Type[BasePydanticSchema],
+                  message: Any) -> Dict[str, Any]:
+    """Full model validation, used for schemas with root validators."""
+    return dict(schema(**message)._iter())
+
+
+def decode_batch(schema: Type[BasePydanticSchema],
+                 messages: List[Any]) -> RecordBatch:
+    """
+    Decode and validate a batch of messages against `schema` directly into
+    a `RecordBatch`.
+
+    Messages are either raw JSON (bytes or str) or already decoded dicts.
+    The result matches creating `schema(**message)` for every message, but
+    without building a model per message. Invalid messages are skipped and
+    reported with their index in `RecordBatch.errors`.
+    """
+    batch = RecordBatch(schema)
+    columns = batch.columns
+    fields = list(schema.__fields__.values())
+    validators = [
+        (field, columns[field.name], _get_field_validator(schema, field))
+        for field in fields
+    ]
+    by_field_name = schema.__config__.allow_population_by_field_name
+    has_root_validators = bool(
+        schema.__pre_root_validators__ or schema.__post_root_validators__
+    )
+    loads = json.loads
+
+    for index, message in enumerate(messages):
+        from_json = isinstance(message, (bytes, str))
+        nbytes = len(message) if from_json else 0
+        try:
+            if isinstance(message, bytes):
+                message = message.decode('utf-8')
+            if from_json:
+                message = loads(message)
+            if not isinstance(message, dict):
+                raise TypeError(
+                    f'Message must be a mapping, got {type(message)}'
+                )
+            if has_root_validators:
+                row = _validate_row(schema, message)
+                for name, column in columns.items():
+                    column.append(row[name])
+                batch.nbytes += nbytes
+                continue
+        except (ValueError, TypeError) as exc:
+            batch.errors.append((index, str(exc)))
+            continue
+
+        values = []
+        row_errors = []
+        for field, _, validate in validators:
+            value = message.get(field.alias, _MISSING)
+            if value is _MISSING and by_field_name:
+                value = message.get(field.name, _MISSING)
+            if value is _MISSING:
+                if field.required:
+                    row_errors.append(ErrorWrapper(
+                        MissingError(), loc=field.alias,
+                    ))
+                    continue
+                values.append(field.get_default())
+                continue
+            value, errors = validate(value, from_json)
+            if errors:
+                row_errors.append(errors)
+            else:
+                values.append(value)
+
+        if row_errors:
+            batch.errors.append(
+                (index, str(ValidationError(row_errors, schema)))
+            )
+            continue
+        for (_, column, _), value in zip(validators, values):
+            column.append(value)
+        batch.nbytes += nbytes
+
+    return batch
@@ -0,0 +1,248 @@
+import bisect
+import logging
+import math
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# seconds, from fast in-memory operations to HTTP checks timing out
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0,
+)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, )
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str],
+                   extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'),
+        )
+        for name, value in pairs
+    )
+    return '{' + escaped + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> '_Metric':
+        """Child metric for label values, created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f'Expected labels {self.labelnames}, got {values}'
+                )
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self) -> '_Metric':
+        return type(self)(self.name, self.documentation)
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}',
+        ]
+        if self.labelnames:
+            for values, child in sorted(self._children.items()):
+                lines += child._render_samples(self.labelnames, values)
+        else:
+            lines += self._render_samples((), ())
+        return lines
+
+    def _render_samples(self, names: Sequence[str],
+                        values: Sequence[str]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def _render_samples(self, names, values):
+        labels = _format_labels(names, values)
+        return [f'{self.name}{labels} {_format_value(self.value)}']
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def _render_samples(self, names, values):
+        labels = _format_labels(names, values)
+        return [f'{self.name}{labels} {_format_value(self.value)}']
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for values above all buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self) -> '_Metric':
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def _render_samples(self, names, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf, ), self.counts):
+            cumulative += count
+            labels = _format_labels(
+                names, values, ('le', _format_value(bound)),
+            )
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(names, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(self.sum)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of a process. Updates are plain in-memory increments under a
+    per-metric lock, formatting only happens when metrics are scraped.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or \
+                        existing.labelnames != metric.labelnames or \
+                        getattr(existing, 'buckets', None) != \
+                        getattr(metric, 'buckets', None):
+                    raise ValueError(
+                        f'Metric {metric.name} is already registered'
+                    )
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str,
+                labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(  # type: ignore
+            Counter(name, documentation, labelnames),
+        )
+
+    def gauge(self, name: str, documentation: str,
+              labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(  # type: ignore
+            Gauge(name, documentation, labelnames),
+        )
+
+    def histogram(self, name: str, documentation: str,
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(  # type: ignore
+            Histogram(name, documentation, labelnames, buckets),
+        )
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve `/metrics` of the registry from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name='metrics', daemon=True,
+    )
+    thread.start()
+    logger.info('Serving metrics on %s:%s', host, port)
+    return server
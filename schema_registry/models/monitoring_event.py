@@ -1,6 +1,7 @@
 import datetime
+import uuid
 
-from typing import Optional, Pattern
+from typing import List, Optional, Pattern
 
 from pydantic import AnyHttpUrl
 
@@ -17,9 +18,13 @@ class RuleMeta(BasePydanticSchema):
     schedule: Optional[dict]
     timeout: Optional[float]
     regex_pattern: Optional[Pattern] = None
+    required_patterns: Optional[List[Pattern]] = None
+    forbidden_patterns: Optional[List[Pattern]] = None
 
 
 class MonitoredEvent(BaseMonitoredEvent):
+    # assigned by the producer, so redelivered events are written once
+    event_id: Optional[uuid.UUID] = None
     url: AnyHttpUrl
     rule_name: str
     timestamp: datetime.datetime
@@ -27,6 +32,9 @@ class MonitoredEvent(BaseMonitoredEvent):
     http_status: Optional[int]
     success: Optional[bool]
     regex_match: Optional[bool]
+    # seconds between checks of the rule when it was checked, they vary
+    # for adaptive schedules
+    check_interval: Optional[float] = None
 
     meta: RuleMeta
 
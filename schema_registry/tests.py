@@ -1,3 +1,33 @@
+import datetime
+import json
+import unittest
+import uuid
+import urllib.request
+
+from unittest import mock
+
+from pydantic import ValidationError
+
+from schema_registry.batch import decode_batch
+from schema_registry.metrics import MetricsRegistry, registry, \
+    start_metrics_server
+from schema_registry.models import MonitoredEvent
+from schema_registry.utils import AggregatedErrorLogger, new_event_id, \
+    pydantic_to_json_serializer
+
+
+def get_fake_payload() -> dict:
+    return dict(
+        url='http://localhost',
+        rule_name='fake-rule',
+        meta={'timeout': 10, 'schedule': {'interval': {'seconds': 10}}},
+        timestamp=datetime.datetime(2020, 12, 13, 10, 0, 0),
+        latency=0.25,
+        http_status=200,
+        success=True,
+    )
+
+
 # TODO: add unit tests
 
 # class SchemaRegistryTest(unittest.TestCase):
@@ -23,3 +53,220 @@
 #
 #     def test_json_to_dict__error__returns_None(self):
 #         pass
+
+
+class BatchDecodeTest(unittest.TestCase):
+
+    def assertSameAsModels(self, messages):
+        batch = decode_batch(MonitoredEvent, messages)
+
+        expected, expected_errors = [], []
+        for index, message in enumerate(messages):
+            if isinstance(message, bytes):
+                message = json.loads(message)
+            try:
+                expected.append(MonitoredEvent(**message))
+            except (ValidationError, TypeError):
+                expected_errors.append(index)
+        self.assertEqual(batch.to_models(), expected)
+        self.assertEqual(
+            [index for index, _ in batch.errors], expected_errors,
+        )
+        return batch
+
+    def test_decode_batch__raw_and_decoded_messages(self):
+        event = MonitoredEvent(**get_fake_payload())
+
+        batch = self.assertSameAsModels([
+            pydantic_to_json_serializer(event),
+            pydantic_to_json_serializer(event),
+            get_fake_payload(),
+        ])
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch['rule_name'], ['fake-rule'] * 3)
+        self.assertEqual(batch['latency'], [0.25] * 3)
+        self.assertIs(batch['meta'][0], batch['meta'][1])
+
+    def test_decode_batch__coercion_matches_pydantic(self):
+        payload = get_fake_payload()
+        self.assertSameAsModels([
+            json.dumps(dict(
+                payload, timestamp=timestamp, latency=1,
+                http_status='200', success='yes', rule_name=5,
+            )).encode('utf-8')
+            for timestamp in (
+                '2020-12-13T10:00:00', '2020-12-13T10:00:00.123',
+                '2020-12-13T10:00:00.5', '2020-12-13T10:00:00Z',
+                '2020-12-13 10:00', 1607853600,
+            )
+        ] + [
+            dict(payload, http_status=True, success=1),
+        ])
+
+    def test_decode_batch__invalid_messages_reported(self):
+        payload = get_fake_payload()
+        batch = self.assertSameAsModels([
+            dict(payload, url='ftp://localhost'),
+            dict(payload, timestamp='2020-13-13T10:00:00'),
+            {'rule_name': 'fake-rule'},
+            dict(payload, http_status='OK', latency='slow'),
+            get_fake_payload(),
+        ])
+        self.assertIn('http_status', batch.errors[-1][1])
+        self.assertIn('latency', batch.errors[-1][1])
+
+        batch = decode_batch(
+            MonitoredEvent, [b'{not json', b'[1, 2]', b'\xff', ],
+        )
+        self.assertEqual(len(batch), 0)
+        self.assertEqual([index for index, _ in batch.errors], [0, 1, 2])
+
+    def test_decode_batch__event_ids(self):
+        event_id = new_event_id()
+        event = MonitoredEvent(**dict(get_fake_payload(), event_id=event_id))
+
+        batch = self.assertSameAsModels([
+            pydantic_to_json_serializer(event),
+            dict(get_fake_payload(), event_id=event_id),
+            get_fake_payload(),
+        ])
+
+        self.assertEqual(batch['event_id'], [event_id, event_id, None])
+
+
+class EventIdTest(unittest.TestCase):
+
+    def test_new_event_id__unique_and_time_ordered(self):
+        with mock.patch('time.time_ns', return_value=1607853600 * 10 ** 9):
+            first, second = new_event_id(), new_event_id()
+        with mock.patch(
+                'time.time_ns', return_value=1607853601 * 10 ** 9,
+        ):
+            third = new_event_id()
+
+        self.assertNotEqual(first, second)
+        self.assertLess(max(first, second), third)
+        self.assertEqual(first.version, 7)
+        self.assertEqual(first.variant, uuid.RFC_4122)
+        self.assertEqual(third.int >> 80, 1607853601000)
+
+
+class JSONSerializerTest(unittest.TestCase):
+
+    def test_pydantic_to_json_serializer__pattern_round_trip(self):
+        payload = get_fake_payload()
+        payload['meta']['regex_pattern'] = 'Try (Now For )?Free'
+        event = MonitoredEvent(**payload)
+
+        serialized = pydantic_to_json_serializer(event)
+
+        self.assertEqual(
+            json.loads(serialized)['meta']['regex_pattern'],
+            'Try (Now For )?Free',
+        )
+        self.assertEqual(
+            MonitoredEvent.parse_raw(serialized).meta.regex_pattern,
+            event.meta.regex_pattern,
+        )
+
+
+class AggregatedErrorLoggerTest(unittest.TestCase):
+
+    @mock.patch('schema_registry.utils.time.monotonic')
+    def test_errors_logged_once_per_interval(self, time_mock):
+        logger_mock = mock.MagicMock()
+        errors = AggregatedErrorLogger(logger_mock, 'Bad messages', 10)
+
+        time_mock.return_value = 100.0
+        errors.add('first')
+        errors.add('second', count=5)
+        time_mock.return_value = 105.0
+        errors.add('third')
+        errors.maybe_log()
+        self.assertEqual(logger_mock.warning.call_count, 1)
+
+        time_mock.return_value = 110.0
+        errors.maybe_log()
+        errors.maybe_log()
+
+        self.assertEqual(
+            logger_mock.warning.call_args_list,
+            [
+                mock.call(
+                    '%s: %s error(s), last error: %s',
+                    'Bad messages', 1, 'first',
+                ),
+                mock.call(
+                    '%s: %s error(s), last error: %s',
+                    'Bad messages', 6, 'third',
+                ),
+            ],
+        )
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_render(self):
+        metrics = MetricsRegistry()
+        checks = metrics.counter('checks_total', 'Checks', ('result', ))
+        latency = metrics.histogram(
+            'latency_seconds', 'Latency', buckets=(0.1, 1),
+        )
+
+        checks.labels('success').inc()
+        checks.labels('success').inc(2)
+        checks.labels('fail"ure').inc()
+        for value in (0.05, 0.5, 5):
+            latency.observe(value)
+        metrics.gauge('lag', 'Lag').set(7)
+
+        self.assertIs(
+            metrics.counter('checks_total', 'Checks', ('result', )), checks,
+        )
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# HELP checks_total Checks',
+            '# TYPE checks_total counter',
+            'checks_total{result="fail\\"ure"} 1.0',
+            'checks_total{result="success"} 3.0',
+            '# HELP lag Lag',
+            '# TYPE lag gauge',
+            'lag 7.0',
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            'latency_seconds_sum 5.55',
+            'latency_seconds_count 3',
+        ]) + '\n')
+        with self.assertRaises(ValueError):
+            metrics.gauge('checks_total', 'Checks')
+
+    def test_register__same_name(self):
+        metrics = MetricsRegistry()
+        counter = metrics.counter('events_total', 'Events', ('rule', ))
+
+        self.assertIs(
+            metrics.counter('events_total', 'Events', ('rule', )), counter,
+        )
+        with self.assertRaises(ValueError):
+            metrics.counter('events_total', 'Events', ('url', ))
+        with self.assertRaises(ValueError):
+            metrics.gauge('events_total', 'Events', ('rule', ))
+        metrics.histogram('seconds', 'Seconds', buckets=(1, 2))
+        with self.assertRaises(ValueError):
+            metrics.histogram('seconds', 'Seconds', buckets=(1, 5))
+
+    def test_metrics_endpoint(self):
+        registry.counter('test_endpoint_total', 'Test').inc()
+        server = start_metrics_server('127.0.0.1', 0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(
+                server.server_address[1],
+        )) as response:
+            body = response.read().decode('utf-8')
+
+        self.assertIn('test_endpoint_total 1.0\n', body)
@@ -2,7 +2,9 @@ import datetime
 import decimal
 import json
 import logging
+import os
 import re
+import time
 import uuid
 
 from typing import Optional
@@ -25,6 +27,34 @@ def is_aware(value):
         value) is not None
 
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_epoch_microseconds(value: datetime.datetime) -> int:
+    """Aware datetimes are converted to UTC, naive ones are taken as is."""
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_microseconds(value: int) -> datetime.datetime:
+    return _EPOCH + value * _MICROSECOND
+
+
+def new_event_id() -> uuid.UUID:
+    """
+    Random UUID prefixed by the current time in milliseconds (the UUIDv7
+    layout), so ids written together are close in an index.
+    """
+    value = time.time_ns() // 1000000 << 80 | \
+        int.from_bytes(os.urandom(10), 'big')
+    # version 7 and RFC 4122 variant bits
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return uuid.UUID(int=value)
+
+
 class JSONEncoder(json.JSONEncoder):
     """
     JSONEncoder subclass that knows how to encode date/time,
@@ -54,11 +84,51 @@ class JSONEncoder(json.JSONEncoder):
         elif isinstance(o, uuid.UUID):
             return str(o)
         elif isinstance(o, re.Pattern):
-            return str(o)
+            return o.pattern
+        elif isinstance(o, BaseModel):
+            return o.dict()
         else:
             return super(JSONEncoder, self).default(o)
 
 
+class AggregatedErrorLogger:
+    """
+    Logs a summary of errors (their count and the last error) at most once
+    per `interval_seconds` instead of a record with traceback per error,
+    so a burst of bad messages costs about as much as a single one.
+    """
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 message: str,
+                 interval_seconds: float = 10.0):
+        self._logger = logger
+        self._message = message
+        self._interval_seconds = interval_seconds
+        self._count = 0
+        self._last_error: Optional[str] = None
+        self._logged_at = float('-inf')
+
+    def add(self, error: str, count: int = 1):
+        self._count += count
+        self._last_error = error
+        self.maybe_log()
+
+    def maybe_log(self):
+        now = time.monotonic()
+        if not self._count or now - self._logged_at < self._interval_seconds:
+            return
+        self._logger.warning(
+            '%s: %s error(s), last error: %s',
+            self._message, self._count, self._last_error,
+        )
+        self._count = 0
+        self._logged_at = now
+
+
+_decode_errors = AggregatedErrorLogger(logger, 'Unable to decode messages')
+
+
 def pydantic_to_json_serializer(obj: BaseModel) -> bytes:
     return json.dumps(obj.dict(), cls=JSONEncoder).encode('utf-8')
 
@@ -66,6 +136,6 @@ def pydantic_to_json_serializer(obj: BaseModel) -> bytes:
 def json_to_dict(obj: bytes) -> Optional[dict]:
     try:
         return json.loads(obj.decode('utf-8'))
-    except json.decoder.JSONDecodeError:
-        logger.exception('Unable to decode: %s', obj)
+    except json.decoder.JSONDecodeError as exc:
+        _decode_errors.add(str(exc))
         return None